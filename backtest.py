@@ -0,0 +1,223 @@
+"""
+Vectorized backtests of rebalancing strategies on the aligned (date x ticker) price matrix.
+A strategy holds target weights that are set on the rebalancing dates and drift with the prices in between. Instead
+of stepping through the days position by position, the weights and the prices of the last rebalancing are spread
+over the dates of their period, so the value of the portfolio, its returns, the turnover and the trading costs are
+computed for all dates and tickers at once.
+The weights either come from an equal-weighted portfolio of all tickers or from ranking the tickers by a signal, e.g.
+the E/P ratio of fundamental_ratios followed over time. Parameter grids are split into chunks that run in the process
+pool of the executor.
+"""
+
+import itertools
+import numpy as np
+import pandas as pd
+from . import executor as ex
+from . import tracing
+from .portfolio import TRADING_DAYS
+
+
+FREQUENCIES = {"W": "Weekly", "M": "Monthly", "Q": "Quarterly", "Y": "Yearly"}
+COST_BPS = 10  # Trading costs in basis points of the traded value.
+REPORTING_LAG = 45  # Days after the end of a quarter until its filing is assumed to be public.
+
+
+def rebalance_dates(index, frequency="M"):
+    """
+    :param index: DatetimeIndex of the price matrix.
+    :param frequency: (Default value = "M") One of FREQUENCIES, the portfolio is rebalanced on the first trading day
+        of every period.
+    :return: Boolean array, True on the rebalancing dates.
+    """
+    periods = index.to_period(frequency).asi8
+
+    return np.r_[True, periods[1:] != periods[:-1]] if len(periods) else np.empty(0, dtype=bool)
+
+
+def equal_weights(price_matrix):
+    """
+    :return: DataFrame of the same shape as price_matrix, on every date all tickers with a price have the same weight.
+    """
+    available = price_matrix.notna()
+
+    return available.div(available.sum(axis=1).replace(0, np.nan), axis=0).fillna(0.0)
+
+
+def top_weights(signal, count):
+    """
+    Invests equally into the count tickers with the highest signal on every date.
+    :param signal: DataFrame (date x ticker) of scores, higher is better, NaN is never selected.
+    :param count: Number of tickers to hold.
+    :return: DataFrame of the weights of the same shape as signal.
+    """
+    selected = signal.rank(axis=1, ascending=False, method="first") <= count
+
+    return selected.div(selected.sum(axis=1).replace(0, np.nan), axis=0).fillna(0.0)
+
+
+def ep_signal(stocks, price_matrix, lag=REPORTING_LAG):
+    """
+    Follows the E/P ratio of fundamental_ratios.ep_ratio over time: the earnings per share of the trailing four
+    quarters divided by the daily closing price. Sums over a missing quarter are left out, the earnings known before
+    are used until the next complete year. The earnings of a quarter are only used lag days after its end, so
+    that the backtest does not look ahead.
+    :param stocks: Dictionary ticker -> loaded fundamental_ratios.Stock.
+    :param price_matrix: DataFrame of closing prices with one column per ticker.
+    :param lag: (Default value = REPORTING_LAG) Days until the filing of a quarter is public.
+    :return: DataFrame (date x ticker) of the E/P ratios, NaN where no earnings are known yet.
+    """
+    earnings = {}
+    for ticker in price_matrix.columns:
+        stock = stocks.get(ticker)
+        if stock is None or stock.fundamentals_index is None:
+            continue
+        ttm = stock.fundamentals_index.ttm_history("Basic Earnings Per Share")
+        if len(ttm):
+            earnings[ticker] = ttm.set_axis(ttm.index + pd.Timedelta(days=lag))
+
+    if not earnings:
+        return pd.DataFrame(np.nan, index=price_matrix.index, columns=price_matrix.columns)
+
+    # The most recent known earnings on every trading day.
+    earnings = pd.concat(earnings, axis=1).sort_index()
+    earnings = earnings.reindex(earnings.index.union(price_matrix.index)).ffill().reindex(price_matrix.index)
+
+    return earnings.reindex(columns=price_matrix.columns) / price_matrix
+
+
+def simulate(price_matrix, target_weights, rebalance, cost_bps=COST_BPS):
+    """
+    Runs a strategy that trades to the target weights at the close of the rebalancing dates. Weights that do not sum
+    to 1 leave the rest in cash.
+    :param price_matrix: DataFrame of closing prices with one column per ticker.
+    :param target_weights: DataFrame of the weights of the same shape, only the rows of the rebalancing dates are used.
+    :param rebalance: Boolean array of the rebalancing dates, see rebalance_dates.
+    :param cost_bps: (Default value = COST_BPS) Trading costs in basis points of the traded value.
+    :return: DataFrame indexed by the dates with the columns "Equity" (starting at 1), "Return" (after costs),
+        "Turnover" (traded value as fraction of the portfolio) and "Costs" (as fraction of the portfolio).
+    """
+    prices = price_matrix.ffill().to_numpy(dtype=np.float64)
+    targets = np.nan_to_num(target_weights.reindex_like(price_matrix).to_numpy(dtype=np.float64))
+    rebalance = np.asarray(rebalance, dtype=bool).copy()
+    dates = len(prices)
+    if dates == 0:
+        return pd.DataFrame(columns=["Equity", "Return", "Turnover", "Costs"], dtype=np.float64)
+    rebalance[0] = True  # The portfolio is bought on the first date.
+
+    # Row of the last rebalancing before every date, -1 before the first one.
+    positions = np.arange(dates)
+    latest = np.maximum.accumulate(np.where(rebalance, positions, -1))
+    previous = np.r_[-1, latest[:-1]]
+    invested = previous >= 0
+
+    # Weights and prices of the period every date belongs to and the growth of the portfolio since its start.
+    weights = np.where(invested[:, None], targets[previous], 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        relative = np.nan_to_num(prices / prices[previous], nan=1.0, posinf=1.0)
+    holdings = weights * relative
+    growth = 1.0 - weights.sum(axis=1) + holdings.sum(axis=1)
+
+    # The growth restarts at 1 after every rebalancing.
+    growth_before = np.where(previous == np.r_[-1, previous[:-1]], np.r_[1.0, growth[:-1]], 1.0)
+    returns = growth / growth_before - 1.0
+
+    # Turnover between the drifted weights before the trade and the new targets.
+    drifted = np.where(invested[:, None], holdings / growth[:, None], 0.0)
+    turnover = np.where(rebalance, np.abs(targets - drifted).sum(axis=1), 0.0)
+    costs = turnover * cost_bps / 10_000
+    net_returns = (1.0 + returns) * (1.0 - costs) - 1.0
+
+    return pd.DataFrame({"Equity": np.cumprod(1.0 + net_returns),
+                         "Return": net_returns,
+                         "Turnover": turnover,
+                         "Costs": costs}, index=price_matrix.index)
+
+
+def summarize(result, risk_free_rate=0.0538):
+    """
+    :param result: Output of simulate.
+    :param risk_free_rate: 53 Weeks T-Bill rate as of 2023-09-05
+    :return: Dictionary with the total return, the annual return (CAGR), volatility and sharpe ratio, the maximum
+        drawdown and the annual turnover and costs.
+    """
+    if len(result) < 2:
+        return {}
+    equity = result["Equity"]
+    years = (len(result) - 1) / TRADING_DAYS
+    annual_return = equity.iloc[-1] ** (1 / years) - 1
+    volatility = result["Return"].iloc[1:].std() * np.sqrt(TRADING_DAYS)
+
+    return {"Total return": equity.iloc[-1] - 1,
+            "Annual return": annual_return,
+            "Volatility": volatility,
+            "Sharpe ratio": (annual_return - risk_free_rate) / volatility if volatility else np.nan,
+            "Max drawdown": (1 - equity / equity.cummax()).max(),
+            "Turnover": result["Turnover"].sum() / years,
+            "Costs": result["Costs"].sum() / years}
+
+
+def backtest(price_matrix, frequency="M", signal=None, count=None, cost_bps=COST_BPS):
+    """
+    Backtests one strategy.
+    :param price_matrix: DataFrame of closing prices with one column per ticker.
+    :param frequency: (Default value = "M") Rebalancing frequency, one of FREQUENCIES.
+    :param signal: (Default value = None) DataFrame (date x ticker) of scores to hold the count best tickers of, all
+        tickers are held with the same weight if None.
+    :param count: (Default value = None) Number of tickers to hold, half of the tickers if None.
+    :param cost_bps: (Default value = COST_BPS) Trading costs in basis points of the traded value.
+    :return: Output of simulate.
+    """
+    if frequency not in FREQUENCIES:
+        raise Exception(f"Unknown rebalancing frequency {frequency}")
+    if signal is None:
+        weights = equal_weights(price_matrix)
+    else:
+        count = max(1, price_matrix.shape[1] // 2) if count is None else count
+        # Only tickers with a price can be bought.
+        weights = top_weights(signal.reindex_like(price_matrix).where(price_matrix.notna()), count)
+
+    return simulate(price_matrix, weights, rebalance_dates(price_matrix.index, frequency), cost_bps)
+
+
+def _run_chunk(price_matrix, signals, runs):
+    # Runs a chunk of the grid in a worker process, the prices and signals are only sent once per chunk.
+    return {label: backtest(price_matrix, signal=signals.get(parameters.get("signal")),
+                            **{name: value for name, value in parameters.items() if name != "signal"})
+            for label, parameters in runs}
+
+
+def label_of(parameters):
+    """
+    :return: Name of a run of the grid, e.g. "signal=E/P, frequency=M, count=5".
+    """
+    return ", ".join(f"{name}={value}" for name, value in parameters.items())
+
+
+@tracing.traced("backtest")
+def sweep(price_matrix, grid, signals=None, chunks=None):
+    """
+    Backtests every combination of the parameters of a grid in parallel.
+    :param price_matrix: DataFrame of closing prices with one column per ticker.
+    :param grid: Dictionary parameter -> list of values with the parameters of backtest ("frequency", "count",
+        "cost_bps") and "signal", the name of a signal in signals. Names without a signal are held with equal weights.
+    :param signals: (Default value = None) Dictionary name -> DataFrame (date x ticker) of scores.
+    :param chunks: (Default value = None) Number of tasks the grid is split into, one per worker if None.
+    :return: Dictionary with the dictionary "results" label -> output of simulate and the DataFrame "summary" with
+        one row per label, see summarize. Runs that failed are left out.
+    """
+    signals = signals or {}
+    names = list(grid)
+    runs = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    runs = [(label_of(parameters), parameters) for parameters in runs]
+
+    chunks = min(len(runs), chunks or ex.CPU_WORKERS)
+    tasks = {number: (_run_chunk, (price_matrix, signals, runs[number::chunks])) for number in range(chunks)}
+    results = {}
+    for chunk in ex.run_tasks(tasks, cpu=True).values():
+        results.update(chunk)
+
+    # In the order of the grid.
+    results = {label: results[label] for label, _ in runs if label in results}
+    summary = pd.DataFrame({label: summarize(result) for label, result in results.items()}).T
+
+    return {"results": results, "summary": summary}
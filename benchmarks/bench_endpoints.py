@@ -0,0 +1,155 @@
+"""
+End-to-end benchmark of the entry points of the application against the local stand-in for Polygon.io.
+For 1, 10, 100 and 1,000 tickers it reports the wall time, the number of HTTP calls and the peak memory of
+Asset.get_prices, get_fundamentals and the Dash callbacks that fire on a click of "Submit", on their own and all of
+them together as one submission. The callbacks are called directly without a browser.
+Every run starts with an empty response cache. The peak memory is measured with tracemalloc in a separate run, so
+that the tracing does not distort the wall time.
+
+Run it from the folder containing the package:
+
+    python -m equity-explorer.benchmarks.bench_endpoints --latency 0.02 --sizes 1 10 100
+
+The results can be written to a JSON file with --json, to compare them before and after a change.
+"""
+
+import argparse
+import json
+import threading
+import time
+import tracemalloc
+from .fake_polygon import FakePolygon
+from .. import executor as ex
+from .. import fundamental_data as f
+from .. import http_client
+from ..cache import response_cache
+from ..price_data import Asset
+
+
+API_KEY = "benchmark"
+SIZES = (1, 10, 100, 1000)
+
+
+def _dashboard():
+    # The callbacks are defined in the dashboard module, importing it does not build the app or the layout.
+    from .. import dashboard
+    dashboard.key = API_KEY
+
+    return dashboard
+
+
+def _load_each(load, tickers):
+    # The data of the tickers is loaded concurrently, as the application does for a submission.
+    return ex.run_tasks({ticker: (load, (ticker,)) for ticker in tickers})
+
+
+def submission_callbacks(dashboard):
+    """
+    :return: Dictionary name -> function that takes the text of the search field and runs the callback as a click of
+        "Submit" does, with the default values of the other inputs.
+    """
+    return {
+        "update_ratio_table": lambda text: dashboard.update_ratio_table(1, text),
+        "update_quant_table": lambda text: dashboard.update_quant_table(1, text),
+        "update_graph": lambda text: dashboard.update_graph(1, text),
+        "update_rolling_graph": lambda text: dashboard.update_rolling_graph(1, "Beta", dashboard.qr.ROLLING_WINDOWS[0],
+                                                                            text),
+        "update_risk_graph": lambda text: dashboard.update_risk_graph(1, text),
+        "update_portfolio": lambda text: dashboard.update_portfolio(1, text),
+        "update_backtest": lambda text: dashboard.update_backtest(1, text),
+        "update_hist": lambda text: dashboard.update_hist(1, text),
+    }
+
+
+def entry_points():
+    """
+    :return: Dictionary name -> function that takes the list of tickers.
+    """
+    callbacks = submission_callbacks(_dashboard())
+
+    def submission(tickers):
+        # All callbacks of submission_callbacks fire on the same click and run in parallel threads of the Dash server.
+        text = " ".join(tickers)
+        threads = [threading.Thread(target=callback, args=(text,)) for callback in callbacks.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_callback(callback):
+        return lambda tickers: callback(" ".join(tickers))
+
+    return {
+        "get_prices": lambda tickers: _load_each(lambda ticker: Asset(API_KEY, ticker, "Stock").get_prices(),
+                                                 tickers),
+        "get_fundamentals": lambda tickers: _load_each(lambda ticker: f.get_fundamentals(API_KEY, ticker,
+                                                                                         aggregate=True),
+                                                       tickers),
+        **{name: run_callback(callback) for name, callback in callbacks.items()},
+        "submission": submission,
+    }
+
+
+def run_once(server, func, tickers, trace_memory=False):
+    """
+    Runs func with an empty cache.
+    :return: (wall time in seconds, HTTP calls per endpoint, peak memory in bytes or None)
+    """
+    response_cache.clear()
+    server.reset()
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    func(tickers)
+    wall_time = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return wall_time, dict(server.calls), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark against a local stand-in for Polygon.io.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="Numbers of tickers.")
+    parser.add_argument("--entries", nargs="+", default=None, help="Entry points to run, all if not given.")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds every response is delayed.")
+    parser.add_argument("--rate-limit", type=int, default=None, help="Requests the server answers per second.")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the run that measures the peak memory.")
+    parser.add_argument("--json", default=None, help="Write the results to this file.")
+    arguments = parser.parse_args()
+
+    server = FakePolygon(latency=arguments.latency, requests_per_second=arguments.rate_limit).start()
+    http_client.API_URL = server.url
+
+    entries = entry_points()
+    names = arguments.entries or list(entries)
+    results = []
+    print(f"{'entry point':<20} {'tickers':>8} {'wall [s]':>10} {'calls':>7} {'peak [MiB]':>11}  calls per endpoint")
+    try:
+        for name in names:
+            for size in arguments.sizes:
+                tickers = [f"T{number}" for number in range(size)]
+                wall_time, calls, _ = run_once(server, entries[name], tickers)
+                peak = None
+                if not arguments.no_memory:
+                    peak = run_once(server, entries[name], tickers, trace_memory=True)[2]
+
+                results.append({"entry": name, "tickers": size, "wall_time": wall_time,
+                                "calls": sum(calls.values()), "calls_per_endpoint": calls, "peak_bytes": peak})
+                peak_text = "-" if peak is None else f"{peak / 2 ** 20:.1f}"
+                endpoints = ", ".join(f"{endpoint}={count}" for endpoint, count in sorted(calls.items()))
+                print(f"{name:<20} {size:>8} {wall_time:>10.3f} {sum(calls.values()):>7} {peak_text:>11}  "
+                      f"{endpoints}")
+    finally:
+        server.stop()
+
+    if arguments.json:
+        with open(arguments.json, "w") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
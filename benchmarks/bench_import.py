@@ -0,0 +1,74 @@
+"""
+Benchmark of the time it takes to import the modules of the package, e.g. for command line use, cron jobs or worker
+processes that only fetch data and compute ratios.
+Every module is imported in a fresh interpreter, so that nothing is cached between the measurements, and the heavy
+dependencies (Dash, Plotly, statsmodels, scipy) the import loaded are listed. The start of the interpreter itself is
+not counted.
+
+Run it from the folder containing the package:
+
+    python -m equity-explorer.benchmarks.bench_import --repeat 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+PACKAGE = __package__.rsplit(".", 1)[0]
+MODULES = ("price_data", "fundamental_data", "fundamental_ratios", "quant_ratios", "dataset", "portfolio",
+           "risk_simulation", "backtest", "report", "__main__", "dashboard")
+HEAVY = ("dash", "dash_bootstrap_components", "plotly", "statsmodels", "scipy")
+
+# Runs in the fresh interpreter and prints the import time in seconds and the heavy dependencies it loaded.
+_MEASURE = """
+import importlib, json, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, [name for name in sys.argv[2:] if name in sys.modules]]))
+"""
+
+
+def measure(module, repeat=5):
+    """
+    Imports a module of the package repeat times, each time in a new interpreter.
+    :return: Tuple (median import time in seconds, heavy dependencies that were loaded).
+    """
+    # The folder containing the package, so that it can be imported by its name.
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    timings = []
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", _MEASURE, f"{PACKAGE}.{module}", *HEAVY], cwd=root,
+                                capture_output=True, text=True, check=True).stdout
+        seconds, loaded = json.loads(output.strip().splitlines()[-1])
+        timings.append(seconds)
+
+    return statistics.median(timings), loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time of the modules of the package.")
+    parser.add_argument("--modules", nargs="+", default=list(MODULES), help="Modules to import, all if not given.")
+    parser.add_argument("--repeat", type=int, default=5, help="Imports per module, the median is reported.")
+    parser.add_argument("--json", default=None, help="Write the results to this file.")
+    arguments = parser.parse_args()
+
+    results = []
+    print(f"{'module':<20} {'import [ms]':>12}  heavy dependencies loaded")
+    for module in arguments.modules:
+        seconds, loaded = measure(module, arguments.repeat)
+        results.append({"module": module, "seconds": seconds, "loaded": loaded})
+        print(f"{module:<20} {seconds * 1000:>12.1f}  {', '.join(loaded) or '-'}")
+
+    if arguments.json:
+        with open(arguments.json, "w") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
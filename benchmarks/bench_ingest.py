@@ -0,0 +1,66 @@
+"""
+Benchmark of the conversion of aggregates responses into DataFrames.
+Compares the columnar ingest of price_data with the previous row-by-row conversion on synthetic minute bars.
+
+Run it from the folder containing the package:
+
+    python -m equity-explorer.benchmarks.bench_ingest
+"""
+
+import json
+import time
+import numpy as np
+import pandas as pd
+from ..price_data import _to_frame
+
+
+def synthetic_response(count, seed=0):
+    """
+    Builds the body of an aggregates response with count minute bars, sorted ascending.
+    """
+    rng = np.random.default_rng(seed)
+    close = 100 * np.cumprod(1 + rng.normal(0, 0.001, count))
+    start = int(pd.Timestamp("2023-01-03 14:30").value // 1_000_000)
+    bars = [{"v": float(volume), "vw": round(price, 4), "o": round(price, 4), "c": round(price, 4),
+             "h": round(price * 1.001, 4), "l": round(price * 0.999, 4), "t": start + 60_000 * number,
+             "n": int(volume // 100)}
+            for number, (price, volume) in enumerate(zip(close, rng.integers(100, 100_000, count)))]
+
+    return json.dumps({"ticker": "AAPL", "status": "OK", "resultsCount": count, "results": bars})
+
+
+def legacy_to_frame(response):
+    # The conversion used before the columnar ingest, kept for comparison.
+    data = pd.DataFrame(json.loads(response)["results"])
+    data["t"] = data["t"].apply(lambda x: pd.to_datetime(x, unit="ms"))
+    data = data.set_index("t")
+    data.sort_index(inplace=True)
+
+    return data
+
+
+def measure(func, *args, repeat=3):
+    """
+    :return: The best wall time of repeat calls in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main():
+    print(f"{'bars':>10} {'legacy [s]':>12} {'columnar [s]':>14} {'float32 [s]':>13} {'speedup':>9}")
+    for count in (1_000, 10_000, 100_000, 400_000):
+        response = synthetic_response(count)
+        legacy = measure(legacy_to_frame, response)
+        columnar = measure(_to_frame, response)
+        columnar_float32 = measure(_to_frame, response, "float32")
+        print(f"{count:>10} {legacy:>12.4f} {columnar:>14.4f} {columnar_float32:>13.4f} {legacy / columnar:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+Local stand-in for the Polygon.io API, used by the benchmarks to measure the application without a live API key.
+It serves synthetic (or recorded) responses for the endpoints the application uses: aggregates, grouped daily bars,
+financials, ticker details and dividends. The latency of every response and a rate limit can be configured, and
+every request is counted per endpoint.
+
+Start it from Python and point the application to it:
+
+    server = FakePolygon(latency=0.02).start()
+    http_client.API_URL = server.url
+
+Or run it on its own and set the environment variable "POLYGON_API_URL" to the printed address:
+
+    python -m equity-explorer.benchmarks.fake_polygon --port 8765 --latency 0.02
+"""
+
+import argparse
+import collections
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from .. import http_client
+
+
+AGGREGATES = re.compile(r"^/v2/aggs/ticker/(?P<ticker>[^/]+)/range/(?P<multiplier>\d+)/(?P<timespan>\w+)/"
+                        r"(?P<start>[\d-]+)/(?P<end>[\d-]+)$")
+GROUPED_DAILY = re.compile(r"^/v2/aggs/grouped/locale/us/market/stocks/(?P<day>[\d-]+)$")
+TICKER_DETAILS = re.compile(r"^/v3/reference/tickers/(?P<ticker>[^/]+)$")
+
+MARKET_SIZE = 1000  # Number of tickers in the grouped daily bars, they are named T0 to T999.
+
+
+def _seed(*parts):
+    # Stable seed, so that every ticker and date is answered with the same data in every run.
+    return zlib.crc32("|".join(map(str, parts)).encode())
+
+
+def _trading_days(start, end):
+    days = []
+    day = date.fromisoformat(start)
+    while day <= date.fromisoformat(end):
+        if day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+
+    return days
+
+
+def _timestamp(day):
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def synthetic_bars(ticker, start, end):
+    """
+    :return: List of daily bars of a random walk for the weekdays from start to end.
+    """
+    days = _trading_days(start, end)
+    rng = np.random.default_rng(_seed(ticker))
+    close = 100 * np.cumprod(1 + rng.normal(0.0003, 0.015, len(days)))
+    volume = rng.integers(100_000, 10_000_000, len(days))
+
+    return [{"o": round(price * 0.998, 4), "h": round(price * 1.01, 4), "l": round(price * 0.99, 4),
+             "c": round(price, 4), "v": float(shares), "vw": round(price, 4), "n": int(shares // 100),
+             "t": _timestamp(day)}
+            for day, price, shares in zip(days, close, volume)]
+
+
+def synthetic_financials(ticker):
+    """
+    :return: The "results" of a financials response with the last four quarters and the last annual filing.
+    """
+    rng = np.random.default_rng(_seed(ticker, "financials"))
+    year = date.today().year
+    periods = [(year, "Q2", f"{year}-04-01", f"{year}-06-30"), (year, "Q1", f"{year}-01-01", f"{year}-03-31"),
+               (year - 1, "FY", f"{year - 1}-01-01", f"{year - 1}-12-31"),
+               (year - 1, "Q4", f"{year - 1}-10-01", f"{year - 1}-12-31"),
+               (year - 1, "Q3", f"{year - 1}-07-01", f"{year - 1}-09-30")]
+
+    filings = []
+    for fiscal_year, fiscal_period, start, end in periods:
+        scale = 4 if fiscal_period == "FY" else 1
+        assets = float(rng.uniform(1e9, 1e11))
+        liabilities = assets * float(rng.uniform(0.2, 0.8))
+        net_income = assets * float(rng.uniform(-0.01, 0.03)) * scale
+        filings.append({
+            "start_date": start, "end_date": end, "fiscal_year": str(fiscal_year), "fiscal_period": fiscal_period,
+            "timeframe": "annual" if fiscal_period == "FY" else "quarterly",
+            "financials": {
+                "balance_sheet": {
+                    "assets": {"label": "Assets", "order": 100, "value": assets, "unit": "USD"},
+                    "liabilities": {"label": "Liabilities", "order": 600, "value": liabilities, "unit": "USD"},
+                    "equity": {"label": "Equity", "order": 1400, "value": assets - liabilities, "unit": "USD"}},
+                "income_statement": {
+                    "revenues": {"label": "Revenues", "order": 100, "value": assets * 0.1 * scale, "unit": "USD"},
+                    "net_income_loss": {"label": "Net Income/Loss", "order": 3200, "value": net_income,
+                                        "unit": "USD"},
+                    "basic_earnings_per_share": {"label": "Basic Earnings Per Share", "order": 4200,
+                                                 "value": round(net_income / 1e9, 2), "unit": "USD / shares"}},
+                "cash_flow_statement": {
+                    "net_cash_flow": {"label": "Net Cash Flow", "order": 1100, "value": net_income * 0.5,
+                                      "unit": "USD"}}}})
+
+    return filings
+
+
+def synthetic_dividends(ticker, count=12):
+    """
+    :return: The "results" of a dividends response, the most recent dividend first.
+    """
+    rng = np.random.default_rng(_seed(ticker, "dividends"))
+    amounts = 0.2 * np.cumprod(1 + rng.uniform(0.0, 0.03, count))
+
+    return [{"ticker": ticker, "cash_amount": round(float(amount), 4), "frequency": 4}
+            for amount in amounts[::-1]]
+
+
+class FakePolygon:
+    """
+    The stand-in server, it runs in a daemon thread and answers every request in its own thread.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, requests_per_second=None, recordings=None):
+        """
+        :param host: (Default value = "127.0.0.1") Address the server listens on.
+        :param port: (Default value = 0) Port the server listens on, a free port if 0.
+        :param latency: (Default value = 0.0) Seconds every response is delayed, like the round trip to the API.
+        :param requests_per_second: (Default value = None) Requests answered per second, further requests within
+            the same second are answered with 429. No limit if None.
+        :param recordings: (Default value = None) Folder with recorded responses. A request is answered with the
+            file named after its path (slashes replaced by underscores, e.g. "v3_reference_tickers_AAPL.json") if
+            it exists, otherwise with synthetic data.
+        """
+        self.latency = latency
+        self.requests_per_second = requests_per_second
+        self.recordings = recordings
+        self.calls = collections.Counter()
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._window = (0, 0)  # (second, requests answered in that second)
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        """
+        Resets the counters between the runs of a benchmark.
+        """
+        with self._lock:
+            self.calls.clear()
+            self.rejected = 0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _admit(self, endpoint):
+        # Counts the request and returns False if it exceeds the rate limit.
+        with self._lock:
+            self.calls[endpoint] += 1
+            if self.requests_per_second is None:
+                return True
+            second, count = self._window
+            now = int(time.monotonic())
+            if now != second:
+                second, count = now, 0
+            self._window = (second, count + 1)
+            if count >= self.requests_per_second:
+                self.rejected += 1
+                return False
+
+            return True
+
+    def respond(self, path, query):
+        """
+        :return: (status_code, payload) of a request.
+        """
+        if self.recordings:
+            recording = os.path.join(self.recordings, path.strip("/").replace("/", "_") + ".json")
+            if os.path.exists(recording):
+                with open(recording) as file:
+                    return 200, json.load(file)
+
+        match = AGGREGATES.match(path)
+        if match:
+            bars = synthetic_bars(match["ticker"], match["start"], match["end"])
+            limit = int(query.get("limit", 50000))
+            cursor = int(query.get("cursor", 0))
+            payload = {"ticker": match["ticker"], "status": "OK", "results": bars[cursor:cursor + limit]}
+            payload["resultsCount"] = len(payload["results"])
+            if cursor + limit < len(bars):
+                payload["next_url"] = f"{self.url}{path}?limit={limit}&cursor={cursor + limit}"
+            return 200, payload
+
+        match = GROUPED_DAILY.match(path)
+        if match:
+            day = date.fromisoformat(match["day"])
+            if day.weekday() >= 5:
+                return 200, {"status": "OK", "resultsCount": 0, "results": []}
+            rng = np.random.default_rng(_seed(match["day"]))
+            close = 100 * (1 + rng.normal(0, 0.015, MARKET_SIZE))
+            results = [{"T": f"T{number}", "o": price, "h": price * 1.01, "l": price * 0.99, "c": price,
+                        "v": 1e6, "t": _timestamp(day)}
+                       for number, price in enumerate(close.round(4).tolist())]
+            return 200, {"status": "OK", "resultsCount": len(results), "results": results}
+
+        if path == "/vX/reference/financials":
+            return 200, {"status": "OK", "results": synthetic_financials(query.get("ticker", ""))}
+
+        match = TICKER_DETAILS.match(path)
+        if match:
+            rng = np.random.default_rng(_seed(match["ticker"], "details"))
+            return 200, {"status": "OK", "results": {"ticker": match["ticker"], "name": match["ticker"],
+                                                     "weighted_shares_outstanding": float(rng.uniform(1e8, 1e10))}}
+
+        if path == "/v3/reference/dividends":
+            return 200, {"status": "OK", "results": synthetic_dividends(query.get("ticker", ""))}
+
+        return 404, {"status": "NOT_FOUND", "message": f"Unknown endpoint {path}"}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                query = {name: values[-1] for name, values in parse_qs(parsed.query).items()}
+                endpoint = http_client.endpoint_name(parsed.path)
+
+                if server.latency:
+                    time.sleep(server.latency)
+                if server._admit(endpoint):
+                    status_code, payload = server.respond(parsed.path, query)
+                else:
+                    status_code, payload = 429, {"status": "ERROR", "error": "Exceeded the maximum requests."}
+
+                body = json.dumps(payload).encode()
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status_code == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *arguments):
+                pass  # The benchmarks send thousands of requests, they are counted instead of logged.
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Polygon.io API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every response is delayed.")
+    parser.add_argument("--rate-limit", type=int, default=None, help="Requests answered per second.")
+    parser.add_argument("--recordings", default=None, help="Folder with recorded responses.")
+    arguments = parser.parse_args()
+
+    server = FakePolygon(arguments.host, arguments.port, arguments.latency, arguments.rate_limit,
+                         arguments.recordings).start()
+    print(f"Serving the Polygon.io stand-in on {server.url}, stop it with ctrl + c.")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Bulk ingest of the whole US stock market through the grouped daily bars of Polygon.io.
+One request returns the bar of every ticker for a single date, so a year of history for the whole market takes about
+252 requests instead of one request per ticker. The bars are rebuilt into (date x ticker) matrices, that
+Asset.get_prices and the quant functions slice from once the matrix is activated through use_market_matrix.
+The requests go through http_client, so POLYGON_API_URL can point them to a local stand-in server.
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+from . import executor as ex
+from . import http_client
+from . import scheduler
+from .cache import response_cache, make_key
+
+
+FIELDS = ("o", "h", "l", "c", "v")
+
+
+def get_grouped_daily(api_key, day, adjusted=True):
+    """
+    This function retrieves the daily bars of all US stocks for one date.
+    :param api_key: The API key for Polygon.io.
+    :param day: The date as a string of the form YYYY-MM-DD.
+    :param adjusted: (Default value = True) Adjust the bars for splits.
+    :return: DataFrame indexed by the tickers with the columns of FIELDS, empty for days without trading.
+    """
+    def request_day():
+        url = http_client.api_url(f"/v2/aggs/grouped/locale/us/market/stocks/{day}", api_key,
+                                  adjusted=str(adjusted).lower())
+        response = http_client.get(url)
+        http_client.check_status(response, day, "No grouped daily bars found")
+        bars = response.json().get("results") or []
+
+        # Decode the bars column by column into typed arrays.
+        tickers = [bar["T"] for bar in bars]
+        columns = {field: np.fromiter((bar.get(field, np.nan) for bar in bars), dtype=np.float64, count=len(bars))
+                   for field in FIELDS}
+
+        return pd.DataFrame(columns, index=pd.Index(tickers, name="ticker"))
+
+    key = make_key("market", "grouped_daily", day=day, adjusted=adjusted)
+
+    return response_cache.get_or_load(key, "grouped_daily", request_day)
+
+
+class MarketMatrix:
+    """
+    Daily bars of many tickers as (date x ticker) matrices, one per field.
+    """
+
+    def __init__(self, matrices, start, end):
+        """
+        :param matrices: Dictionary field -> DataFrame with the dates as index and the tickers as columns.
+        :param start: First date that was requested, as a string of the form YYYY-MM-DD.
+        :param end: Last date that was requested, as a string of the form YYYY-MM-DD.
+        """
+        self.matrices = matrices
+        self.start = start
+        self.end = end
+        self.close = matrices["c"]
+        self.tickers = set(self.close.columns)
+
+    def __contains__(self, ticker):
+        return ticker in self.tickers
+
+    def covers(self, start, end):
+        """
+        :return: True if the matrix holds the dates from start to end.
+        """
+        return self.start <= start and end <= self.end
+
+    def prices(self, ticker, start=None, end=None):
+        """
+        Slices the bars of one ticker in the format of Asset.get_prices.
+        :return: DataFrame with one column per field, indexed by the dates the ticker traded.
+        """
+        data = pd.DataFrame({field: matrix[ticker] for field, matrix in self.matrices.items()}).loc[start:end]
+        data.index.name = "t"
+
+        return data.dropna(subset=["c"])
+
+    def closes(self, tickers, start=None, end=None):
+        """
+        :return: DataFrame of the closing prices of the tickers, that are part of the matrix.
+        """
+        return self.close.loc[start:end, [ticker for ticker in tickers if ticker in self]]
+
+
+def build_market_matrix(api_key, start, end, fields=FIELDS, adjusted=True):
+    """
+    Requests the grouped daily bars of all weekdays from start to end and rebuilds them into matrices.
+    The days are requested concurrently in the background lane of the request scheduler, so that requests of the
+    dashboard are not held up by the bulk ingest. Holidays without bars are left out.
+    :param api_key: The API key for Polygon.io.
+    :param start: First date as a string of the form YYYY-MM-DD.
+    :param end: Last date as a string of the form YYYY-MM-DD.
+    :param fields: (Default value = FIELDS) The fields to keep, "c" is always kept.
+    :param adjusted: (Default value = True) Adjust the bars for splits.
+    :return: MarketMatrix of the days.
+    """
+    days = [day.strftime("%Y-%m-%d") for day in pd.bdate_range(start, end)]
+    with scheduler.lane(scheduler.BACKGROUND):
+        bars = ex.run_tasks({day: (get_grouped_daily, (api_key, day, adjusted)) for day in days})
+    bars = {pd.Timestamp(day): bars[day] for day in days if day in bars and not bars[day].empty}
+
+    fields = list(dict.fromkeys(["c"] + list(fields)))
+    if not bars:
+        return MarketMatrix({field: pd.DataFrame() for field in fields}, start, end)
+
+    # One concat of all days in long format, each field is then unstacked into a (date x ticker) matrix.
+    long_format = pd.concat(bars, names=["date", "ticker"])
+    matrices = {field: long_format[field].unstack("ticker").sort_index() for field in fields}
+
+    return MarketMatrix(matrices, start, end)
+
+
+_market_matrix = None
+_market_lock = threading.Lock()
+
+
+def use_market_matrix(matrix):
+    """
+    Activates a MarketMatrix (or deactivates it with None) for Asset.get_prices and the quant functions.
+    """
+    global _market_matrix
+    with _market_lock:
+        _market_matrix = matrix
+
+
+def market_matrix():
+    """
+    :return: The active MarketMatrix or None.
+    """
+    return _market_matrix
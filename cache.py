@@ -0,0 +1,316 @@
+"""
+In-process cache for the responses of Polygon.io, so that repeated clicks in the dashboard reuse the data.
+The logic of the keys is as follows:
+
+    stock_ticker + "_" + value_type + "_" + parameters
+
+    - stock_ticker: The ticker symbol of the asset.
+    - value_type: The kind of data requested, e.g. "prices", "fundamentals", "ticker_info" or "dividends".
+    - parameters: The remaining parameters of the request, sorted by their name (the API key is left out).
+
+Every value type has its own time to live and the memory of the local backend is bounded, the least recently used
+values are evicted first. Identical requests that arrive at the same time share a single call to Polygon.io.
+If the environment variable "EQUITY_EXPLORER_REDIS" holds a URL, the values are stored as pickle elements in redis.
+"""
+
+import asyncio
+import inspect
+import os
+import pickle
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from functools import wraps
+
+
+# Time to live in seconds for each value type. Prices change during the day, fundamentals only with new filings.
+TTL = {"prices": 60 * 5,
+       "fundamentals": 60 * 60 * 12,
+       "ticker_info": 60 * 60 * 24,
+       "dividends": 60 * 60 * 12,
+       "grouped_daily": 60 * 60 * 12}
+
+DEFAULT_TTL = 60 * 5
+
+
+def make_key(asset_ticker, value_type, **parameters):
+    """
+    This function builds the key of a cached value.
+    :param asset_ticker: The ticker of the asset.
+    :param value_type: The kind of data requested.
+    :param parameters: The remaining parameters of the request.
+    :return: The key as a string.
+    """
+    key = f"{asset_ticker}_{value_type}"
+    if parameters:
+        key += "_" + "&".join(f"{name}={parameters[name]}" for name in sorted(parameters))
+
+    return key
+
+
+def _sizeof(value):
+    """
+    Approximates the memory used by a cached value in bytes.
+    """
+    if hasattr(value, "memory_usage"):
+        usage = value.memory_usage(deep=True)  # DataFrames return a Series, Series return an integer.
+        return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof(item) for item in value)
+
+    return sys.getsizeof(value)
+
+
+def _copy(value):
+    """
+    Returns a copy of a cached value, so that callers can modify their data without altering the cache.
+    """
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if hasattr(value, "copy"):
+        return value.copy()
+
+    return value
+
+
+class MemoryBackend:
+    """
+    Dict-based backend with a time to live per value and LRU eviction once max_bytes is exceeded.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expiry, size, value)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return False, None
+            self._entries.move_to_end(key)  # Mark the value as recently used.
+            return True, entry[2]
+
+    def set(self, key, value, ttl):
+        size = _sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._size += size
+            # Evict the least recently used values until the bound is met again.
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        self._size -= self._entries.pop(key)[1]
+
+
+class RedisBackend:
+    """
+    Backend storing the values as pickle elements in redis, so that several processes can share them.
+    Redis takes care of the time to live and the eviction (configure "maxmemory-policy allkeys-lru").
+    """
+
+    def __init__(self, url="redis://localhost:6379/0", prefix="equity-explorer:"):
+        import redis  # Optional dependency, only needed for this backend.
+
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + key)
+        if raw is None:
+            return False, None
+
+        return True, pickle.loads(raw)
+
+    def set(self, key, value, ttl):
+        self._client.set(self.prefix + key, pickle.dumps(value), ex=max(int(ttl), 1))
+
+    def clear(self):
+        for key in self._client.scan_iter(match=self.prefix + "*"):
+            self._client.delete(key)
+
+
+class _Call:
+    """
+    A request that is currently in flight, other threads asking for the same key wait for its result.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    """
+    Cache in front of the requests to Polygon.io with hit and miss counters.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._async_in_flight = weakref.WeakKeyDictionary()  # event loop -> {key: future}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, value_type, loader):
+        """
+        Returns the cached value for key or calls loader to request it.
+        :param key: The key built with make_key.
+        :param value_type: The kind of data, which selects the time to live.
+        :param loader: Function without arguments, that requests the value.
+        :return: A copy of the value.
+        """
+        found, value = self.backend.get(key)
+        if found:
+            self._count("hits")
+            return _copy(value)
+
+        # Single-flight: only the first thread requests the value, the others wait for its result.
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._in_flight[key] = call
+
+        if not leader:
+            call.done.wait()
+            self._count("coalesced")
+            if call.error is not None:
+                raise call.error
+            return _copy(call.value)
+
+        try:
+            # The value might have been stored while this thread was waiting for the lock.
+            found, value = self.backend.get(key)
+            if found:
+                self._count("hits")
+            else:
+                self._count("misses")
+                value = loader()
+                self.backend.set(key, value, TTL.get(value_type, DEFAULT_TTL))
+            call.value = value
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+        return _copy(value)
+
+    async def get_or_load_async(self, key, value_type, loader):
+        """
+        Asynchronous version of get_or_load.
+        :param loader: Function without arguments, that returns a coroutine requesting the value.
+        :return: A copy of the value.
+        """
+        found, value = self.backend.get(key)
+        if found:
+            self._count("hits")
+            return _copy(value)
+
+        # Single-flight within the running event loop.
+        in_flight = self._async_in_flight.setdefault(asyncio.get_running_loop(), {})
+        future = in_flight.get(key)
+        if future is not None:
+            self._count("coalesced")
+            return _copy(await asyncio.shield(future))
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())  # Errors are raised below.
+        in_flight[key] = future
+        try:
+            self._count("misses")
+            value = await loader()
+            self.backend.set(key, value, TTL.get(value_type, DEFAULT_TTL))
+            future.set_result(value)
+        except Exception as error:
+            future.set_exception(error)
+            raise
+        finally:
+            del in_flight[key]
+
+        return _copy(value)
+
+    def stats(self):
+        """
+        :return: Dictionary with the hit, miss and coalesced counters.
+        """
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
+
+    def clear(self):
+        self.backend.clear()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+def _default_backend():
+    redis_url = os.getenv("EQUITY_EXPLORER_REDIS")
+    if redis_url:
+        return RedisBackend(redis_url)
+
+    return MemoryBackend()
+
+
+# The cache shared by all modules of the package.
+response_cache = ResponseCache(_default_backend())
+
+
+def cached(value_type, ticker_parameter="asset_ticker"):
+    """
+    Decorator to cache the result of a request function in response_cache, works for coroutine functions as well.
+    The API key and the "show" flag are not part of the key.
+    :param value_type: The kind of data the function returns.
+    :param ticker_parameter: The name of the parameter holding the ticker.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def build_key(args, kwargs):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            parameters = {name: value for name, value in arguments.arguments.items()
+                          if name not in ("api_key", "show", ticker_parameter)}
+
+            return make_key(arguments.arguments[ticker_parameter], value_type, **parameters)
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return await response_cache.get_or_load_async(build_key(args, kwargs), value_type,
+                                                              lambda: func(*args, **kwargs))
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return response_cache.get_or_load(build_key(args, kwargs), value_type, lambda: func(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
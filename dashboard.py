@@ -0,0 +1,561 @@
+import os
+from threading import Timer
+import webbrowser
+from dash import Dash, dcc, html, dash_table, callback, Output, Input, State, Patch, no_update
+import dash_bootstrap_components as dbc
+import pandas as pd
+import plotly
+from . import visualize as viz
+from . import downsample
+from . import fundamental_ratios as fr
+from . import quant_ratios as qr
+from . import portfolio as pf
+from . import risk_simulation as rs
+from . import executor as ex
+from . import metrics
+from . import tracing
+from .dataset import get_dataset, parse_tickers
+
+
+# NOTE: Change this if your key is not stored in an Environment Variable.
+key = os.getenv("API_Polygon")
+
+
+def create_layout():
+    """
+    Sets up the predefined elements offered by Dash.
+    :return: The layout of the dashboard.
+    """
+    return html.Div([
+        # Header of the Application
+        html.Div(children="Equity Explorer",
+                 style={"fontSize": "24px",
+                        'color': 'white',
+                        'fontFamily': 'Arial',
+                        }),
+
+        html.Div(style={'height': '20px'}),
+        # Search field for the tickers that should be analyzed
+        dcc.Input(id="ticker_as_text".format("search"),
+                  value="AAPL".format("search"), style={"margin-left": "15px"}),
+        # Search button to confirm the input
+        dbc.Button('Submit', id='search_button', color='#101010', style={'backgroundColor': '#101010',
+                                                                         'color': 'white',
+                                                                         'fontFamily': 'Arial',
+                                                                         'border': '1px solid #636efa',
+                                                                         'marginLeft': '1.0em'
+                                                                         }),
+        html.Div(style={'height': '20px'}),
+        # Container to align the two graphs in a row
+        dbc.Container([dbc.Row([
+            dbc.Col(dcc.Graph(figure={}, id="price_line")),
+            dbc.Col(dcc.Graph(figure={}, id="price_hist")),
+            # Rolling metrics of the tickers, the metric and the length of the window can be chosen
+            dbc.Col([
+                dbc.Row([
+                    dbc.Col(dcc.Dropdown(["Beta", "Alpha", "Volatility", "Sharpe ratio"], "Beta",
+                                         id="rolling_metric", clearable=False, style={"color": "#101010"})),
+                    dbc.Col(dcc.Dropdown([{"label": f"{window} days", "value": window}
+                                          for window in qr.ROLLING_WINDOWS],
+                                         qr.ROLLING_WINDOWS[0], id="rolling_window", clearable=False,
+                                         style={"color": "#101010"})),
+                ]),
+                dcc.Graph(figure={}, id="rolling_line"),
+            ]),
+            # Tickers of the traces currently shown in the graphs in the order of the traces, and the versions of
+            # their data. The store of the lines also holds the submitted tickers ("dataset"), see zoom_graph.
+            dcc.Store(id="price_line_tickers", data={"tickers": [], "versions": []}),
+            dcc.Store(id="price_hist_tickers", data={"tickers": [], "versions": []}),
+            html.Div(style={'height': '20px'}),
+            # DataTable containing the fundamental ratios
+            dash_table.DataTable(data=[{"Ticker": "AAPL",
+                                        "E/P Ratio": "calculating.",
+                                        "P/B Ratio": "calculating.",
+                                        "Current Ratio": "calculating.",
+                                        "ROE": "calculating.",
+                                        "ROA": "calculating.",
+                                        "Average Dividend growth": "calculating."}],
+                                 columns=[{"name": i, "id": i} for i in [
+                                     "Ticker",
+                                     "E/P Ratio",
+                                     "P/B Ratio",
+                                     "Current Ratio",
+                                     "ROE",
+                                     "ROA",
+                                     "Average Dividend growth"]],
+                                 page_size=6,
+                                 id="ratio_table",
+                                 style_as_list_view=True,
+                                 style_table={
+                                     'overflowX': 'auto',
+                                     'border': '1px solid #636efa'
+                                 },
+                                 style_header={
+                                     'backgroundColor': '#101010',
+                                     'color': 'white',
+                                     'fontWeight': 'bold',
+                                     'borderBottom': '1px solid #636efa',
+                                     'padding': '5px'
+                                 },
+                                 style_cell={
+                                     'backgroundColor': '#101010',
+                                     'color': 'white',
+                                     'fontFamily': 'Arial',
+                                     'fontSize': 14,
+                                     'border': '1px solid #636efa',
+                                     'padding': '5px'
+                                 }),
+            html.Div(style={'height': '20px'}),
+            # DataTable containing the quantitative ratios
+            dash_table.DataTable(data=[{"Ticker": "AAPL",
+                                        "Alpha": "calculating.",
+                                        "Beta": "calculating.",
+                                        "Volatility": "calculating.",
+                                        "Sharpe ratio": "calculating.",
+                                        "VaR 95%": "calculating.",
+                                        "CVaR 95%": "calculating.",
+                                        "VaR 99%": "calculating.",
+                                        "CVaR 99%": "calculating.",
+                                        "Median drawdown": "calculating."}],
+                                 columns=[{"name": i, "id": i} for i in [
+                                     "Ticker",
+                                     "Alpha",
+                                     "Beta",
+                                     "Volatility",
+                                     "Sharpe ratio",
+                                     "VaR 95%",
+                                     "CVaR 95%",
+                                     "VaR 99%",
+                                     "CVaR 99%",
+                                     "Median drawdown"]],
+                                 page_size=6,
+                                 id="quant_table",
+                                 style_as_list_view=True,
+                                 style_table={
+                                     'overflowX': 'auto',
+                                     'border': '1px solid #636efa'
+                                 },
+                                 style_header={
+                                     'backgroundColor': '#101010',
+                                     'color': 'white',
+                                     'fontWeight': 'bold',
+                                     'borderBottom': '1px solid #636efa',
+                                     'padding': '5px'
+                                 },
+                                 style_cell={
+                                     'backgroundColor': '#101010',
+                                     'color': 'white',
+                                     'fontFamily': 'Arial',
+                                     'fontSize': 14,
+                                     'border': '1px solid #636efa',
+                                     'padding': '5px'
+                                 }),
+            html.Div(style={'height': '20px'}),
+            # Simulated distribution of the maximum drawdowns of the tickers
+            dbc.Col(dcc.Graph(figure={}, id="risk_graph")),
+            html.Div(style={'height': '20px'}),
+            # Efficient frontier and weights of the portfolios of the tickers
+            dbc.Col(dcc.Graph(figure={}, id="frontier_graph")),
+            dbc.Col(dash_table.DataTable(data=[],
+                                         columns=[{"name": i, "id": i} for i in [
+                                             "Ticker",
+                                             "Min variance",
+                                             "Max Sharpe"]],
+                                         page_size=10,
+                                         id="weights_table",
+                                         style_as_list_view=True,
+                                         style_table={
+                                             'overflowX': 'auto',
+                                             'border': '1px solid #636efa'
+                                         },
+                                         style_header={
+                                             'backgroundColor': '#101010',
+                                             'color': 'white',
+                                             'fontWeight': 'bold',
+                                             'borderBottom': '1px solid #636efa',
+                                             'padding': '5px'
+                                         },
+                                         style_cell={
+                                             'backgroundColor': '#101010',
+                                             'color': 'white',
+                                             'fontFamily': 'Arial',
+                                             'fontSize': 14,
+                                             'border': '1px solid #636efa',
+                                             'padding': '5px'
+                                         })),
+            html.Div(style={'height': '20px'}),
+            # Backtests of rebalancing strategies of the tickers, with their turnover and trading costs
+            dbc.Col(dcc.Graph(figure={}, id="backtest_equity")),
+            dbc.Col(dcc.Graph(figure={}, id="backtest_costs")),
+            html.Div(style={'height': '20px'}),
+        ])], fluid=True)])
+
+
+def create_app():
+    """
+    Instantiates the Dash App, the layout is only built once the server is started.
+    :return: The Dash App.
+    """
+    app = Dash(__name__, external_stylesheets=[dbc.themes.CYBORG])  # Instantiating the basis for the Dash App
+    metrics.register_route(app.server)  # Serves /metrics if EQUITY_EXPLORER_METRICS is set to "1".
+    app.layout = create_layout()
+
+    return app
+
+
+# NOTE: For each parameter displayed in a column a task is created. The measures can be modified but their function
+# have to return a dictionary (see output of function in fr). It is also necessary to adjust the placeholder data at
+# the top so that all datapoints are allocated correctly.
+RATIO_TASKS = list(fr.RATIOS.values())
+
+RATIO_TIMEOUT = 30  # Seconds a ratio may take to be calculated.
+RATIOS_IN_PROCESSES = os.getenv("EQUITY_EXPLORER_RATIO_PROCESSES") == "1"  # For CPU-heavy measures.
+RISK_BIN_WIDTH = 0.005  # Width of the bins of the simulated drawdowns, half a percent.
+
+
+@tracing.traced("ratio")
+def add_table_rows(ticker_symbols: list):
+    """
+    Calculates the rows of the DataTable for several tickers at once.
+    :param ticker_symbols: The data of all tickers is taken from the dataset of the submission, afterwards every
+        (ticker, ratio) pair is calculated as its own task in the worker pool.
+    :return: Returns a list of dictionaries that are recognized as rows of a DataTable.
+    """
+    stocks = get_dataset(key, ticker_symbols).stocks
+
+    tasks = {(symbol, task.__name__): (task, (stock,))
+             for symbol, stock in stocks.items() for task in RATIO_TASKS}
+    calculated_ratios = ex.run_tasks(tasks, timeout=RATIO_TIMEOUT, cpu=RATIOS_IN_PROCESSES)
+
+    rows = []
+    for symbol in ticker_symbols:
+        # We must not forget the Ticker_symbol of the row!
+        row_of_data = {"Ticker": symbol}
+        for task in RATIO_TASKS:
+            row_of_data.update(calculated_ratios.get((symbol, task.__name__), {}))
+        rows.append(row_of_data)
+
+    return rows
+
+
+def add_table_row(ticker_symbol: str):
+    """
+    Calculates parameters of a row for the DataTable.
+    :param ticker_symbol: This calculates the parameters for each stock given ticker_symbol concurrently.
+    :return: Returns a dictionary that will be appended to a list to be recognized as a row of a DataTable.
+    """
+    return add_table_rows([ticker_symbol])[0]
+
+
+def cumulative_returns(prices):
+    """
+    Converts the bars of an asset into its cumulative returns, stored in the column "c".
+    """
+    returns = prices[["c"]].pct_change(periods=1).dropna()
+    returns["c"] = (1 + returns["c"]).cumprod() - 1
+
+    return returns
+
+
+# NOTE: All callbacks with the input "search_button" fire on the same click. They take their data from get_dataset,
+# which loads the tickers of a submission once and lets the other callbacks wait for the result instead of requesting
+# it again.
+@callback(Output("ratio_table", "data"),
+          Input("search_button", "n_clicks"),
+          State("ticker_as_text", "value"))
+@tracing.trace_callback
+@metrics.timed("callback_seconds")
+def update_ratio_table(n_clicks, ticker):
+    # All tickers are calculated at once in the worker pool.
+    return add_table_rows(parse_tickers(ticker))
+
+
+@callback(Output("quant_table", "data"),
+          Input("search_button", "n_clicks"),
+          State("ticker_as_text", "value"))
+@tracing.trace_callback
+@metrics.timed("callback_seconds")
+def update_quant_table(n_clicks, ticker):
+    clean_ticker_list = parse_tickers(ticker)
+    dataset = get_dataset(key, clean_ticker_list)
+
+    # The benchmark is part of the dataset and all tickers are calculated together.
+    quant_metrics = qr.get_quant_metrics(key, clean_ticker_list, price_matrix=dataset.price_matrix)
+
+    # VaR, CVaR and drawdowns of the simulated paths, tickers without enough returns are left empty.
+    simulation = dataset.risk_simulation
+    if simulation:
+        quant_metrics = quant_metrics.join(simulation["metrics"])
+    quant_metrics = quant_metrics.round(3)
+
+    return [{"Ticker": ticker_symbol, **row} for ticker_symbol, row in quant_metrics.to_dict("index").items()]
+
+
+def rendered_tickers(rendered):
+    """
+    :param rendered: The content of a dcc.Store of the tickers of a graph, see update_traces.
+    :return: Tuple of the lists (tickers, versions of their data) of the traces in the graph.
+    """
+    if not isinstance(rendered, dict):  # Stores of pages opened before the versions were kept only hold the tickers.
+        return list(rendered or []), [None] * len(rendered or [])
+
+    return rendered.get("tickers", []), rendered.get("versions", [])
+
+
+def update_traces(rendered, wanted, make_trace, make_figure, version_of):
+    """
+    Updates a figure with one trace per ticker, only the traces of added or removed tickers and of tickers whose data
+    changed are sent to the browser.
+    :param rendered: The tickers of the traces in the figure and the versions of their data, as kept in a dcc.Store.
+    :param wanted: The tickers that should be shown.
+    :param make_trace: Function ticker -> trace, or None if there is no data for the ticker.
+    :param make_figure: Function list of traces -> figure, used if nothing is rendered yet.
+    :param version_of: Function ticker -> version of its data, see Dataset.data_version.
+    :return: Tuple of the figure (or a Patch of it) and the content of the store for the new figure.
+    """
+    rendered_symbols, rendered_versions = rendered_tickers(rendered)
+    if not rendered_symbols:
+        traces = {symbol: make_trace(symbol) for symbol in wanted}
+        shown = [symbol for symbol in wanted if traces[symbol] is not None]
+        return (make_figure([traces[symbol] for symbol in shown]),
+                {"tickers": shown, "versions": [version_of(symbol) for symbol in shown]})
+
+    removed = [position for position, symbol in enumerate(rendered_symbols) if symbol not in wanted]
+    added = [symbol for symbol in wanted if symbol not in rendered_symbols]
+    # Traces of tickers whose data was loaded again since they were drawn, e.g. after the cache expired.
+    changed = [position for position, (symbol, version) in enumerate(zip(rendered_symbols, rendered_versions))
+               if symbol in wanted and version != version_of(symbol)]
+    if not removed and not added and not changed:
+        return no_update, no_update
+
+    figure = Patch()
+    for position in changed:
+        trace = make_trace(rendered_symbols[position])
+        if trace is None:
+            removed.append(position)
+        else:
+            figure["data"][position] = trace.to_plotly_json()
+    # Deleting from the back keeps the positions of the remaining traces valid.
+    removed = set(removed)
+    for position in sorted(removed, reverse=True):
+        del figure["data"][position]
+    shown = [symbol for position, symbol in enumerate(rendered_symbols) if position not in removed]
+    for symbol in added:
+        trace = make_trace(symbol)
+        if trace is not None:
+            figure["data"].append(trace.to_plotly_json())
+            shown.append(symbol)
+
+    return figure, {"tickers": shown, "versions": [version_of(symbol) for symbol in shown]}
+
+
+@callback(Output("price_line", "figure"),
+          Output("price_line_tickers", "data"),
+          Input("search_button", "n_clicks"),
+          State("ticker_as_text", "value"),
+          State("price_line_tickers", "data"))
+@tracing.trace_callback
+@metrics.timed("callback_seconds")
+def update_graph(n_clicks, ticker, rendered=None):
+    clean_ticker_list = parse_tickers(ticker)
+    dataset = get_dataset(key, clean_ticker_list)
+
+    # Function to create the line of a ticker, the benchmark is always shown first
+    def make_line(ticker_symbol):
+        prices = dataset.prices(ticker_symbol)
+        if prices is None:
+            return None
+        # Long series are downsampled to the resolution of the graph.
+        return viz.line_trace(cumulative_returns(prices)["c"], ticker_symbol)
+
+    def make_figure(traces):
+        return viz.get_figure(traces, "Returns", "Date", "Returns")
+
+    wanted = list(dict.fromkeys([dataset.benchmark] + clean_ticker_list))
+    figure, store = update_traces(rendered, wanted, make_line, make_figure, dataset.data_version)
+
+    # The submitted tickers are kept with the traces, so that zoom_graph finds the cached dataset of the lines.
+    if store is no_update:
+        if isinstance(rendered, dict) and rendered.get("dataset") == clean_ticker_list:
+            return figure, store
+        symbols, versions = rendered_tickers(rendered)
+        store = {"tickers": symbols, "versions": versions}
+    store["dataset"] = clean_ticker_list
+
+    return figure, store
+
+
+@callback(Output("price_line", "figure", allow_duplicate=True),
+          Output("price_line_tickers", "data", allow_duplicate=True),
+          Input("price_line", "relayoutData"),
+          State("price_line_tickers", "data"),
+          prevent_initial_call=True)
+@tracing.trace_callback
+@metrics.timed("callback_seconds")
+def zoom_graph(relayout_data, rendered):
+    # Redraws the lines in the visible range with the full resolution of the graph, the lines were downsampled over
+    # their whole range before. Resetting the zoom draws the whole range again.
+    changed, start, end = downsample.visible_range(relayout_data)
+    symbols, _ = rendered_tickers(rendered)
+    if not changed or not symbols:
+        return no_update, no_update
+
+    # The prices come from the dataset the lines were drawn from, it is still in the cache after a submission. Stores
+    # of older pages do not name it, their first line is the benchmark.
+    rendered = rendered if isinstance(rendered, dict) else {}
+    dataset = get_dataset(key, rendered.get("dataset", symbols[1:]))
+
+    figure = Patch()
+    shown = []
+    for position, symbol in enumerate(symbols):
+        prices = dataset.prices(symbol)
+        if prices is None:
+            continue
+        returns = cumulative_returns(prices)["c"]
+        figure["data"][position] = viz.line_trace(returns.loc[start:end], symbol).to_plotly_json()
+        shown.append(symbol)
+
+    # A zoomed line only holds the visible range, so it is drawn again by the next submission. After a reset the lines
+    # are the ones update_graph draws.
+    zoomed = start is not None or end is not None
+    versions = [None if zoomed or symbol not in shown else dataset.data_version(symbol) for symbol in symbols]
+
+    return figure, {**rendered, "tickers": symbols, "versions": versions}
+
+
+@callback(Output("rolling_line", "figure"),
+          Input("search_button", "n_clicks"),
+          Input("rolling_metric", "value"),
+          Input("rolling_window", "value"),
+          State("ticker_as_text", "value"))
+@tracing.trace_callback
+@metrics.timed("callback_seconds")
+def update_rolling_graph(n_clicks, metric, window, ticker):
+    clean_ticker_list = parse_tickers(ticker)
+    dataset = get_dataset(key, clean_ticker_list)
+
+    # All windows are calculated once per dataset, switching the metric or the window only selects another table.
+    values = dataset.rolling_metrics[window][metric]
+    traces = [viz.line_trace(values[symbol], symbol) for symbol in values.columns if values[symbol].notna().any()]
+
+    return viz.get_figure(traces, f"Rolling {metric} ({window} days)", "Date", metric)
+
+
+@callback(Output("risk_graph", "figure"),
+          Input("search_button", "n_clicks"),
+          State("ticker_as_text", "value"))
+@tracing.trace_callback
+@metrics.timed("callback_seconds")
+def update_risk_graph(n_clicks, ticker):
+    clean_ticker_list = parse_tickers(ticker)
+    dataset = get_dataset(key, clean_ticker_list)
+    title = f"Simulated max drawdown over {rs.HORIZON} days"
+
+    # The simulation is shared with the quant table, the drawdowns of all paths are binned on the server.
+    simulation = dataset.risk_simulation
+    if not simulation:
+        return viz.get_figure([], title, "Max drawdown", "Paths")
+    traces = [viz.histogram_trace(*downsample.fixed_width_histogram(simulation["drawdowns"][:, column],
+                                                                    RISK_BIN_WIDTH),
+                                  ticker_symbol, RISK_BIN_WIDTH)
+              for column, ticker_symbol in enumerate(simulation["metrics"].index)]
+
+    return viz.get_figure(traces, title, "Max drawdown", "Paths").update_layout(barmode="overlay", bargap=0)
+
+
+@callback(Output("frontier_graph", "figure"),
+          Output("weights_table", "data"),
+          Input("search_button", "n_clicks"),
+          State("ticker_as_text", "value"))
+@tracing.trace_callback
+@metrics.timed("callback_seconds")
+def update_portfolio(n_clicks, ticker):
+    clean_ticker_list = parse_tickers(ticker)
+    dataset = get_dataset(key, clean_ticker_list)
+
+    # The portfolio is built from the tickers only, the benchmark is left out.
+    result = pf.optimize_portfolio(dataset.price_matrix[clean_ticker_list])
+    if not result:
+        return viz.get_figure([], "Efficient frontier (at least two tickers needed)", "Volatility", "Return"), []
+
+    frontier, portfolios, assets = result["frontier"], result["portfolios"], result["assets"]
+    traces = [plotly.graph_objects.Scatter(x=frontier["Volatility"], y=frontier["Return"], mode="lines",
+                                           name="Efficient frontier"),
+              plotly.graph_objects.Scatter(x=assets["Volatility"], y=assets["Return"], mode="markers",
+                                           text=assets.index, name="Tickers"),
+              plotly.graph_objects.Scatter(x=portfolios["Volatility"], y=portfolios["Return"], mode="markers",
+                                           text=portfolios.index, marker={"size": 12, "symbol": "star"},
+                                           name="Portfolios")]
+    fig = viz.get_figure(traces, "Efficient frontier", "Volatility", "Return")
+
+    # A portfolio without weights (see pf.max_sharpe_weights) is shown as "-".
+    weights = (result["weights"] * 100).round(2)
+    rows = [{"Ticker": ticker_symbol,
+             **{name: "-" if pd.isna(weight) else f"{weight}%" for name, weight in row.items()}}
+            for ticker_symbol, row in weights.to_dict("index").items()]
+
+    return fig, rows
+
+
+@callback(Output("backtest_equity", "figure"),
+          Output("backtest_costs", "figure"),
+          Input("search_button", "n_clicks"),
+          State("ticker_as_text", "value"))
+@tracing.trace_callback
+@metrics.timed("callback_seconds")
+def update_backtest(n_clicks, ticker):
+    clean_ticker_list = parse_tickers(ticker)
+    dataset = get_dataset(key, clean_ticker_list)
+
+    # The grid of strategies is run once per dataset in the process pool.
+    backtests = dataset.backtests
+    traces = [viz.line_trace(result["Equity"], label) for label, result in backtests["results"].items()]
+    equity_fig = viz.get_figure(traces, "Backtests", "Date", "Equity")
+
+    summary = backtests["summary"]
+    labels = list(summary.index)
+    cost_traces = [plotly.graph_objects.Bar(x=labels, y=summary.get("Turnover", []), name="Turnover per year",
+                                            offsetgroup=0),
+                   plotly.graph_objects.Bar(x=labels, y=summary.get("Costs", []), name="Costs per year",
+                                            offsetgroup=1, yaxis="y2")]
+    costs_fig = viz.get_figure(cost_traces, "Turnover and costs", "Strategy", "Turnover")
+    costs_fig.update_layout(yaxis2={"title": "Costs", "overlaying": "y", "side": "right", "tickformat": ".2%"})
+
+    return equity_fig, costs_fig
+
+
+@callback(Output("price_hist", "figure"),
+          Output("price_hist_tickers", "data"),
+          Input("search_button", "n_clicks"),
+          State("ticker_as_text", "value"),
+          State("price_hist_tickers", "data"))
+@tracing.trace_callback
+@metrics.timed("callback_seconds")
+def update_hist(n_clicks, ticker, rendered=None):
+    clean_ticker_list = parse_tickers(ticker)
+    dataset = get_dataset(key, clean_ticker_list)
+
+    # Function to create the bars of the distribution of a ticker, the returns are binned on the server with the
+    # same bin edges for all tickers, so only the counts of the bins are sent.
+    def make_hist(ticker_symbol):
+        histogram = dataset.return_histogram(ticker_symbol)
+        if histogram is None:
+            return None
+        return viz.histogram_trace(*histogram, ticker_symbol)
+
+    def make_figure(traces):
+        return viz.get_figure(traces, "Distribution", "Returns", "Count").update_layout(barmode="overlay", bargap=0)
+
+    return update_traces(rendered, clean_ticker_list, make_hist, make_figure, dataset.data_version)
+
+
+def serve():
+    """
+    Starts the server of the dashboard and opens it in the browser.
+    """
+    app = create_app()
+
+    def open_browser(debug=True):
+        webbrowser.open_new('http://127.0.0.1:8050')
+    Timer(1, open_browser).start()
+    app.run()
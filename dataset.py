@@ -0,0 +1,181 @@
+"""
+The data of one submission in the dashboard. All callbacks that fire on the same click ask for the dataset of the
+same tickers, it is loaded once (concurrent callbacks wait for the first one) and kept in the response cache.
+"""
+
+import re
+from functools import cached_property
+import pandas as pd
+from . import backtest as bt
+from . import downsample
+from . import executor as ex
+from . import fundamental_ratios as fr
+from . import quant_ratios as qr
+from . import risk_simulation as rs
+from . import tracing
+from .cache import response_cache, make_key
+from .price_data import Asset
+
+
+BENCHMARK = "SPX"
+LOAD_TIMEOUT = 60  # Seconds the data of a ticker may take to load.
+
+
+def parse_tickers(text):
+    """
+    Find all tickers in the input string, they are separated by everything except capital letters and digits.
+    :param text: The input of the search field.
+    :return: List of the tickers without duplicates.
+    """
+    ticker_list = re.findall(r'[A-Z0-9]*\.?[A-Z0-9]*', text or "")
+
+    return list(dict.fromkeys(element for element in ticker_list if element != ''))
+
+
+class Dataset:
+    """
+    The stocks of a submission with their data bundles and the prices of the benchmark.
+    """
+
+    def __init__(self, tickers, stocks, benchmark_prices, benchmark=BENCHMARK):
+        self.tickers = tickers
+        self.stocks = stocks  # ticker -> loaded fr.Stock, tickers that could not be loaded are left out.
+        self.benchmark = benchmark
+        self.benchmark_prices = benchmark_prices
+        self._histograms = {}  # (ticker, bin width) -> binned daily returns, kept as long as the dataset is cached.
+        self._versions = {}  # ticker -> hash of its closing prices, see data_version.
+
+    def prices(self, ticker):
+        """
+        :return: DataFrame of the bars of ticker (the benchmark included) or None if it could not be loaded.
+        """
+        if ticker == self.benchmark:
+            return self.benchmark_prices
+        stock = self.stocks.get(ticker)
+
+        return None if stock is None else stock.prices
+
+    @cached_property
+    def price_matrix(self):
+        """
+        Closing prices with one column per ticker and the benchmark as the last column.
+        """
+        closing_prices = {}
+        for ticker in self.tickers + [self.benchmark]:
+            prices = self.prices(ticker)
+            if prices is not None and "c" in prices:
+                closing_prices[ticker] = prices["c"].set_axis(prices.index.normalize())
+
+        price_matrix = pd.concat(closing_prices, axis=1) if closing_prices else pd.DataFrame()
+
+        return price_matrix.reindex(columns=list(dict.fromkeys(self.tickers + [self.benchmark]))).sort_index()
+
+    @cached_property
+    def rolling_metrics(self):
+        """
+        Rolling alpha, beta, volatility and sharpe ratio of the tickers, see quant_ratios.get_rolling_metrics.
+        """
+        return qr.get_rolling_metrics(None, self.tickers, benchmark=self.benchmark, price_matrix=self.price_matrix)
+
+    @cached_property
+    def risk_simulation(self):
+        """
+        Simulated VaR, CVaR and maximum drawdowns of the tickers without the benchmark, see
+        risk_simulation.simulate_risk.
+        """
+        return rs.simulate_risk(self.price_matrix[self.tickers])
+
+    @cached_property
+    def backtests(self):
+        """
+        Backtests of the tickers without the benchmark at every rebalancing frequency, held with equal weights or the
+        best half by E/P ratio, see backtest.sweep.
+        """
+        price_matrix = self.price_matrix[self.tickers]
+        signals = {"E/P": bt.ep_signal(self.stocks, price_matrix)}
+
+        return bt.sweep(price_matrix, {"signal": ["Equal weight", "E/P"], "frequency": list(bt.FREQUENCIES)}, signals)
+
+    def return_histogram(self, ticker, bin_width=downsample.BIN_WIDTH):
+        """
+        Bins the daily returns of ticker once, the bins of all tickers share their edges.
+        :return: Tuple of arrays (left edges, counts) or None if the ticker could not be loaded.
+        """
+        key = (ticker, bin_width)
+        if key not in self._histograms:
+            prices = self.prices(ticker)
+            self._histograms[key] = (None if prices is None else
+                                     downsample.fixed_width_histogram(prices["c"].pct_change().to_numpy(), bin_width))
+
+        return self._histograms[key]
+
+    def data_version(self, ticker):
+        """
+        Tells the graphs whether the traces of a ticker have to be drawn again, e.g. after the dataset was loaded again
+        with new bars.
+        :return: String that changes with the closing prices of the ticker, None if it could not be loaded.
+        """
+        if ticker not in self._versions:
+            prices = self.prices(ticker)
+            self._versions[ticker] = (None if prices is None or "c" not in prices else
+                                      str(pd.util.hash_pandas_object(prices["c"]).sum()))
+
+        return self._versions[ticker]
+
+    def memory_usage(self, deep=True):
+        # Used by the cache to bound its memory.
+        frames = [self.benchmark_prices] + [frame for stock in self.stocks.values()
+                                            for frame in (stock.prices, stock.balance_sheet,
+                                                          stock.income_statement, stock.dividends)]
+
+        return sum(int(frame.memory_usage(deep=deep).sum()) for frame in frames if frame is not None)
+
+
+@tracing.traced("load")
+def load_dataset(api_key, tickers, timeout=LOAD_TIMEOUT, workers=None):
+    """
+    Loads the data of all tickers and the benchmark concurrently.
+    :param api_key: The API key for Polygon.io.
+    :param tickers: List of tickers.
+    :param timeout: (Default value = LOAD_TIMEOUT) Seconds the data of a ticker may take to load, None to wait for
+        every ticker, e.g. in batch jobs that share the rate limit of Polygon.io.
+    :param workers: (Default value = None) Tickers loaded at once, the shared worker pool of the executor if None.
+    :return: Dataset of the tickers.
+    """
+    def load_stock(ticker):
+        return fr.Stock(api_key, ticker).load_data()
+
+    def load_benchmark():
+        return Asset(api_key, BENCHMARK, "Indices").get_prices()
+
+    # The benchmark has its own key, so that it does not replace a stock of the same ticker.
+    tasks = {ticker: (load_stock, (ticker,)) for ticker in tickers}
+    tasks[("benchmark", BENCHMARK)] = (load_benchmark, ())
+    results = ex.run_tasks(tasks, timeout=timeout, workers=workers)
+    benchmark_prices = results.pop(("benchmark", BENCHMARK), None)
+
+    return Dataset(list(tickers), results, benchmark_prices)
+
+
+def get_prices(api_key, ticker):
+    """
+    Returns the prices of a single ticker or the benchmark, e.g. to redraw a graph. They come from the response cache
+    if the dataset of the ticker was loaded before.
+    :param api_key: The API key for Polygon.io.
+    :param ticker: The ticker.
+    :return: DataFrame of the bars.
+    """
+    return Asset(api_key, ticker, "Indices" if ticker == BENCHMARK else "Stock").get_prices()
+
+
+@tracing.traced("load")
+def get_dataset(api_key, tickers):
+    """
+    Returns the dataset of the tickers, it is only loaded once for all callbacks of a submission.
+    :param api_key: The API key for Polygon.io.
+    :param tickers: List of tickers.
+    :return: Dataset of the tickers.
+    """
+    key = make_key(",".join(tickers), "dataset")
+
+    return response_cache.get_or_load(key, "prices", lambda: load_dataset(api_key, tickers))
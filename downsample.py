@@ -0,0 +1,128 @@
+"""
+Downsampling of long price series before they are plotted, so that the browser only receives about as many points as
+the graph has pixels. Lines are reduced with Largest-Triangle-Three-Buckets (LTTB), which keeps the peaks and troughs
+that define the shape of a line, candles are aggregated into OHLC buckets and distributions are binned on the server.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+MAX_POINTS = 2000  # Points per trace, about twice the width of a graph in pixels.
+WEBGL_POINTS = 1000  # Traces with more points are drawn with WebGL instead of SVG.
+BIN_WIDTH = 0.0025  # Width of the bins of the return distributions, a quarter of a percent.
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Selects threshold points of a line with the Largest-Triangle-Three-Buckets algorithm.
+    The first and the last point are always kept, from every bucket in between the point is taken, that forms the
+    largest triangle with the point selected before and the average of the next bucket.
+    :param x: Array of the x values as numbers, sorted ascending.
+    :param y: Array of the y values without NaN.
+    :param threshold: Number of points to keep.
+    :return: Array of the positions of the selected points.
+    """
+    length = len(y)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    # Bounds of the threshold - 2 buckets between the first and the last point.
+    edges = (np.arange(threshold - 1) * (length - 2) // (threshold - 2) + 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, length - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else length
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+
+        # Twice the area of the triangles, the factor does not change the maximum.
+        areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+
+    return selected
+
+
+def downsample_line(series, max_points=MAX_POINTS):
+    """
+    Reduces a series to at most max_points points with LTTB.
+    :param series: Series indexed by timestamps or numbers.
+    :param max_points: (Default value = MAX_POINTS) Number of points to keep, nothing is dropped if None.
+    :return: The reduced series.
+    """
+    series = series.dropna()
+    if max_points is None or len(series) <= max_points:
+        return series
+
+    index = series.index
+    x = (index.asi8 if isinstance(index, pd.DatetimeIndex) else index.to_numpy()).astype(np.float64)
+
+    return series.iloc[lttb_indices(x, series.to_numpy(dtype=np.float64), max_points)]
+
+
+def downsample_ohlc(data, max_points=MAX_POINTS):
+    """
+    Aggregates bars into at most max_points buckets of consecutive bars: the open of the first bar, the highest high,
+    the lowest low, the close of the last bar and the summed volume. A bucket is labelled with its first timestamp.
+    :param data: DataFrame of bars with the columns "o", "h", "l", "c" and optionally "v".
+    :param max_points: (Default value = MAX_POINTS) Number of buckets, nothing is aggregated if None.
+    :return: DataFrame of the aggregated bars.
+    """
+    if max_points is None or len(data) <= max_points:
+        return data
+
+    starts = np.unique(np.linspace(0, len(data), max_points, endpoint=False).astype(np.int64))
+    ends = np.append(starts[1:], len(data)) - 1
+    columns = {"o": data["o"].to_numpy()[starts],
+               "h": np.maximum.reduceat(data["h"].to_numpy(), starts),
+               "l": np.minimum.reduceat(data["l"].to_numpy(), starts),
+               "c": data["c"].to_numpy()[ends]}
+    if "v" in data:
+        columns["v"] = np.add.reduceat(data["v"].to_numpy(), starts)
+
+    return pd.DataFrame(columns, index=data.index[starts])
+
+
+def fixed_width_histogram(values, bin_width=BIN_WIDTH):
+    """
+    Counts the values in bins of a fixed width with edges at the multiples of bin_width, so that the bins of all
+    series line up and a series can be added to a graph later without binning the others again.
+    :param values: Array or Series of the values, NaN and infinite values are ignored.
+    :param bin_width: (Default value = BIN_WIDTH) Width of the bins.
+    :return: Tuple of arrays (left edges, counts) of the bins that are not empty.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return np.empty(0), np.empty(0, dtype=np.int64)
+
+    bins = np.floor(values / bin_width).astype(np.int64)
+    first = bins.min()
+    counts = np.bincount(bins - first)
+    occupied = np.flatnonzero(counts)
+
+    return (occupied + first) * bin_width, counts[occupied]
+
+
+def visible_range(relayout_data):
+    """
+    Reads the range of the x-axis from the relayoutData of a graph.
+    :return: Tuple (changed, start, end). changed is False if the x-axis was not zoomed or reset, start and end are
+        None if the whole range is shown again.
+    """
+    if not relayout_data:
+        return False, None, None
+    if relayout_data.get("xaxis.autorange"):
+        return True, None, None
+    if "xaxis.range[0]" in relayout_data:
+        return True, relayout_data["xaxis.range[0]"], relayout_data.get("xaxis.range[1]")
+    if "xaxis.range" in relayout_data:
+        start, end = relayout_data["xaxis.range"]
+        return True, start, end
+
+    return False, None, None
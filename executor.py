@@ -0,0 +1,157 @@
+"""
+Long-lived worker pools for the calculations of the dashboard.
+The requests to Polygon.io are I/O-bound, therefore they run in a thread pool that is created once and reused by every
+callback. CPU-heavy calculations can be moved to a process pool instead.
+Running tasks can not be stopped. For tasks in the thread pool the timeout of run_tasks is therefore also a deadline for
+their requests (see scheduler.deadline), so that a task that timed out gives its worker back with its next request
+instead of blocking it. Tasks in the process pool that time out run to their end.
+The sizes of the pools can be set through the environment variables "EQUITY_EXPLORER_IO_WORKERS" and
+"EQUITY_EXPLORER_CPU_WORKERS".
+"""
+
+import concurrent.futures
+import contextvars
+import logging
+import os
+import threading
+import time
+from . import scheduler
+from . import tracing
+
+
+POLL_INTERVAL = 0.05  # Seconds between the checks whether tasks with a timeout started running.
+IO_WORKERS = int(os.getenv("EQUITY_EXPLORER_IO_WORKERS", "16"))
+CPU_WORKERS = int(os.getenv("EQUITY_EXPLORER_CPU_WORKERS", str(os.cpu_count() or 1)))
+
+logger = logging.getLogger(__name__)
+
+_io_pool = None
+_cpu_pool = None
+_pool_lock = threading.Lock()
+
+
+def io_pool():
+    """
+    :return: The thread pool for I/O-bound tasks.
+    """
+    global _io_pool
+    with _pool_lock:
+        if _io_pool is None:
+            _io_pool = concurrent.futures.ThreadPoolExecutor(max_workers=IO_WORKERS,
+                                                             thread_name_prefix="equity-explorer-io")
+
+    return _io_pool
+
+
+def cpu_pool():
+    """
+    :return: The process pool for CPU-bound tasks.
+    """
+    global _cpu_pool
+    with _pool_lock:
+        if _cpu_pool is None:
+            _cpu_pool = concurrent.futures.ProcessPoolExecutor(max_workers=CPU_WORKERS)
+
+    return _cpu_pool
+
+
+def submit(func, *args, cpu=False, pool=None):
+    """
+    Submits a task to one of the pools.
+    :param func: The function to call, it has to be picklable if cpu is True.
+    :param args: The arguments of the function.
+    :param cpu: (Default value = False) Run the task in the process pool instead of the thread pool.
+    :param pool: (Default value = None) Thread pool to run the task in instead of the shared one.
+    :return: concurrent.futures.Future of the task.
+    """
+    if cpu:
+        # Within a trace the spans recorded in the worker process are merged back with the result.
+        return tracing.submit_to_process(cpu_pool(), func, *args)
+
+    # The context variables of the caller are passed on to the worker thread.
+    return (pool or io_pool()).submit(contextvars.copy_context().run, func, *args)
+
+
+def run_tasks(tasks, timeout=None, cpu=False, workers=None):
+    """
+    Runs several tasks at once and waits for their results.
+    :param tasks: Dictionary of the following form -> key : (func, args).
+    :param timeout: (Default value = None) Seconds each task may take, counted from the moment it starts running, so
+        that tasks waiting for a free worker do not use up their time.
+    :param cpu: (Default value = False) Run the tasks in the process pool instead of the thread pool.
+    :param workers: (Default value = None) Run the tasks in a thread pool of their own with this many workers instead
+        of the shared one, e.g. to set the number of concurrent requests of a batch job. Ignored if cpu is True.
+    :return: Dictionary key : result in the order of the tasks. Tasks that failed or timed out are left out.
+    """
+    pool = None
+    if workers is not None and not cpu:
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="equity-explorer-tasks")
+    try:
+        return _run_tasks(tasks, timeout, cpu, pool)
+    finally:
+        if pool is not None:
+            # Tasks that timed out finish in the background, the threads of the pool end with them.
+            pool.shutdown(wait=False)
+
+
+def _run_tasks(tasks, timeout, cpu, pool):
+    if cpu or timeout is None:
+        futures = {key: submit(func, *args, cpu=cpu, pool=pool) for key, (func, args) in tasks.items()}
+    else:
+        futures = {key: submit(_with_deadline, timeout, func, *args, pool=pool) for key, (func, args) in tasks.items()}
+
+    results = {}
+    started = {}
+    pending = dict(futures)
+    while pending:
+        if timeout is None:
+            concurrent.futures.wait(pending.values())
+        else:
+            # The clock of a task starts once a worker picked it up, which is checked every POLL_INTERVAL.
+            now = time.monotonic()
+            for key, future in pending.items():
+                if key not in started and _worker_future(future).running():
+                    started[key] = now
+            deadlines = [started[key] + timeout for key in pending if key in started]
+            wait = min([POLL_INTERVAL] + [deadline - now for deadline in deadlines])
+            concurrent.futures.wait(pending.values(), timeout=max(wait, 0),
+                                    return_when=concurrent.futures.FIRST_COMPLETED)
+
+        now = time.monotonic()
+        for key, future in list(pending.items()):
+            if future.done():
+                del pending[key]
+                try:
+                    results[key] = future.result()
+                except Exception as error:
+                    logger.error("Task %s failed: %r", key, error)
+            elif timeout is not None and key in started and now - started[key] >= timeout:
+                del pending[key]
+                _worker_future(future).cancel()  # Running tasks can not be stopped, their result is ignored.
+                logger.warning("Task %s timed out after %s seconds", key, timeout)
+
+    return {key: results[key] for key in futures if key in results}
+
+
+def _with_deadline(timeout, func, *args):
+    # The deadline starts with the task, the requests sent after it raise TimeoutError.
+    with scheduler.deadline(timeout):
+        return func(*args)
+
+
+def _worker_future(future):
+    # Futures of traced process tasks stand in for the future of the worker, see tracing.submit_to_process.
+    return getattr(future, "worker_future", future)
+
+
+def shutdown():
+    """
+    Stops both pools, e.g. when the server is closed.
+    """
+    global _io_pool, _cpu_pool
+    with _pool_lock:
+        for pool in (_io_pool, _cpu_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        _io_pool = None
+        _cpu_pool = None
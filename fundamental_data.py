@@ -1,73 +1,60 @@
 """
-All values in this module will be stored in memory using redis, to offer a fast way to reuse the data.
-The logic within redis is as follows:
+All values in this module are cached in memory (see cache.py), to offer a fast way to reuse the data.
+The logic of the cache keys is as follows:
 
     stock_ticker + "_" + value_type
 
     - stock_ticker: The ticker symbol of the stock.
     - value_type: The kind of data requested. Through this Module it is possible to request "fundamentals", "ticker_info" and "dividends".
 
-The values are stored as pickle elements which is in general a dependency of this module and will be transformed to Pandas-DataFrames.
+If redis is configured as the backend of the cache, the values are stored as pickle elements.
 A subscription for the Polygon.io Stocks-Starter is necessary to request the data.
 """
 
 import json
 import pandas as pd
-import requests
+from . import http_client
+from . import metrics
+from . import tracing
+from .cache import cached
+from .http_client import PolygonError
 
 
 def handle_response(response, asset_ticker, client_error_message, show=False):
     """
-    This function handles the response from the API.
+    This function handles the response from the API, the body is parsed exactly once.
     :param response: The response from the API.
     :param asset_ticker: The ticker of the asset.
     :param client_error_message: The message to display if the client made an error.
     :return: The response in JSON format.
     """
 
-    data = None
+    # Raises RateLimitError on 429 and PolygonError on any other 4xx or 5xx.
+    http_client.check_status(response, asset_ticker, client_error_message)
 
-    if str(response.status_code)[0] == "4" or response.json()["results"] == []:
-        raise Exception(f"{client_error_message} for {asset_ticker}")
-    elif str(response.status_code)[0] == "2":
-        data = response.json()
-        if show: print(json.dumps(response.json(), sort_keys=True, indent=4))
-    elif str(response.status_code)[0] == "5":
-        raise Exception("Internal server error, please try again later")
+    data = response.json()
+    if not data.get("results"):
+        raise PolygonError(f"{client_error_message} for {asset_ticker}", response.status_code)
+    if show: print(json.dumps(data, sort_keys=True, indent=4))
 
     return data
 
 
-# TODO Idea: Make the API Calls asynchronous.
-def get_fundamentals(api_key, asset_ticker="AAPL", show=False, aggregate=False, statement_type="balance_sheet"):
+def _parse_statements(data, asset_ticker):
     """
-    This function retrieves the fundamentals of a given asset.
-    :param api_key: The API key for Polygon.io.
-    :param asset_ticker: (Default value = "AAPL") The ticker of the asset.
-    :param show: (Default value = False) Print the response to the console.
-    :param aggregate: (Default value = False) Aggregate the statements by statement type.
-    :param statement_type: (Default value = "balance_sheet") The type of statement to aggregate.
+    This function converts the filings of a financials response into DataFrames.
+    :param data: The "results" of the financials response.
+    :param asset_ticker: The ticker of the asset.
     :return: Dictionary of the following form -> (ticker, filing_date, number) : statement_df.
     """
 
-    # Url to request the data from Polygon.io.
-    url = (f"https://api.polygon.io/vX/reference/financials?ticker="
-           f"{asset_ticker}"
-           f"&apiKey={api_key}")
-    
-    # Request the data from Polygon.io.
-    response = requests.get(url)
-
-    # Ensure to handle cases where no data is avaible properly. 
-    data = handle_response(response, asset_ticker, "No fundamentals found", show=show)["results"]
-
     all_statements = {}
     # Iterate through the filings and the statements in each filing.
     for number in range(0,len(data)):
         for statement in data[number]["financials"].keys():
             
             # Get the reporting period to categorize the statement - period is stored in a Tuple.
-            reporting_period = (data[number]["start_date"], data[number]["start_date"]) 
+            reporting_period = (data[number]["start_date"], data[number]["end_date"])
 
             # Get the statement and convert it to a DataFrame with the provided "order" as the index.
             raw_statement = data[number]["financials"][statement]
@@ -82,48 +69,181 @@ def get_fundamentals(api_key, asset_ticker="AAPL", show=False, aggregate=False,
             # Add the statement to the dictionary with the key being the tuple (ticker, reporting_period, statement).
             all_statements[(asset_ticker, reporting_period, statement)] = statement_df
 
-    # Aggregate the statements by statement type.
+    return all_statements
+
+
+# Columns of the long format of the filings, one row per line item of a statement in a filing.
+FINANCIALS_COLUMNS = ["ticker", "fiscal_year", "fiscal_period", "start_date", "end_date", "statement", "order", "label",
+                      "value"]
+
+
+@tracing.traced("parse")
+@metrics.timed("parse_seconds")
+def normalize_financials(data, asset_ticker, statement_types=None):
+    """
+    This function flattens the filings of a financials response into one table in a single pass.
+    Statements that are not requested are skipped before anything is built.
+    :param data: The "results" of the financials response.
+    :param asset_ticker: The ticker of the asset.
+    :param statement_types: (Default value = None) The types of statements to keep, all if None.
+    :return: DataFrame in long format with the columns of FINANCIALS_COLUMNS.
+    """
+    records = [(asset_ticker, filing.get("fiscal_year") or "", filing.get("fiscal_period") or "",
+                filing["start_date"], filing["end_date"], statement,
+                item.get("order", 0), item.get("label"), item.get("value"))
+               for filing in data
+               for statement, items in filing["financials"].items()
+               if statement_types is None or statement in statement_types
+               for item in items.values()]
+
+    financials = pd.DataFrame.from_records(records, columns=FINANCIALS_COLUMNS)
+    financials["value"] = financials["value"].astype("float64")
+
+    return financials
+
+
+@tracing.traced("parse")
+@metrics.timed("parse_seconds")
+def pivot_statement(financials, statement_type):
+    """
+    This function aggregates the line items of one statement type over all filings with one pivot.
+    :param financials: The output of normalize_financials.
+    :param statement_type: The type of statement to aggregate.
+    :return: DataFrame with the line items (order, label) as index and the reporting periods as columns, the most
+        recent period first. Line items that are missing in a filing are filled with 0.
+    """
+    statement = financials[financials["statement"] == statement_type]
+    if statement.empty:
+        return pd.DataFrame()
+
+    aggregated_df = statement.pivot_table(index=["order", "label"], columns=["start_date", "end_date"],
+                                          values="value", aggfunc="first", fill_value=0)
+    aggregated_df.columns.names = [None, None]
+    aggregated_df.index.names = [None, None]
+    aggregated_df.sort_index(axis=1, inplace=True, ascending=False)
+
+    return aggregated_df
+
+
+@tracing.traced("fundamentals")
+@cached("fundamentals")
+def _request_financials(api_key, asset_ticker, show=False):
+    """
+    This function requests the raw filings of a given asset.
+    :param api_key: The API key for Polygon.io.
+    :param asset_ticker: The ticker of the asset.
+    :param show: (Default value = False) Print the response to the console.
+    :return: The "results" of the financials response.
+    """
+
+    # Request the data from Polygon.io.
+    response = http_client.get(http_client.api_url("/vX/reference/financials", api_key, ticker=asset_ticker))
+
+    # Ensure to handle cases where no data is avaible properly. 
+    return handle_response(response, asset_ticker, "No fundamentals found", show=show)["results"]
+
+
+@cached("fundamentals")
+async def _request_financials_async(api_key, asset_ticker, show=False):
+    """
+    Asynchronous version of _request_financials.
+    """
+
+    response = await http_client.get_async(http_client.api_url("/vX/reference/financials", api_key,
+                                                               ticker=asset_ticker))
+
+    return handle_response(response, asset_ticker, "No fundamentals found", show=show)["results"]
+
+
+@tracing.traced("fundamentals")
+def get_fundamentals(api_key, asset_ticker="AAPL", show=False, aggregate=False, statement_type="balance_sheet"):
+    """
+    This function retrieves the fundamentals of a given asset.
+    :param api_key: The API key for Polygon.io.
+    :param asset_ticker: (Default value = "AAPL") The ticker of the asset.
+    :param show: (Default value = False) Print the response to the console.
+    :param aggregate: (Default value = False) Aggregate the statements by statement type.
+    :param statement_type: (Default value = "balance_sheet") The type of statement to aggregate.
+    :return: Dictionary of the following form -> (ticker, filing_date, number) : statement_df.
+    """
+
+    data = _request_financials(api_key, asset_ticker, show=show)
+
+    # Aggregate the statements by statement type, only the requested type is processed.
     if aggregate:
-        aggregated_statements = {}
-        aggregated_index = []
-        for statement in all_statements.keys():
-
-            if statement[2] == "balance_sheet" and statement_type == "balance_sheet":
-                aggregated_statements[statement[1]] = all_statements[statement][["value"]]
-                index = all_statements[statement].index.to_list()
-                if len(aggregated_index) < len(index):
-                    aggregated_index = index
-
-            elif statement[2] == "income_statement" and statement_type == "income_statement":
-                aggregated_statements[statement[1]] = all_statements[statement][["value"]]
-                index = all_statements[statement].index.to_list()
-                if len(aggregated_index) < len(index):
-                    aggregated_index = index
-
-            elif statement[2] == "cash_flow_statement" and statement_type == "cash_flow_statement":
-                aggregated_statements[statement[1]] = all_statements[statement][["value"]]
-                index = all_statements[statement].index.to_list()
-                if len(aggregated_index) < len(index):
-                    aggregated_index = index
-
-            elif statement[2] == "comprehensive_income" and statement_type == "comprehensive_income":
-                aggregated_statements[statement[1]] = all_statements[statement][["value"]]
-                index = all_statements[statement].index.to_list()
-                if len(aggregated_index) < len(index):
-                    aggregated_index = index
-
-        actual_index = pd.MultiIndex.from_tuples(aggregated_index)  # Create a MultiIndex from the list of tuples.
-
-        for key, value in aggregated_statements.items():
-            value = value.reindex(actual_index, fill_value=0)  # Fill missing values with 0.
-            aggregated_statements[key] = value["value"].to_list()
-
-        all_statements = pd.DataFrame(aggregated_statements, index=actual_index)
-        all_statements.sort_index(axis=1, inplace=True, ascending=False)
+        return pivot_statement(normalize_financials(data, asset_ticker, [statement_type]), statement_type)
+
+    return _parse_statements(data, asset_ticker)
+
+
+async def get_fundamentals_async(api_key, asset_ticker="AAPL", show=False, aggregate=False,
+                                 statement_type="balance_sheet"):
+    """
+    Asynchronous version of get_fundamentals.
+    """
+
+    data = await _request_financials_async(api_key, asset_ticker, show=show)
+
+    if aggregate:
+        return pivot_statement(normalize_financials(data, asset_ticker, [statement_type]), statement_type)
+
+    return _parse_statements(data, asset_ticker)
+
+
+def get_financials(api_key, asset_ticker="AAPL", show=False, statement_types=None):
+    """
+    This function retrieves the filings of a given asset in long format.
+    :param api_key: The API key for Polygon.io.
+    :param asset_ticker: (Default value = "AAPL") The ticker of the asset.
+    :param show: (Default value = False) Print the response to the console.
+    :param statement_types: (Default value = None) The types of statements to keep, all if None.
+    :return: DataFrame with the columns of FINANCIALS_COLUMNS.
+    """
+
+    return normalize_financials(_request_financials(api_key, asset_ticker, show=show), asset_ticker, statement_types)
+
+
+async def get_financials_async(api_key, asset_ticker="AAPL", show=False, statement_types=None):
+    """
+    Asynchronous version of get_financials.
+    """
+
+    data = await _request_financials_async(api_key, asset_ticker, show=show)
+
+    return normalize_financials(data, asset_ticker, statement_types)
 
-    return all_statements
+
+def get_statements(api_key, asset_ticker="AAPL", show=False,
+                   statement_types=("balance_sheet", "income_statement")):
+    """
+    This function retrieves several aggregated statements of a given asset with a single request.
+    :param api_key: The API key for Polygon.io.
+    :param asset_ticker: (Default value = "AAPL") The ticker of the asset.
+    :param show: (Default value = False) Print the response to the console.
+    :param statement_types: The types of statements to aggregate.
+    :return: Dictionary of the following form -> statement_type : aggregated statement_df.
+    """
+
+    data = _request_financials(api_key, asset_ticker, show=show)
+    financials = normalize_financials(data, asset_ticker, statement_types)
+
+    return {statement_type: pivot_statement(financials, statement_type) for statement_type in statement_types}
+
+
+async def get_statements_async(api_key, asset_ticker="AAPL", show=False,
+                               statement_types=("balance_sheet", "income_statement")):
+    """
+    Asynchronous version of get_statements.
+    """
+
+    data = await _request_financials_async(api_key, asset_ticker, show=show)
+    financials = normalize_financials(data, asset_ticker, statement_types)
+
+    return {statement_type: pivot_statement(financials, statement_type) for statement_type in statement_types}
 
 
+@tracing.traced("fundamentals")
+@cached("ticker_info")
 def get_ticker_info(api_key, asset_ticker="AAPL", show=False):
     """
     This function is used, to return info about a given ticker.
@@ -133,8 +253,7 @@ def get_ticker_info(api_key, asset_ticker="AAPL", show=False):
     """
     
     # Request the data from Polygon.io.
-    url = f"https://api.polygon.io/v3/reference/tickers/{asset_ticker}?apiKey={api_key}"
-    response = requests.get(url)
+    response = http_client.get(http_client.api_url(f"/v3/reference/tickers/{asset_ticker}", api_key))
     
     # Handle the response give by Polygon.io.
     info = handle_response(response, asset_ticker, "No information found", show=show)
@@ -143,6 +262,20 @@ def get_ticker_info(api_key, asset_ticker="AAPL", show=False):
     return info_df
 
 
+@cached("ticker_info")
+async def get_ticker_info_async(api_key, asset_ticker="AAPL", show=False):
+    """
+    Asynchronous version of get_ticker_info.
+    """
+
+    response = await http_client.get_async(http_client.api_url(f"/v3/reference/tickers/{asset_ticker}", api_key))
+    info = handle_response(response, asset_ticker, "No information found", show=show)
+
+    return pd.DataFrame(info)["results"]
+
+
+@tracing.traced("fundamentals")
+@cached("dividends", ticker_parameter="ticker")
 def get_dividends(api_key, ticker="AAPL", show=False):
     """
     This function is used, to return the dividends of a stock.
@@ -152,10 +285,21 @@ def get_dividends(api_key, ticker="AAPL", show=False):
     """
     
     # Request the data from Polygon.io.
-    url = f"https://api.polygon.io/v3/reference/dividends?ticker={ticker}&apiKey={api_key}"
-    response = requests.get(url)
+    response = http_client.get(http_client.api_url("/v3/reference/dividends", api_key, ticker=ticker))
 
     data = handle_response(response, ticker, "No dividends found", show=show)["results"]
     dividends_df = pd.DataFrame(data)  # First filtering for "results" then declaring the df is correct order here.
 
     return dividends_df
+
+
+@cached("dividends", ticker_parameter="ticker")
+async def get_dividends_async(api_key, ticker="AAPL", show=False):
+    """
+    Asynchronous version of get_dividends.
+    """
+
+    response = await http_client.get_async(http_client.api_url("/v3/reference/dividends", api_key, ticker=ticker))
+    data = handle_response(response, ticker, "No dividends found", show=show)["results"]
+
+    return pd.DataFrame(data)
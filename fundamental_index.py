@@ -0,0 +1,102 @@
+"""
+Index over the filings of a ticker, built once when the filings are loaded.
+It holds the value of every line item per fiscal period, the most recent value of every line item and its sum over
+the trailing twelve months (TTM), so that the ratios only need a dictionary lookup instead of scanning the columns of
+the statements.
+"""
+
+import math
+import pandas as pd
+
+
+TTM_DAYS = (350, 380)  # Days from the start of the first to the end of the last of four consecutive quarters.
+
+
+class FundamentalsIndex:
+
+    def __init__(self, financials):
+        """
+        :param financials: The filings in long format, see fundamental_data.normalize_financials.
+        """
+        financials = financials.dropna(subset=["value"])
+
+        # The filings keyed by their fiscal period, the most recent first.
+        periods = (financials[["fiscal_year", "fiscal_period", "start_date", "end_date"]]
+                   .drop_duplicates(["fiscal_year", "fiscal_period"])
+                   .sort_values(["end_date", "start_date"], ascending=False))
+        self.periods = list(zip(periods["fiscal_year"], periods["fiscal_period"]))
+        self._start_dates = dict(zip(self.periods, periods["start_date"]))
+        self._end_dates = dict(zip(self.periods, periods["end_date"]))
+
+        values = financials.pivot_table(index="label", columns=["fiscal_year", "fiscal_period"],
+                                        values="value", aggfunc="first")
+        values = values.reindex(columns=pd.MultiIndex.from_tuples(self.periods))
+        self._by_period = {period: values[period].dropna().to_dict() for period in self.periods}
+
+        # Most recent value of every line item, taken from the most recent filing that reports it.
+        self._latest = values.bfill(axis=1).iloc[:, 0].dropna().to_dict() if len(self.periods) else {}
+
+        # Sum of the four most recent quarters. If less than four quarters are reported or a quarter is missing in
+        # between, so that they do not span about a year, the most recent annual filing is used instead.
+        self._quarters = [period for period in self.periods if str(period[1]).startswith("Q")]
+        quarters = self._quarters[:4]
+        annual = [period for period in self.periods if period[1] == "FY"][:1]
+        self._ttm = {}
+        if len(quarters) == 4 and spans_year(self._start_dates[quarters[-1]], self._end_dates[quarters[0]]):
+            self._ttm = values[quarters].sum(axis=1, min_count=4).dropna().to_dict()
+        if annual:
+            for label, value in values[annual[0]].dropna().items():
+                self._ttm.setdefault(label, value)
+
+    def latest(self, label, default=math.nan):
+        """
+        :return: The most recent value of the line item, e.g. "Equity".
+        """
+        return self._latest.get(label, default)
+
+    def ttm(self, label, default=math.nan):
+        """
+        :return: The sum of the line item over the trailing twelve months, e.g. "Basic Earnings Per Share".
+        """
+        return self._ttm.get(label, default)
+
+    def value(self, label, fiscal_year, fiscal_period, default=math.nan):
+        """
+        :return: The value of the line item in the filing of the given fiscal period, e.g. ("2023", "Q2").
+        """
+        return self._by_period.get((fiscal_year, fiscal_period), {}).get(label, default)
+
+    def quarterly(self, label):
+        """
+        :return: Series of the line item in every quarterly filing, indexed by the end of the quarter in ascending
+            order, e.g. to follow "Basic Earnings Per Share" over time.
+        """
+        values = {pd.Timestamp(self._end_dates[period]): self._by_period[period][label]
+                  for period in self._quarters if label in self._by_period[period]}
+
+        return pd.Series(values, dtype="float64").sort_index()
+
+    def ttm_history(self, label):
+        """
+        :return: Series of the sum of the line item over every four consecutive quarters that span about a year (see
+            spans_year), indexed by the end of the last quarter in ascending order. Sums over a missing quarter are
+            left out.
+        """
+        quarters = [period for period in reversed(self._quarters) if label in self._by_period[period]]
+        values = {}
+        for position in range(3, len(quarters)):
+            window = quarters[position - 3:position + 1]
+            if spans_year(self._start_dates[window[0]], self._end_dates[window[-1]]):
+                values[pd.Timestamp(self._end_dates[window[-1]])] = sum(self._by_period[period][label]
+                                                                        for period in window)
+
+        return pd.Series(values, dtype="float64").sort_index()
+
+
+def spans_year(start_date, end_date):
+    """
+    :return: True if the filings from start_date to end_date cover about twelve months, see TTM_DAYS.
+    """
+    days = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days
+
+    return TTM_DAYS[0] <= days <= TTM_DAYS[1]
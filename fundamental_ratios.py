@@ -1,8 +1,19 @@
-import datetime as dt
+import asyncio
+import logging
 import pandas as pd
-from scipy.stats import gmean
+from . import http_client
+from . import metrics
+from . import tracing
 from .price_data import Asset
-from .fundamental_data import get_dividends
+from .fundamental_data import (get_dividends, get_financials, get_dividends_async, get_financials_async,
+                               get_ticker_info_async, pivot_statement)
+from .fundamental_index import FundamentalsIndex
+
+
+STATEMENT_TYPES = ("balance_sheet", "income_statement")
+
+logger = logging.getLogger(__name__)
+metrics.counter("load_failures_total", "Datasets of a Stock that could not be requested by dataset.")
 
 
 # This class primarily works as a plain old data class.
@@ -13,165 +24,224 @@ class Stock(Asset):
 
     def __init__(self, api_key, asset_ticker, asset_class="Stock"):
         super().__init__(api_key, asset_ticker, asset_class)
+        # The data bundle shared by all ratios - filled once through load_data().
+        self.prices = None
+        self.balance_sheet = None
+        self.income_statement = None
+        self.fundamentals_index = None
+        self.infos = None
+        self.dividends = None
+
+    @tracing.traced("load")
+    def load_data(self):
+        """
+        Requests every dataset the ratios need, with at most one request per endpoint.
+        :return: The Stock itself, so that the call can be chained.
+        """
+        self._set_financials(_request_or_none(get_financials, self.api_key,
+                                              asset_ticker=self.asset_ticker,
+                                              statement_types=STATEMENT_TYPES))
+        self.prices = _request_or_none(self.get_prices)
+        self.infos = _request_or_none(self.get_infos)
+        self.dividends = _request_or_none(get_dividends, api_key=self.api_key, ticker=self.asset_ticker)
+
+        return self
+
+    async def load_data_async(self):
+        """
+        Asynchronous version of load_data, the endpoints are requested concurrently.
+        :return: The Stock itself, so that the call can be chained.
+        """
+        results = await asyncio.gather(
+            get_financials_async(self.api_key, asset_ticker=self.asset_ticker, statement_types=STATEMENT_TYPES),
+            self.get_prices_async(),
+            get_ticker_info_async(api_key=self.api_key, asset_ticker=self.asset_ticker),
+            get_dividends_async(api_key=self.api_key, ticker=self.asset_ticker),
+            return_exceptions=True)
+        financials, self.prices, self.infos, self.dividends = [None if isinstance(result, Exception) else result
+                                                               for result in results]
+        self._set_financials(financials)
+
+        return self
+
+    def _set_financials(self, financials):
+        # The statements and the index of the filings are built once from the same response.
+        if financials is None:
+            return
+        self.balance_sheet = pivot_statement(financials, "balance_sheet")
+        self.income_statement = pivot_statement(financials, "income_statement")
+        self.fundamentals_index = FundamentalsIndex(financials)
+
+
+def _request_or_none(request, *args, **kwargs):
+    # A missing dataset (e.g. a stock without dividends) only affects the ratios that rely on it, they return pd.NA.
+    # Errors other than failed requests are bugs and are raised.
+    try:
+        return request(*args, **kwargs)
+    except http_client.REQUEST_ERRORS as error:
+        name = getattr(request, "__name__", str(request))
+        logger.warning("Request %s failed: %s", name, error)
+        metrics.observe("load_failures_total", 1, dataset=name)
+        return None
+
+
+def _last_close(stock_class):
+    # The most recent closing price or None if the prices could not be loaded.
+    prices = stock_class.prices
+    if prices is None or prices.empty or "c" not in prices:
+        return None
+
+    return prices["c"].iloc[-1]
 
 
-def ep_ratio(stock_class: Stock, concurrency_manager):
+@tracing.traced("ratio")
+@metrics.timed("ratio_seconds")
+def ep_ratio(stock_class: Stock):
     """
     This function calculates the Earnings-Yield of a stock.
     
     stock_class: Stock class that stored all its specific data to make requests with.
-    :return: Earnings-Yield or None.
+    :return: Dictionary with the Earnings-Yield or pd.NA.
     """
-    # Setting the start and end date for the request. 
-    start = (dt.datetime.today() - dt.timedelta(days=720)).strftime("%Y-%m-%d")
-    end = dt.datetime.today().strftime("%Y-%m-%d")
-
-    # Requesting the fundamental stock data.
-    fundamentals = stock_class.get_fundamentals(statement_type="income_statement")
-
-    # Fetching the filing dates of the current year. 
-    #  TODO Idea: The file should fetch the most recent values not just from this year.
-    filings_dates = fundamentals.columns
-
-    # TODO Idea: This could be calculated more carefully. On this value a lot of metrics are based on.
-    #      Current strategy is to use the values of the past year and this year.
-    #      If there are more recent values this year the values from past year will be ignored.
-    current_years_filings = [date for date in filings_dates if (
-                str(dt.datetime.today().year - 1) in str(date) or str(dt.datetime.today().year) in str(date))]
-
-    # Removing old values if they exist so that only the 4 most recent values are included in the calculation.
-    if 4 < len(current_years_filings):
-        # Calculating the last index of the relevant data
-        lower_bound = 4 - len(current_years_filings)
-        current_years_filings = current_years_filings[0:lower_bound]
-    print(current_years_filings)
-    # Getting the earnings of the list, that was cleaned above and summing up the earnings.
-    eps = fundamentals[current_years_filings].loc[(4200, "Basic Earnings Per Share")].to_list()
-    summed_eps = sum(eps)
-
-    # Grabbing the current stock price.
-    # TODO Idea: There could be a faster request for this.
-    price = stock_class.get_prices()["c"][-1]
+    price = _last_close(stock_class)
+    if stock_class.fundamentals_index is None or price is None:
+        return {"E/P Ratio": pd.NA}
+
+    # The earnings of the trailing twelve months are precomputed in the index of the filings.
+    summed_eps = stock_class.fundamentals_index.ttm("Basic Earnings Per Share")
 
     # Calculate the actual calculation.
     try:
         stock_ep_ratio = summed_eps / price
-        concurrency_manager["E/P Ratio"] = {"E/P Ratio": round(stock_ep_ratio, 4)}
-        return round(stock_ep_ratio, 4)
+        return {"E/P Ratio": round(stock_ep_ratio, 4)}
     except ZeroDivisionError:
-        concurrency_manager["E/P Ratio"] = {"E/P Ratio": pd.NA}
-        return None
+        return {"E/P Ratio": pd.NA}
 
 
-def pb_ratio(stock_class: Stock, concurrency_manager):
+@tracing.traced("ratio")
+@metrics.timed("ratio_seconds")
+def pb_ratio(stock_class: Stock):
     """
     Calculate the Price-To-Book ratio.
 
     stock_class: Stock class that stored all its specific data to make requests with.
-    :return: Price-To-Book-Ratio or None.
+    :return: Dictionary with the Price-To-Book-Ratio or pd.NA.
     """
 
-    # Setting the start and end date for the request. 
-    start = (dt.datetime.today() - dt.timedelta(days=5)).strftime("%Y-%m-%d")
-    end = (dt.datetime.today() - dt.timedelta(days=1)).strftime("%Y-%m-%d")
-
-    # Requesting the data that is needed for the calculation.
-    equity = stock_class.get_fundamentals(statement_type="balance_sheet").loc[(1400, "Equity")][0]
-    shares = stock_class.get_infos()["weighted_shares_outstanding"]
-    price = stock_class.get_prices()["c"][-1]
+    # Taking the data that is needed for the calculation from the bundle.
+    price = _last_close(stock_class)
+    shares = None if stock_class.infos is None else stock_class.infos.get("weighted_shares_outstanding")
+    if stock_class.fundamentals_index is None or price is None or shares is None:
+        return {"P/B Ratio": pd.NA}
+    equity = stock_class.fundamentals_index.latest("Equity")
 
     # Do the actual calculation.
     try:
         pb_ratio = price / (equity / shares)
-        concurrency_manager["P/B Ratio"] = {"P/B Ratio": round(pb_ratio, 2)}
-        return round(pb_ratio, 2)
+        return {"P/B Ratio": round(pb_ratio, 2)}
     except ZeroDivisionError:
-        concurrency_manager["P/B Ratio"] = {"P/B Ratio": pd.NA}
-        return None
+        return {"P/B Ratio": pd.NA}
 
 
-def current_ratio(stock_class: Stock, concurrency_manager):
+@tracing.traced("ratio")
+@metrics.timed("ratio_seconds")
+def current_ratio(stock_class: Stock):
     """
     Calculate the Current Ratio for a Stock.
     stock_class: Stock class that stored all its specific data to make requests with.
-    :return: Price-To-Book-Ratio or None.
+    :return: Dictionary with the Current Ratio or pd.NA.
     """
 
-    # Request the data needed.
-    fundamental_data = stock_class.get_fundamentals(statement_type="balance_sheet")
-    assets = fundamental_data.loc[(100, "Assets")][0]
-    liabilities = fundamental_data.loc[(600, "Liabilities")][0]
+    # Take the data needed from the bundle.
+    if stock_class.fundamentals_index is None:
+        return {"Current Ratio": pd.NA}
+    assets = stock_class.fundamentals_index.latest("Assets")
+    liabilities = stock_class.fundamentals_index.latest("Liabilities")
 
     # Do the actual calculation.
     try:
         current_ratio = assets / liabilities
-        concurrency_manager["Current Ratio"] = {"Current Ratio": round(current_ratio, 2)}
-        return round(current_ratio, 2)
+        return {"Current Ratio": round(current_ratio, 2)}
     except ZeroDivisionError:
-        concurrency_manager["Current Ratio"] = {"Current Ratio": pd.NA}
-        return None
+        return {"Current Ratio": pd.NA}
 
 
-def ro_equity(stock_class: Stock, concurrency_manager):
+@tracing.traced("ratio")
+@metrics.timed("ratio_seconds")
+def ro_equity(stock_class: Stock):
     """
     Calculate the Return-On-Equity for a given stock.
 
     stock_class: Stock class that stored all its specific data to make requests with.
-    :return: Price-To-Book-Ratio or None.
+    :return: Dictionary with the Return-On-Equity or pd.NA.
     """
 
-    # Request the data necessary. 
-    equity = stock_class.get_fundamentals(statement_type="balance_sheet").loc[(1400, "Equity")][0]
-    income = stock_class.get_fundamentals(statement_type="income_statement").loc[(3200, "Net Income/Loss")][0]
+    # Take the data necessary from the bundle.
+    if stock_class.fundamentals_index is None:
+        return {"ROE": pd.NA}
+    equity = stock_class.fundamentals_index.latest("Equity")
+    income = stock_class.fundamentals_index.ttm("Net Income/Loss")
 
     # Do the actual calculation.
     try:
         roe = income / equity
-        concurrency_manager["ROE"] = {"ROE": round(roe, 2)}
-        return round(roe, 2)
+        return {"ROE": round(roe, 2)}
     except ZeroDivisionError:
-        concurrency_manager["ROE"] = {"ROE": pd.NA}
-        return None
+        return {"ROE": pd.NA}
 
 
-def ro_assets(stock_class: Stock, concurrency_manager):
+@tracing.traced("ratio")
+@metrics.timed("ratio_seconds")
+def ro_assets(stock_class: Stock):
     """
     Calculate the Return-On-Asset for a given stock.
 
     stock_class: Stock class that stored all its specific data to make requests with.
-    :return: Price-To-Book-Ratio or None.
+    :return: Dictionary with the Return-On-Assets or pd.NA.
     """
 
-    # Request the data necessary. 
-    assets = stock_class.get_fundamentals(statement_type="balance_sheet").loc[(100, "Assets")][0]
-    income = stock_class.get_fundamentals(statement_type="income_statement").loc[(3200, "Net Income/Loss")][0]
+    # Take the data necessary from the bundle.
+    if stock_class.fundamentals_index is None:
+        return {"ROA": pd.NA}
+    assets = stock_class.fundamentals_index.latest("Assets")
+    income = stock_class.fundamentals_index.ttm("Net Income/Loss")
 
     # Do the actual calculation.
     try:
         roa = income / assets
-        concurrency_manager["ROA"] = {"ROA": round(roa, 2)}
-        return round(roa, 2)
+        return {"ROA": round(roa, 2)}
     except ZeroDivisionError:
-        concurrency_manager["ROA"] = {"ROA": pd.NA}
-        return None
+        return {"ROA": pd.NA}
 
 
-def div_growth(stock_class: Stock, concurrency_manager):
+@tracing.traced("ratio")
+@metrics.timed("ratio_seconds")
+def div_growth(stock_class: Stock):
     """
     Calculate the Dividend Growth for a given Stock.
     
     stock_class: Stock class that stored all its specific data to make requests with.
-    :return: Price-To-Book-Ratio or None.
+    :return: Dictionary with the average Dividend Growth or pd.NA.
     """
 
-    # Request the data necessary. 
-    dividends = get_dividends(api_key=stock_class.api_key, ticker=stock_class.asset_ticker)
+    # Take the data necessary from the bundle.
+    dividends = stock_class.dividends
+    if dividends is None or "cash_amount" not in dividends:
+        return {"Average Dividend growth": pd.NA}
 
     # Calculate the divided growth for all dividends.
     dividends_growth = dividends["cash_amount"][::-1].pct_change(periods=1).dropna()
     # Calculate the geometric average of the dividend growth.
+    from scipy.stats import gmean  # Imported on first use, it takes longer to import than the rest of the package.
     average_dividends = round(gmean([rate + 1 for rate in dividends_growth.to_list()]) - 1, 3)
 
-    concurrency_manager["Average Dividend growth"] = {"Average Dividend growth": average_dividends}
+    return {"Average Dividend growth": average_dividends}
+
 
-    return average_dividends
+# Every ratio of this module by the name of the value it returns, in the order of the columns of the tables.
+RATIOS = {"E/P Ratio": ep_ratio,
+          "P/B Ratio": pb_ratio,
+          "Current Ratio": current_ratio,
+          "ROE": ro_equity,
+          "ROA": ro_assets,
+          "Average Dividend growth": div_growth}
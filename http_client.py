@@ -0,0 +1,238 @@
+"""
+HTTP layer for all requests to Polygon.io.
+The synchronous functions share one requests.Session, the asynchronous functions one aiohttp.ClientSession per event
+loop, so that connections to the API are kept alive and reused instead of paying a new TLS handshake for every call.
+The address of the API can be changed through the environment variable "POLYGON_API_URL", e.g. to a local server.
+Every request is sent through the request scheduler (see scheduler.py), that keeps the requests within the quota and
+retries them on 429 and 5xx.
+"""
+
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import weakref
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from . import metrics
+from . import tracing
+from .scheduler import request_scheduler, time_left
+
+
+API_URL = os.getenv("POLYGON_API_URL", "https://api.polygon.io").rstrip("/")
+
+POOL_SIZE = 32  # Maximum number of connections kept open to the API.
+TIMEOUT = 30  # Seconds until a request is aborted.
+
+
+class PolygonError(Exception):
+    """
+    Raised if Polygon.io answers a request with an error or without data.
+    """
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RateLimitError(PolygonError):
+    """
+    Raised if a request was still answered with 429 after all retries of the scheduler.
+    """
+
+
+# Errors of a request that failed, e.g. to catch them without hiding bugs in the code processing the responses.
+# TimeoutError is raised for requests after the deadline of their task, see scheduler.deadline.
+REQUEST_ERRORS = (PolygonError, requests.RequestException, TimeoutError)
+
+
+class Response:
+    """
+    Status code, headers and body of a response. The body is parsed at most once.
+    """
+
+    def __init__(self, status_code, text, url, headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.url = url
+        self.headers = headers or {}
+        self._json = None
+
+    def json(self):
+        if self._json is None:
+            self._json = json.loads(self.text)
+
+        return self._json
+
+
+def check_status(response, asset_ticker, client_error_message="No data found"):
+    """
+    Raises the matching PolygonError if the request was not successful.
+    :param response: The response from the API.
+    :param asset_ticker: The ticker of the asset.
+    :param client_error_message: The message to display if the client made an error.
+    """
+    status_code = response.status_code
+    if status_code == 429:
+        raise RateLimitError(f"Rate limit of Polygon.io reached while requesting {asset_ticker}", status_code)
+    if 400 <= status_code < 500:
+        raise PolygonError(f"{client_error_message} for {asset_ticker}", status_code)
+    if status_code >= 500:
+        raise PolygonError("Internal server error, please try again later", status_code)
+
+
+# Paths of the endpoints that contain a ticker or a date, they are grouped by their endpoint in the metrics.
+_ENDPOINTS = ((re.compile(r"^/v2/aggs/ticker/[^/]+/range/"), "aggregates"),
+              (re.compile(r"^/v2/aggs/grouped/"), "grouped_daily"),
+              (re.compile(r"^/v3/reference/tickers/[^/]+$"), "ticker_details"),
+              (re.compile(r"^/vX/reference/financials$"), "financials"),
+              (re.compile(r"^/v3/reference/dividends$"), "dividends"))
+
+
+def endpoint_name(url):
+    """
+    :return: The name of the endpoint of url, e.g. "aggregates" for "/v2/aggs/ticker/AAPL/range/1/day/...".
+    """
+    path = urlparse(url).path
+    for pattern, name in _ENDPOINTS:
+        if pattern.match(path):
+            return name
+
+    return path
+
+
+def api_url(path, api_key, **parameters):
+    """
+    Builds the URL of an endpoint.
+    :param path: The path of the endpoint, e.g. "/v3/reference/dividends".
+    :param api_key: The API key for Polygon.io.
+    :param parameters: Query parameters of the request.
+    :return: The URL as a string.
+    """
+    query = "&".join(f"{name}={value}" for name, value in parameters.items())
+    query = f"{query}&apiKey={api_key}" if query else f"apiKey={api_key}"
+
+    return f"{API_URL}{path}?{query}"
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    :return: The requests.Session shared by all threads of the process.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+
+    return _session
+
+
+def get(url):
+    """
+    Requests url through the shared session and the request scheduler.
+    :return: Response of the request.
+    """
+    def send():
+        start = time.perf_counter()
+        left = time_left()
+        response = get_session().get(url, timeout=TIMEOUT if left is None else min(TIMEOUT, left))
+        if metrics.ENABLED:
+            metrics.record_request(endpoint_name(url), response.status_code, time.perf_counter() - start,
+                                   len(response.content))
+        return Response(response.status_code, response.text, url, response.headers)
+
+    with tracing.span("GET", "http", endpoint=endpoint_name(url)) as attributes:
+        response = request_scheduler.execute(send)
+        if attributes is not None:
+            attributes["status"] = response.status_code
+
+    return response
+
+
+# One aiohttp session per event loop, a session can not be shared between loops.
+_async_sessions = weakref.WeakKeyDictionary()
+
+
+def get_async_session():
+    """
+    :return: The aiohttp.ClientSession of the running event loop.
+    """
+    import aiohttp  # Optional dependency, only needed for the asynchronous requests.
+
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=POOL_SIZE, limit_per_host=POOL_SIZE)
+        session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=TIMEOUT))
+        _async_sessions[loop] = session
+
+    return session
+
+
+async def get_async(url):
+    """
+    Requests url through the session of the running event loop and the request scheduler.
+    :return: Response of the request.
+    """
+    async def send():
+        start = time.perf_counter()
+        async with get_async_session().get(url) as response:
+            body = await response.read()
+            text = await response.text()  # Decodes the body that was read above.
+        if metrics.ENABLED:
+            metrics.record_request(endpoint_name(url), response.status, time.perf_counter() - start, len(body))
+        return Response(response.status, text, url, response.headers)
+
+    with tracing.span("GET", "http", endpoint=endpoint_name(url)) as attributes:
+        response = await request_scheduler.execute_async(send)
+        if attributes is not None:
+            attributes["status"] = response.status_code
+
+    return response
+
+
+async def close_async_session():
+    """
+    Closes the session of the running event loop.
+    """
+    session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+async def gather_bounded(coroutines, concurrency=8):
+    """
+    Awaits the coroutines with at most concurrency of them running at the same time.
+    :return: List of the results in the order of the coroutines.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_bounded(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run_bounded(coroutine) for coroutine in coroutines))
+
+
+def run(coroutine):
+    """
+    Runs a coroutine from synchronous code and closes the session of its event loop afterwards.
+    :return: The result of the coroutine.
+    """
+    async def run_and_close():
+        try:
+            return await coroutine
+        finally:
+            await close_async_session()
+
+    return asyncio.run(run_and_close())
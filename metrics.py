@@ -0,0 +1,180 @@
+"""
+Counters and histograms of the time spent on the requests to Polygon.io, the ratios and the callbacks of the dashboard.
+They are exposed in the text format of Prometheus on the route "/metrics" of the server of the dashboard.
+The metrics are only recorded if the environment variable "EQUITY_EXPLORER_METRICS" is set to "1". Otherwise timed
+returns the functions unchanged and the other functions return right away, so they cost close to nothing.
+"""
+
+import bisect
+import functools
+import inspect
+import os
+import threading
+import time
+
+
+ENABLED = os.getenv("EQUITY_EXPLORER_METRICS") == "1"
+
+# Upper bounds of the buckets of the histograms in seconds, the default buckets of the Prometheus clients.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+BYTE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+
+class Counter:
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}  # labels -> value, the labels are a sorted tuple of (name, value) pairs.
+
+    def add(self, labels, value):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(labels)} {value}" for labels, value in sorted(self.values.items())]
+
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, description, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [counts per bucket (the last one is +Inf), sum]
+
+    def add(self, labels, value):
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        counts[0][bisect.bisect_left(self.buckets, value)] += 1
+        counts[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+
+        return lines
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in labels)
+
+    return "{" + pairs + "}"
+
+
+# All metrics of the process, they are registered once at import.
+_metrics = {}
+_lock = threading.Lock()
+
+
+def counter(name, description):
+    _metrics[name] = Counter(name, description)
+
+
+def histogram(name, description, buckets=BUCKETS):
+    _metrics[name] = Histogram(name, description, buckets)
+
+
+counter("polygon_requests_total", "Requests sent to Polygon.io by endpoint and status code.")
+histogram("polygon_request_seconds", "Latency of the requests to Polygon.io by endpoint.")
+counter("polygon_response_bytes_total", "Bytes downloaded from Polygon.io by endpoint.")
+histogram("polygon_response_bytes", "Size of the responses of Polygon.io by endpoint.", BYTE_BUCKETS)
+histogram("parse_seconds", "Time to convert a response of Polygon.io into DataFrames by function.")
+histogram("ratio_seconds", "Time to calculate a ratio by function.")
+histogram("callback_seconds", "Wall time of a callback of the dashboard.")
+
+
+def observe(name, value, **labels):
+    """
+    Adds a value to the metric name, e.g. observe("ratio_seconds", 0.2, function="ep_ratio").
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        _metrics[name].add(tuple(sorted(labels.items())), value)
+
+
+def timed(name, **labels):
+    """
+    Decorator that records the wall time of every call in the histogram name, labelled with the name of the function.
+    The function is returned unchanged if the metrics are disabled.
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+        function_labels = {"function": func.__name__, **labels}
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def timed_coroutine(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe(name, time.perf_counter() - start, **function_labels)
+            return timed_coroutine
+
+        @functools.wraps(func)
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start, **function_labels)
+
+        return timed_function
+
+    return decorator
+
+
+def record_request(endpoint, status_code, seconds, size):
+    """
+    Records a request to Polygon.io, called by http_client for every attempt.
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        _metrics["polygon_requests_total"].add((("endpoint", endpoint), ("status", status_code)), 1)
+        _metrics["polygon_request_seconds"].add((("endpoint", endpoint),), seconds)
+        _metrics["polygon_response_bytes_total"].add((("endpoint", endpoint),), size)
+        _metrics["polygon_response_bytes"].add((("endpoint", endpoint),), size)
+
+
+def render():
+    """
+    :return: All metrics in the text format of Prometheus.
+    """
+    with _lock:
+        lines = [line for metric in _metrics.values() for line in metric.render()]
+
+    return "\n".join(lines) + "\n"
+
+
+def clear():
+    with _lock:
+        for metric in _metrics.values():
+            metric.values.clear()
+
+
+def register_route(server, path="/metrics"):
+    """
+    Adds the route of the metrics to the Flask server of the dashboard (app.server), if the metrics are enabled.
+    """
+    if not ENABLED:
+        return
+
+    def metrics_route():
+        return render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+    server.add_url_rule(path, "metrics", metrics_route)
@@ -0,0 +1,173 @@
+"""
+Portfolio construction on the aligned (date x ticker) return matrix of many tickers.
+The covariance matrix is estimated with Ledoit-Wolf shrinkage towards a scaled identity, which keeps it well
+conditioned even with hundreds of tickers and a single year of daily returns. From it the minimum-variance and the
+maximum-Sharpe weights and the efficient frontier are solved in closed form with one batched linear solve.
+Short positions are allowed. A maximum-Sharpe portfolio whose gross leverage (the sum of the absolute weights) exceeds
+MAX_LEVERAGE is not reported: the tangency weights explode when the excess returns of the tickers nearly cancel out.
+The estimate is kept in the response cache under a fingerprint of the prices and only recomputed if they change.
+"""
+
+import numpy as np
+import pandas as pd
+from . import tracing
+from .cache import response_cache, make_key
+
+
+TRADING_DAYS = 252
+MIN_OBSERVATIONS = 60  # Tickers with fewer daily returns are left out of the portfolio.
+FRONTIER_POINTS = 50
+MAX_LEVERAGE = 2.0  # Highest gross leverage of the maximum-Sharpe portfolio, e.g. 150% long and 50% short.
+
+
+def ledoit_wolf(returns):
+    """
+    Shrinks the sample covariance matrix towards a scaled identity with the optimal intensity of Ledoit and Wolf (2004).
+    :param returns: Array of shape (periods, tickers) without NaN.
+    :return: Tuple (covariance matrix, shrinkage intensity between 0 and 1).
+    """
+    periods, tickers = returns.shape
+    centered = returns - returns.mean(axis=0)
+    sample = centered.T @ centered / periods
+
+    target_scale = np.trace(sample) / tickers
+    distance = ((sample - target_scale * np.eye(tickers)) ** 2).sum() / tickers
+
+    # Variance of the sample covariance, from the squared norms of the rows: sum_t |x_t|^4 - T |S|^2.
+    squared_norms = (centered ** 2).sum(axis=1)
+    spread = ((squared_norms ** 2).sum() / periods - (sample ** 2).sum()) / (periods * tickers)
+
+    shrinkage = 0.0 if distance == 0 else min(max(spread / distance, 0.0), 1.0)
+    covariance = shrinkage * target_scale * np.eye(tickers) + (1 - shrinkage) * sample
+
+    return covariance, shrinkage
+
+
+def _fingerprint(price_matrix):
+    # Changes whenever a price or a date of the matrix changes.
+    return int(pd.util.hash_pandas_object(price_matrix, index=True).sum()) & 0xFFFFFFFFFFFFFFFF
+
+
+def get_covariance(price_matrix):
+    """
+    Estimates the annualized mean returns and the shrunk covariance matrix of the tickers of a price matrix.
+    :param price_matrix: DataFrame of closing prices with one column per ticker.
+    :return: Dictionary with the Series "mean", the DataFrame "covariance" and the float "shrinkage". Tickers with
+        less than MIN_OBSERVATIONS returns are left out, the remaining ones only use the dates where all have a return.
+    """
+    def estimate():
+        returns = price_matrix.pct_change(fill_method=None).iloc[1:]
+        returns = returns.loc[:, returns.notna().sum() >= MIN_OBSERVATIONS].dropna()
+        tickers = returns.columns
+        if len(tickers) == 0 or len(returns) < 2:
+            return {"mean": pd.Series(dtype=np.float64), "covariance": pd.DataFrame(), "shrinkage": pd.NA}
+
+        covariance, shrinkage = ledoit_wolf(returns.to_numpy(dtype=np.float64))
+        return {"mean": returns.mean() * TRADING_DAYS,
+                "covariance": pd.DataFrame(covariance * TRADING_DAYS, index=tickers, columns=tickers),
+                "shrinkage": shrinkage}
+
+    key = make_key(",".join(map(str, price_matrix.columns)), "covariance", prices=_fingerprint(price_matrix))
+
+    return response_cache.get_or_load(key, "prices", estimate)
+
+
+def _solve(covariance, mean, risk_free_rate):
+    """
+    Solves the covariance matrix for the vector of ones and the excess returns at once.
+    :return: Tuple of arrays (inverse covariance times ones, inverse covariance times excess returns).
+    """
+    right_hand_sides = np.column_stack([np.ones(len(mean)), mean - risk_free_rate])
+    solved = np.linalg.solve(covariance, right_hand_sides)
+
+    return solved[:, 0], solved[:, 1]
+
+
+def min_variance_weights(covariance):
+    """
+    :param covariance: Array of shape (tickers, tickers).
+    :return: Array of the weights of the portfolio with the lowest variance, they sum to 1.
+    """
+    inverse_ones = np.linalg.solve(covariance, np.ones(len(covariance)))
+
+    return inverse_ones / inverse_ones.sum()
+
+
+def max_sharpe_weights(mean, covariance, risk_free_rate=0.0538, max_leverage=MAX_LEVERAGE):
+    """
+    :param mean: Array of the expected returns.
+    :param covariance: Array of shape (tickers, tickers).
+    :param risk_free_rate: 53 Weeks T-Bill rate as of 2023-09-05
+    :param max_leverage: (Default value = MAX_LEVERAGE) Highest sum of the absolute weights.
+    :return: Array of the weights of the tangency portfolio, they sum to 1. NaN if no portfolio of weights summing to
+        1 earns more than the risk free rate or if its gross leverage exceeds max_leverage.
+    """
+    inverse_ones, inverse_excess = _solve(covariance, mean, risk_free_rate)
+    total = inverse_excess.sum()
+    # The gross leverage of the weights is |inverse_excess|.sum() / total, the check also keeps a total close to 0
+    # from being divided by.
+    if total <= 0 or np.abs(inverse_excess).sum() > max_leverage * total:
+        return np.full(len(mean), np.nan)
+
+    return inverse_excess / total
+
+
+def efficient_frontier(mean, covariance, target_returns):
+    """
+    Calculates the portfolios with the lowest variance for several target returns in closed form.
+    :param mean: Array of the expected returns.
+    :param covariance: Array of shape (tickers, tickers).
+    :param target_returns: Array of the target returns.
+    :return: Tuple of arrays (volatilities of shape (targets,), weights of shape (targets, tickers)).
+    """
+    inverse_ones, inverse_mean = _solve(covariance, mean, 0.0)
+    a = inverse_ones.sum()
+    b = inverse_mean.sum()
+    c = mean @ inverse_mean
+    d = a * c - b * b
+
+    # Every frontier portfolio is a combination of the two solved vectors.
+    target_returns = np.asarray(target_returns, dtype=np.float64)
+    weights = (np.outer(c - b * target_returns, inverse_ones) + np.outer(a * target_returns - b, inverse_mean)) / d
+    variances = (a * target_returns ** 2 - 2 * b * target_returns + c) / d
+
+    return np.sqrt(np.maximum(variances, 0.0)), weights
+
+
+@tracing.traced("portfolio")
+def optimize_portfolio(price_matrix, risk_free_rate=0.0538, points=FRONTIER_POINTS):
+    """
+    Builds the minimum-variance portfolio, the maximum-Sharpe portfolio and the efficient frontier of the tickers.
+    :param price_matrix: DataFrame of closing prices with one column per ticker.
+    :param risk_free_rate: 53 Weeks T-Bill rate as of 2023-09-05
+    :param points: (Default value = FRONTIER_POINTS) Number of portfolios on the frontier.
+    :return: Dictionary with the DataFrames "weights" (tickers x ["Min variance", "Max Sharpe"]), "frontier"
+        (columns "Return" and "Volatility"), "portfolios" (the return and volatility of both portfolios) and "assets"
+        (the return and volatility of every ticker). Empty if there are less than two tickers with enough returns.
+    """
+    estimate = get_covariance(price_matrix)
+    mean, covariance = estimate["mean"], estimate["covariance"]
+    if len(mean) < 2:
+        return {}
+
+    mean_values = mean.to_numpy()
+    covariance_values = covariance.to_numpy()
+    weights = pd.DataFrame({"Min variance": min_variance_weights(covariance_values),
+                            "Max Sharpe": max_sharpe_weights(mean_values, covariance_values, risk_free_rate)},
+                           index=mean.index)
+
+    portfolios = pd.DataFrame({"Return": weights.T.to_numpy() @ mean_values,
+                               "Volatility": np.sqrt(np.einsum("pi,ij,pj->p", weights.T.to_numpy(),
+                                                               covariance_values, weights.T.to_numpy()))},
+                              index=weights.columns)
+
+    # The frontier starts at the minimum-variance portfolio and ends at the highest expected return of a ticker.
+    lowest = portfolios.loc["Min variance", "Return"]
+    target_returns = np.linspace(lowest, max(lowest, mean_values.max()), points)
+    volatilities, _ = efficient_frontier(mean_values, covariance_values, target_returns)
+
+    return {"weights": weights,
+            "frontier": pd.DataFrame({"Return": target_returns, "Volatility": volatilities}),
+            "portfolios": portfolios,
+            "assets": pd.DataFrame({"Return": mean_values, "Volatility": np.sqrt(np.diag(covariance_values))},
+                                   index=mean.index)}
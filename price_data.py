@@ -1,8 +1,25 @@
+import asyncio
+import concurrent.futures
+import contextvars
 from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
-import requests
 import json
+from . import bulk_data
 from . import fundamental_data as f
+from . import http_client
+from . import metrics
+from . import price_store
+from . import tracing
+from .cache import response_cache, make_key
+
+try:
+    import orjson as json_decoder  # Optional dependency, decodes large responses several times faster.
+except ImportError:
+    json_decoder = json
+
+
+INTEGER_FIELDS = ("n",)  # Fields of the bars that are counts, they are kept as nullable integers.
 
 
 class Asset:
@@ -12,7 +29,7 @@ class Asset:
 
     def __init__(self, api_key, asset_ticker, asset_class,
                  start=(datetime.today() - timedelta(days=365)).strftime('%Y-%m-%d'),
-                 end=datetime.today().strftime('%Y-%m-%d'), frequency="day", limit=1000):
+                 end=datetime.today().strftime('%Y-%m-%d'), frequency="day", limit=50000, dtype="float64"):
         self.api_key = api_key
         self.asset_ticker = asset_ticker
         self.asset_class = asset_class
@@ -20,6 +37,7 @@ class Asset:
         self.end = end
         self.frequency = frequency
         self.limit = limit
+        self.dtype = dtype  # "float32" halves the memory of long minute series.
 
     # TODO Idea: It would be prettier if this function would be assigned to the Stock class directly.
     def get_fundamentals(self, show=False, aggregate=True, statement_type="balance_sheet"):
@@ -39,68 +57,249 @@ class Asset:
 
         return infos
 
-    def get_prices(self, show=False):
+    @tracing.traced("prices")
+    def get_prices(self, show=False, chunks=1):
         """
         This function retrieves the prices of a given asset
         :param show: (Default value = False) Print the response to the console
+        :param chunks: (Default value = 1) Split the date range into this many parts, that are requested in parallel.
+        :return:
+        """
+
+        # Daily stock bars are sliced from the market matrix, if one is active and covers the range.
+        market = bulk_data.market_matrix()
+        if (market is not None and self.asset_class == "Stock" and self.frequency == "day"
+                and self.asset_ticker in market and market.covers(self.start, self.end)):
+            data = _as_dtype(market.prices(self.asset_ticker, self.start, self.end), self.dtype)
+            if show: print(data)
+            return data
+
+        def request_pages(start, end):
+            # The pages are passed on one by one, only the parallel requests put all of them together first.
+            if chunks > 1:
+                return [self._request_prices_parallel(start, end, chunks)]
+            return self.iter_prices(start, end)
+
+        def request_prices():
+            # The store on disk is asked before Polygon.io, only the missing dates are requested.
+            store = price_store.default_store()
+            if store is None:
+                if chunks > 1:
+                    return self._request_prices_parallel(self.start, self.end, chunks)
+                return self._request_prices(self.start, self.end)
+
+            data = store.get_prices(self.asset_class, self.asset_ticker, self.frequency,
+                                    self.start, self.end, request_pages)
+
+            # The store keeps every column as float64.
+            return _as_dtype(data, self.dtype)
+
+        # The cache is asked first, the prices are only requested if they are missing or expired.
+        key = make_key(self.asset_ticker, "prices", asset_class=self.asset_class, start=self.start, end=self.end,
+                       frequency=self.frequency, limit=self.limit, dtype=self.dtype)
+        data = response_cache.get_or_load(key, "prices", request_prices)
+        if show: print(data)
+
+        return data
+
+    async def get_prices_async(self, show=False):
+        """
+        Asynchronous version of get_prices.
+        :param show: (Default value = False) Print the response to the console
         :return:
         """
 
+        # The store on disk works synchronously, so the request is moved to a thread in this case.
+        if price_store.default_store() is not None:
+            return await asyncio.to_thread(self.get_prices, show)
+
+        key = make_key(self.asset_ticker, "prices", asset_class=self.asset_class, start=self.start, end=self.end,
+                       frequency=self.frequency, limit=self.limit, dtype=self.dtype)
+        data = await response_cache.get_or_load_async(key, "prices",
+                                                      lambda: self._request_prices_async(self.start, self.end))
+        if show: print(data)
+
+        return data
+
+    def iter_prices(self, start=None, end=None):
+        """
+        Generator over the pages of bars between start and end, the "next_url" of every response is followed.
+        Only one page is held in memory at a time, so the pages can be processed or persisted as they arrive.
+        :param start: (Default value = None) First date as a string of the form YYYY-MM-DD, self.start if None.
+        :param end: (Default value = None) Last date as a string of the form YYYY-MM-DD, self.end if None.
+        :return: Generator of DataFrames of the bars indexed by their timestamp.
+        """
+        url = self._get_url(start or self.start, end or self.end)
+        while url:
+            response = http_client.get(url)
+            http_client.check_status(response, self.asset_ticker, "No prices found")
+            payload = json_decoder.loads(response.text)
+            yield _bars_to_frame(payload.get("results", []), dtype=self.dtype)
+            url = self._next_url(payload)
+
+    @tracing.traced("prices")
+    def _request_prices(self, start, end):
+        """
+        Requests the bars between start and end from Polygon.io, all pages included.
+        :param start: First date as a string of the form YYYY-MM-DD.
+        :param end: Last date as a string of the form YYYY-MM-DD.
+        :return: DataFrame of the bars indexed by their timestamp.
+        """
+        return _concat_pages(list(self.iter_prices(start, end)))
+
+    async def _request_prices_async(self, start, end):
+        pages = []
+        url = self._get_url(start, end)
+        while url:
+            response = await http_client.get_async(url)
+            http_client.check_status(response, self.asset_ticker, "No prices found")
+            payload = json_decoder.loads(response.text)
+            pages.append(_bars_to_frame(payload.get("results", []), dtype=self.dtype))
+            url = self._next_url(payload)
+
+        return _concat_pages(pages)
+
+    def _request_prices_parallel(self, start, end, chunks):
+        """
+        Splits the date range into chunks, that are requested in parallel and put together in order.
+        """
+        ranges = split_range(start, end, chunks)
+
+        # A pool per call instead of the shared one, get_prices itself might run in a worker of the shared pool and
+        # waiting there for other tasks of the same pool could block it. The context is copied into the threads, so
+        # that the lane of the request scheduler and the trace carry over.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, self._request_prices, range_start, range_end)
+                       for range_start, range_end in ranges]
+            pages = [future.result() for future in futures]
+
+        return _concat_pages(pages)
+
+    def _next_url(self, payload):
+        # The "next_url" of Polygon.io does not contain the API key.
+        next_url = payload.get("next_url")
+
+        return f"{next_url}&apiKey={self.api_key}" if next_url else None
+
+    def _get_url(self, start, end):
         # Create a dictionary of functions to call based on the asset class
-        asset_classes = {"Stock": self._get_stock_data,
-                         "Option": self._get_options_data,
-                         "Indices": self._get_indices_data,
-                         "Forex": self._get_forex_data
+        asset_classes = {"Stock": self._get_stock_url,
+                         "Option": self._get_options_url,
+                         "Indices": self._get_indices_url,
+                         "Forex": self._get_forex_url
                          }
 
         # Call the appropriate function based on the asset class
-        response = asset_classes[self.asset_class]()
+        return asset_classes[self.asset_class](start, end)
 
-        # Convert the response to a DataFrame
-        data = pd.DataFrame(json.loads(response)["results"])
-        data["t"] = data["t"].apply(lambda x: pd.to_datetime(x, unit="ms"))  # Convert the timestamp to pandas datetime
-        data = data.set_index("t")  # Set the index to the timestamp
-        data.sort_index(inplace=True)
-        if show: print(data)
+    def _get_stock_url(self, start, end):
+        return http_client.api_url(f"/v2/aggs/ticker/{self.asset_ticker}/range/1/{self.frequency}/{start}/{end}",
+                                   self.api_key, adjusted="true", sort="asc", limit=self.limit)
 
-        return data
+    def _get_options_url(self, start, end):
+        return http_client.api_url(f"/v2/aggs/ticker/O:{self.asset_ticker}/range/1/{self.frequency}/{start}/{end}",
+                                   self.api_key, adjusted="true", sort="asc", limit=self.limit)
+
+    def _get_indices_url(self, start, end):
+        return http_client.api_url(f"/v2/aggs/ticker/I:{self.asset_ticker}/range/1/{self.frequency}/{start}/{end}",
+                                   self.api_key, sort="asc", limit=self.limit)
+
+    def _get_forex_url(self, start, end):
+        return http_client.api_url(f"/v2/aggs/ticker/C:{self.asset_ticker}/range/1/{self.frequency}/{start}/{end}",
+                                   self.api_key, adjusted="true", sort="asc", limit=self.limit)
+
+
+def _to_frame(response, dtype="float64"):
+    """
+    Converts the text of an aggregates response to a DataFrame.
+    :param response: The body of the response.
+    :param dtype: (Default value = "float64") The type of the price and volume columns.
+    :return: DataFrame of the bars indexed by their timestamp.
+    """
+    return _bars_to_frame(json_decoder.loads(response).get("results", []), dtype=dtype)
+
+
+@metrics.timed("parse_seconds")
+def _bars_to_frame(bars, dtype="float64"):
+    """
+    Converts the "results" of an aggregates response to a DataFrame.
+    The bars are decoded column by column into typed arrays instead of building a DataFrame from a list of dicts.
+    :param bars: List of the bars as dictionaries.
+    :param dtype: (Default value = "float64") The type of the price and volume columns.
+    :return: DataFrame of the bars indexed by their timestamp.
+    """
 
-    def _get_stock_data(self):
-        url = (f"https://api.polygon.io/v2/aggs/ticker/{self.asset_ticker}"
-               f"/range/1/{self.frequency}"
-               f"/{self.start}/{self.end}?"
-               f"adjusted=true&sort=asc&limit={self.limit}&apiKey={self.api_key}")
+    # There are no "results" if no bars exist for the range.
+    if not bars:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name="t"))
 
-        response = requests.get(url)
+    count = len(bars)
+    # Bars may leave out fields, e.g. "vw" or "n" for bars without trades, so the columns are the union of all keys.
+    fields = [field for field in dict.fromkeys(field for bar in bars for field in bar)
+              if field != "t" and field not in INTEGER_FIELDS]
+    timestamps = np.fromiter((bar["t"] for bar in bars), dtype=np.int64, count=count)
+    values = np.empty((count, len(fields)), dtype=dtype)
+    for column, field in enumerate(fields):
+        values[:, column] = np.fromiter((bar.get(field, np.nan) for bar in bars), dtype=dtype, count=count)
 
-        return response.text
+    # Convert all timestamps with one call and set them as the index.
+    index = pd.to_datetime(timestamps, unit="ms")
+    index.name = "t"
+    data = pd.DataFrame(values, index=index, columns=fields, copy=False)
+    for field in INTEGER_FIELDS:
+        if any(field in bar for bar in bars):
+            missing = np.fromiter((field not in bar for bar in bars), dtype=bool, count=count)
+            counts = np.fromiter((bar.get(field, 0) for bar in bars), dtype=np.int64, count=count)
+            data[field] = pd.arrays.IntegerArray(counts, missing)
 
-    def _get_options_data(self):
-        url = (f"https://api.polygon.io/v2/aggs/ticker/O:{self.asset_ticker}"
-               f"/range/1/{self.frequency}"
-               f"/{self.start}/{self.end}?"
-               f"adjusted=true&sort=asc&limit={self.limit}&apiKey={self.api_key}")
+    # The bars are requested with sort=asc, the sort is only needed if the API did not keep to it.
+    if not index.is_monotonic_increasing:
+        data.sort_index(inplace=True)
 
-        response = requests.get(url)
+    return data
 
-        return response.text
 
-    def _get_indices_data(self):
-        url = (f"https://api.polygon.io/v2/aggs/ticker/I:{self.asset_ticker}"
-               f"/range/1/{self.frequency}"
-               f"/{self.start}/{self.end}?"
-               f"sort=asc&limit={self.limit}&apiKey={self.api_key}")
+def _as_dtype(data, dtype):
+    """
+    Converts the price and volume columns to dtype, the counts of INTEGER_FIELDS stay integers.
+    """
+    return data.astype({column: "Int64" if column in INTEGER_FIELDS else dtype for column in data.columns},
+                       copy=False)
 
-        response = requests.get(url)
 
-        return response.text
+def _concat_pages(pages):
+    pages = [page for page in pages if not page.empty]
+    if not pages:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name="t"))
+    if len(pages) == 1:
+        return pages[0]
 
-    def _get_forex_data(self):
-        url = (f"https://api.polygon.io/v2/aggs/ticker/C:{self.asset_ticker}"
-               f"/range/1/{self.frequency}"
-               f"/{self.start}/{self.end}?"
-               f"adjusted=true&sort=asc&limit={self.limit}&apiKey={self.api_key}")
+    return pd.concat(pages)
 
-        response = requests.get(url)
 
-        return response.text
+def split_range(start, end, chunks):
+    """
+    Splits the dates from start to end into consecutive ranges of about the same length.
+    :param start: First date as a string of the form YYYY-MM-DD.
+    :param end: Last date as a string of the form YYYY-MM-DD.
+    :param chunks: Number of ranges.
+    :return: List of tuples (start, end) of dates as strings.
+    """
+    first = datetime.strptime(start, "%Y-%m-%d")
+    days = (datetime.strptime(end, "%Y-%m-%d") - first).days + 1
+    chunks = max(1, min(chunks, days))
+    bounds = [first + timedelta(days=days * number // chunks) for number in range(chunks + 1)]
+
+    return [(bounds[number].strftime("%Y-%m-%d"), (bounds[number + 1] - timedelta(days=1)).strftime("%Y-%m-%d"))
+            for number in range(chunks)]
+
+
+def get_prices_many(assets, concurrency=8):
+    """
+    Requests the prices of several assets concurrently.
+    :param assets: List of Asset objects.
+    :param concurrency: (Default value = 8) Maximum number of requests running at the same time.
+    :return: List of DataFrames in the order of the assets.
+    """
+    return http_client.run(http_client.gather_bounded([asset.get_prices_async() for asset in assets],
+                                                      concurrency))
@@ -0,0 +1,337 @@
+"""
+Persistent store for price bars, so that Polygon.io is only asked for the dates that are not on disk yet.
+The bars are stored as memory-mapped NumPy arrays per asset class, ticker and frequency:
+
+    root / asset_class / ticker / frequency / meta.json           - the fields, the date range and the version
+                                              v-<id> / t.npy      - int64 timestamps in milliseconds
+                                                       values.npy - float64 matrix with one column per field
+
+The covered range is always contiguous, therefore a request only has to fill the dates before and after it.
+Every update writes its arrays to a new version folder and only then points meta.json to it with a single replace, so
+readers and crashes never see the arrays of different versions together.
+Updates of a ticker are serialized with a lock file in its directory, so that the dashboard and a report can share a
+store. Set the environment variable "EQUITY_EXPLORER_STORE" to a directory to enable the store for Asset.get_prices.
+"""
+
+import json
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl, msvcrt locks a byte of the file instead.
+    fcntl = None
+    import msvcrt
+
+
+CHUNK_ROWS = 2 ** 18  # Rows of values that are copied at once when the stored bars are merged with new pages.
+
+
+class PriceStore:
+
+    def __init__(self, root):
+        self.root = root
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def get_prices(self, asset_class, asset_ticker, frequency, start, end, request_pages):
+        """
+        Returns the bars between start and end and requests only the missing date ranges.
+        :param asset_class: The asset class, e.g. "Stock" or "Indices".
+        :param asset_ticker: The ticker of the asset.
+        :param frequency: The frequency of the bars, e.g. "day" or "minute".
+        :param start: First date as a string of the form YYYY-MM-DD.
+        :param end: Last date as a string of the form YYYY-MM-DD.
+        :param request_pages: Function (start, end) -> iterable of DataFrames, that requests the bars from Polygon.io
+            page by page in ascending order, e.g. Asset.iter_prices.
+        :return: DataFrame of the bars indexed by their timestamp.
+        """
+        unsettled = []
+        with self._lock(asset_class, asset_ticker, frequency):
+            coverage = self.coverage(asset_class, asset_ticker, frequency)
+            for gap_start, gap_end in missing_ranges(coverage, start, end):
+                if gap_start > _last_settled_day():
+                    # The bars of today are not final yet, they are returned without being stored.
+                    unsettled += [page for page in request_pages(gap_start, gap_end) if not page.empty]
+                    continue
+                self.append(asset_class, asset_ticker, frequency, request_pages(gap_start, gap_end),
+                            gap_start, gap_end)
+
+        data = self.read(asset_class, asset_ticker, frequency, start, end)
+        if not unsettled:
+            return data
+        # The stored bars of today are replaced by the ones just requested.
+        data = pd.concat(([] if data is None else [data]) + unsettled)
+
+        return data[~data.index.duplicated(keep="last")].sort_index()
+
+    def coverage(self, asset_class, asset_ticker, frequency):
+        """
+        :return: Tuple (start, end) of the dates on disk or None if nothing is stored.
+        """
+        meta = self._read_meta(asset_class, asset_ticker, frequency)
+        if meta is None:
+            return None
+
+        return meta["start"], meta["end"]
+
+    def read(self, asset_class, asset_ticker, frequency, start, end):
+        """
+        Reads the bars between start and end. The values are views of the memory-mapped files and are not copied.
+        :return: DataFrame of the bars indexed by their timestamp, None if nothing is stored.
+        """
+        meta, timestamps, values = self._load(asset_class, asset_ticker, frequency)
+        if meta is None:
+            return None
+
+        # The timestamps are sorted, so the slice can be found with a binary search.
+        first = np.searchsorted(timestamps, _to_ms(start), side="left")
+        last = np.searchsorted(timestamps, _to_ms(end) + 24 * 60 * 60 * 1000, side="left")
+
+        index = pd.to_datetime(timestamps[first:last], unit="ms")
+        index.name = "t"
+
+        return pd.DataFrame(values[first:last], index=index, columns=meta["columns"], copy=False)
+
+    def append(self, asset_class, asset_ticker, frequency, pages, start, end):
+        """
+        Merges new bars into the store and extends the covered range.
+        The pages are written to the new version folder as they arrive and are then merged with the stored bars into
+        memory-mapped arrays, so only one page and CHUNK_ROWS rows of values are held in memory at a time.
+        :param pages: DataFrame of the bars indexed by their timestamp or an iterable of such DataFrames.
+        :param start: First date that was requested for the pages.
+        :param end: Last date that was requested for the pages.
+        """
+        directory = self._directory(asset_class, asset_ticker, frequency)
+        meta, stored_timestamps, stored_values = self._load(asset_class, asset_ticker, frequency)
+        # The bars of today are not final yet, they are stored but not covered, so they are requested again next time.
+        end = min(end, _last_settled_day())
+        if meta is None and start > end:
+            return
+        if isinstance(pages, pd.DataFrame):
+            pages = [pages]
+
+        version = f"v-{uuid.uuid4().hex}"
+        version_directory = os.path.join(directory, version)
+        os.makedirs(version_directory)
+
+        # Parts in the order they are merged: (timestamps, values, columns) of the stored bars and of every page.
+        parts = []
+        columns = []
+        if meta is not None:
+            parts.append((stored_timestamps, stored_values, meta["columns"]))
+            columns = list(meta["columns"])
+            start = min(start, meta["start"])
+            end = max(end, meta["end"])
+        for number, page in enumerate(pages):
+            if page.empty:
+                continue
+            page_path = os.path.join(version_directory, f"page-{number}.npy")
+            np.save(page_path, page.to_numpy(np.float64, na_value=np.nan))
+            parts.append((np.asarray(page.index.as_unit("ms").asi8, dtype=np.int64),
+                          np.load(page_path, mmap_mode="r"), list(page.columns)))
+            columns += [column for column in page.columns if column not in columns]
+
+        # Only the timestamps are merged in memory. The most recent version of a bar is kept if it was requested
+        # twice, e.g. the bars of the last day, and the bars are sorted by their timestamp.
+        timestamps = np.concatenate([part[0] for part in parts]) if parts else np.empty(0, dtype=np.int64)
+        order = np.argsort(timestamps[::-1], kind="stable")
+        unique_timestamps, positions = np.unique(timestamps[::-1][order], return_index=True)
+        rows = (len(timestamps) - 1 - order[positions]) if len(timestamps) else positions
+
+        # The values of all parts are copied one after another and reordered only if the pages overlapped the
+        # stored bars or were out of order.
+        values_path = os.path.join(version_directory, "values.npy")
+        values = np.lib.format.open_memmap(values_path, mode="w+", dtype=np.float64,
+                                           shape=(len(timestamps), len(columns)))
+        offset = 0
+        for part_timestamps, part_values, part_columns in parts:
+            targets = [columns.index(column) for column in part_columns]
+            for first in range(0, len(part_timestamps), CHUNK_ROWS):
+                chunk = slice(offset + first, offset + min(first + CHUNK_ROWS, len(part_timestamps)))
+                values[chunk] = np.nan
+                values[chunk, targets] = part_values[first:first + CHUNK_ROWS]
+            offset += len(part_timestamps)
+        if not np.array_equal(rows, np.arange(len(timestamps))):
+            merged = values
+            values_path = os.path.join(version_directory, "merged.npy")
+            values = np.lib.format.open_memmap(values_path, mode="w+", dtype=np.float64,
+                                               shape=(len(rows), len(columns)))
+            for first in range(0, len(rows), CHUNK_ROWS):
+                values[first:first + CHUNK_ROWS] = merged[rows[first:first + CHUNK_ROWS]]
+            del merged
+        values.flush()
+        del values, parts
+        _sync(values_path)
+        os.replace(values_path, os.path.join(version_directory, "values.npy"))
+        for name in os.listdir(version_directory):
+            if name.startswith("page-") or name == "merged.npy":
+                os.remove(os.path.join(version_directory, name))
+
+        # The new version is complete on disk before meta.json points to it.
+        _save(os.path.join(version_directory, "t.npy"), unique_timestamps)
+        self._commit(directory, {"columns": columns, "start": start, "end": end, "version": version})
+
+    def _load(self, asset_class, asset_ticker, frequency):
+        """
+        :return: Tuple (meta, timestamps, values) of the current version with the arrays memory-mapped, (None, None,
+            None) if nothing is stored.
+        """
+        directory = self._directory(asset_class, asset_ticker, frequency)
+        for attempt in range(3):
+            meta = self._read_meta(asset_class, asset_ticker, frequency)
+            if meta is None:
+                return None, None, None
+            version_directory = os.path.join(directory, meta.get("version", ""))
+            try:
+                timestamps = np.load(os.path.join(version_directory, "t.npy"), mmap_mode="r")
+                values = np.load(os.path.join(version_directory, "values.npy"), mmap_mode="r")
+                return meta, timestamps, values
+            except FileNotFoundError:
+                # The version was replaced and removed between reading meta.json and opening its arrays.
+                if attempt == 2:
+                    raise
+
+    def _commit(self, directory, meta):
+        """
+        Points meta.json to a new version with a single replace and removes the older versions.
+        """
+        temporary_path = os.path.join(directory, f"meta.json.{uuid.uuid4().hex}.tmp")
+        with open(temporary_path, "w") as meta_file:
+            json.dump(meta, meta_file)
+            meta_file.flush()
+            os.fsync(meta_file.fileno())
+        os.replace(temporary_path, os.path.join(directory, "meta.json"))
+
+        # Readers that still map the arrays of an old version keep them until they are unmapped. Folders that can not
+        # be removed yet (Windows keeps mapped files) are removed by the next update.
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith("v-") and name != meta["version"]:
+                shutil.rmtree(path, ignore_errors=True)
+            elif name in ("t.npy", "values.npy"):  # Arrays of the layout before versions were introduced.
+                os.remove(path)
+
+    def _directory(self, asset_class, asset_ticker, frequency):
+        return os.path.join(self.root, asset_class, asset_ticker.replace(":", "_"), frequency)
+
+    def _read_meta(self, asset_class, asset_ticker, frequency):
+        path = os.path.join(self._directory(asset_class, asset_ticker, frequency), "meta.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as meta_file:
+            return json.load(meta_file)
+
+    @contextmanager
+    def _lock(self, asset_class, asset_ticker, frequency):
+        """
+        Serializes the updates of a ticker, within the process by a thread lock and across processes by a lock file.
+        """
+        with self._locks_lock:
+            thread_lock = self._locks.setdefault((asset_class, asset_ticker, frequency), threading.Lock())
+        with thread_lock, _file_lock(os.path.join(self._directory(asset_class, asset_ticker, frequency), ".lock")):
+            yield
+
+
+def missing_ranges(coverage, start, end):
+    """
+    Calculates the date ranges that have to be requested to extend the coverage to [start, end].
+    :param coverage: Tuple (start, end) of the dates on disk or None.
+    :return: List of tuples (start, end) of dates as strings.
+    """
+    if coverage is None:
+        return [(start, end)]
+
+    covered_start, covered_end = coverage
+    ranges = []
+    if start < covered_start:
+        ranges.append((start, _shift(covered_start, -1)))
+    if covered_end < end:
+        ranges.append((_shift(covered_end, 1), end))
+
+    return ranges
+
+
+def _last_settled_day():
+    # The last day whose bars are final.
+    return (date.today() - timedelta(days=1)).isoformat()
+
+
+def _shift(day, days):
+    return (date.fromisoformat(day) + timedelta(days=days)).isoformat()
+
+
+def _to_ms(day):
+    return int(pd.Timestamp(day).value // 1_000_000)
+
+
+@contextmanager
+def _file_lock(path):
+    # Blocks until no other process holds the lock, it is released when the file is closed.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after 10 seconds.
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _sync(path):
+    # Flushes a file written through a memory map to disk.
+    with open(path, "rb+") as array_file:
+        os.fsync(array_file.fileno())
+
+
+def _save(path, array):
+    # The array is flushed to disk before the version it belongs to is committed.
+    with open(path, "wb") as array_file:
+        np.save(array_file, array)
+        array_file.flush()
+        os.fsync(array_file.fileno())
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(root):
+    """
+    :return: The PriceStore of the directory, there is one per directory so that all callers share its locks.
+    """
+    root = os.path.abspath(root)
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = PriceStore(root)
+
+        return _stores[root]
+
+
+def default_store():
+    """
+    :return: The PriceStore configured through "EQUITY_EXPLORER_STORE" or None.
+    """
+    root = os.getenv("EQUITY_EXPLORER_STORE")
+    if not root:
+        return None
+
+    return get_store(root)
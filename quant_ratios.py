@@ -1,10 +1,19 @@
 from datetime import datetime, timedelta
 import numpy as np
-import statsmodels.api as sm
 import pandas as pd
 from .price_data import Asset
+from . import bulk_data
+from . import executor as ex
+from . import metrics
+from . import tracing
 
 
+TRADING_DAYS = 252
+ROLLING_WINDOWS = (30, 60, 90)  # Lengths of the rolling windows in trading days.
+
+
+@tracing.traced("ratio")
+@metrics.timed("ratio_seconds")
 def get_capm(api_key, asset_ticker, freq=1):
     """
     Function to fetch the alpha and beta value for give ticker.
@@ -29,6 +38,8 @@ def get_capm(api_key, asset_ticker, freq=1):
 
     concatenated_returns = pd.concat([asset_returns, spx_returns], axis=1).dropna()
 
+    import statsmodels.api as sm  # Imported on first use, it takes longer to import than the rest of the package.
+
     market_portfolio = sm.add_constant(concatenated_returns["SPX"])
     stock_returns = concatenated_returns[asset_ticker]
     model = sm.OLS(stock_returns, market_portfolio).fit()
@@ -36,6 +47,8 @@ def get_capm(api_key, asset_ticker, freq=1):
     return model.params
 
 
+@tracing.traced("ratio")
+@metrics.timed("ratio_seconds")
 def get_realized_volatility(api_key, asset_ticker, freq=1):
     """
     Calculate the realized volatility for the last 365 days including weekends and holidays for the given ticker.
@@ -52,6 +65,8 @@ def get_realized_volatility(api_key, asset_ticker, freq=1):
     return asset_returns.std() * np.sqrt(252)  # TODO Does it really make sense to normalize the volatility with sqrt(252) ?
 
 
+@tracing.traced("ratio")
+@metrics.timed("ratio_seconds")
 def get_sharpe_ratio(api_key, assert_ticker, risk_free_rate=0.0538):
     """
     Calculate the current sharpe ratio of the given ticker
@@ -68,3 +83,204 @@ def get_sharpe_ratio(api_key, assert_ticker, risk_free_rate=0.0538):
     sharpe_ratio = (asset_return - risk_free_rate) / asset_volatility
 
     return sharpe_ratio
+
+
+@tracing.traced("prices")
+def get_price_matrix(api_key, asset_tickers, benchmark="SPX"):
+    """
+    Fetch the closing prices of several tickers and the benchmark, the benchmark is only requested once.
+    :param api_key: key for the Polygon.io API
+    :param asset_tickers: list of tickers as strings
+    :param benchmark: (Default value = "SPX") index the tickers are compared with
+    :return: DataFrame of the closing prices with one column per ticker and the benchmark as the last column
+    """
+    def get_closing_prices(ticker, asset_class):
+        prices = Asset(api_key, ticker, asset_class).get_prices()["c"]
+        prices.index = prices.index.normalize()
+        return prices
+
+    # Tickers of an active market matrix are sliced from it, the others are requested concurrently.
+    # Tickers without prices are left empty.
+    prices = {}
+    window = Asset(api_key, benchmark, "Indices")
+    market = bulk_data.market_matrix()
+    if market is not None and market.covers(window.start, window.end):
+        prices.update(market.closes(asset_tickers, window.start, window.end).items())
+    tasks = {ticker: (get_closing_prices, (ticker, "Stock")) for ticker in asset_tickers if ticker not in prices}
+    tasks[benchmark] = (get_closing_prices, (benchmark, "Indices"))
+    prices.update(ex.run_tasks(tasks))
+
+    price_matrix = pd.concat(prices, axis=1) if prices else pd.DataFrame()
+
+    return price_matrix.reindex(columns=list(dict.fromkeys(list(asset_tickers) + [benchmark]))).sort_index()
+
+
+@tracing.traced("ratio")
+@metrics.timed("ratio_seconds")
+def get_quant_metrics(api_key, asset_tickers, freq=1, risk_free_rate=0.0538, benchmark="SPX", price_matrix=None):
+    """
+    Calculate alpha, beta, volatility and sharpe ratio of several tickers at once.
+    The regression of every ticker on the benchmark is solved in closed form over the whole return matrix.
+    :param api_key: key for the Polygon.io API
+    :param asset_tickers: list of tickers as strings
+    :param freq: frequency over how many periods the returns should be calculated
+    :param risk_free_rate: 53 Weeks T-Bill rate as of 2023-09-05
+    :param benchmark: (Default value = "SPX") index the tickers are compared with
+    :param price_matrix: (Default value = None) prices from get_price_matrix, they are requested if None is given
+    :return: DataFrame indexed by the tickers with the columns "Alpha", "Beta", "Volatility" and "Sharpe ratio"
+    """
+    if price_matrix is None:
+        price_matrix = get_price_matrix(api_key, asset_tickers, benchmark=benchmark)
+    price_matrix = price_matrix.reindex(columns=list(asset_tickers) + [benchmark])
+
+    returns = price_matrix.pct_change(periods=freq, fill_method=None).iloc[freq:].to_numpy(dtype=np.float64)
+    stock_returns = returns[:, :-1]
+    market_returns = returns[:, -1:]
+
+    alpha, beta = _regress_on_market(stock_returns, market_returns)
+
+    # Realized volatility of every column, missing returns are ignored.
+    with np.errstate(invalid="ignore", divide="ignore"):
+        volatility = np.nanstd(stock_returns, axis=0, ddof=1) * np.sqrt(TRADING_DAYS)
+
+        # Return from the first to the last available price of every column.
+        prices = price_matrix.to_numpy(dtype=np.float64)[:, :-1]
+        first_prices = _first_valid(prices)
+        last_prices = _first_valid(prices[::-1])
+        total_return = (last_prices - first_prices) / first_prices
+        sharpe_ratio = (total_return - risk_free_rate) / volatility
+
+    return pd.DataFrame({"Alpha": alpha, "Beta": beta, "Volatility": volatility, "Sharpe ratio": sharpe_ratio},
+                        index=pd.Index(asset_tickers, name="Ticker"))
+
+
+@tracing.traced("ratio")
+@metrics.timed("ratio_seconds")
+def get_rolling_metrics(api_key, asset_tickers, windows=ROLLING_WINDOWS, freq=1, risk_free_rate=0.0538, benchmark="SPX",
+                        price_matrix=None):
+    """
+    Calculate rolling alpha, beta, volatility and sharpe ratio of several tickers for several window lengths.
+    Every window is computed in one pass over the (time x ticker) return matrix from running sums of x, y, xy, x² and
+    y², instead of fitting a regression per window.
+    :param api_key: key for the Polygon.io API
+    :param asset_tickers: list of tickers as strings
+    :param windows: (Default value = ROLLING_WINDOWS) lengths of the windows in trading days
+    :param freq: frequency over how many periods the returns should be calculated
+    :param risk_free_rate: 53 Weeks T-Bill rate as of 2023-09-05
+    :param benchmark: (Default value = "SPX") index the tickers are compared with
+    :param price_matrix: (Default value = None) prices from get_price_matrix, they are requested if None is given
+    :return: dictionary window -> dictionary metric -> DataFrame (dates x tickers), the metrics are "Alpha", "Beta",
+        "Volatility" and "Sharpe ratio". The sharpe ratio is annualized from the mean return of the window.
+    """
+    if price_matrix is None:
+        price_matrix = get_price_matrix(api_key, asset_tickers, benchmark=benchmark)
+    price_matrix = price_matrix.reindex(columns=list(asset_tickers) + [benchmark])
+
+    returns = price_matrix.pct_change(periods=freq, fill_method=None).iloc[freq:]
+    dates = returns.index
+    returns = returns.to_numpy(dtype=np.float64)
+    stock_returns = returns[:, :-1]
+    market_returns = returns[:, -1:]
+    columns = pd.Index(asset_tickers, name="Ticker")
+
+    rolling_metrics = {}
+    for window in windows:
+        alpha, beta, volatility, mean_return = _rolling_moments(stock_returns, market_returns, window)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sharpe_ratio = (mean_return * TRADING_DAYS - risk_free_rate) / volatility
+        rolling_metrics[window] = {name: pd.DataFrame(values, index=dates, columns=columns)
+                                   for name, values in (("Alpha", alpha), ("Beta", beta),
+                                                        ("Volatility", volatility), ("Sharpe ratio", sharpe_ratio))}
+
+    return rolling_metrics
+
+
+def _window_sums(values, window):
+    """
+    :return: the sums of the last window rows for every row of values, computed from one cumulative sum
+    """
+    cumulative = np.concatenate([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+    sums = cumulative[window:] - cumulative[:-window]
+
+    # The first rows do not have a full window yet.
+    return np.concatenate([np.full((min(window - 1, len(values)), values.shape[1]), np.nan), sums])
+
+
+def _rolling_moments(stock_returns, market_returns, window):
+    """
+    Rolling regression of every column of stock_returns on market_returns and rolling volatility, O(n) per window.
+    Only windows where all returns of a column exist get a value.
+    :param stock_returns: array of shape (periods, tickers)
+    :param market_returns: array of shape (periods, 1)
+    :param window: length of the window in periods
+    :return: tuple of arrays (alpha, beta, annualized volatility, mean return) of shape (periods, tickers)
+    """
+    if len(stock_returns) < window:
+        empty = np.full(stock_returns.shape, np.nan)
+        return empty, empty, empty, empty
+
+    valid = ~np.isnan(stock_returns) & ~np.isnan(market_returns)
+
+    # The returns are centered before the sums are taken, so that the differences of the running sums do not lose
+    # precision. Alpha is shifted back afterwards, beta and the volatility do not change.
+    with np.errstate(invalid="ignore"):
+        x_center = np.nanmean(market_returns)
+        y_center = np.nanmean(stock_returns, axis=0)
+    x = np.where(valid, market_returns - x_center, 0.0)
+    y = np.where(valid, stock_returns - y_center, 0.0)
+
+    observations = _window_sums(valid.astype(np.float64), window)
+    sum_x = _window_sums(x, window)
+    sum_y = _window_sums(y, window)
+    sum_xy = _window_sums(x * y, window)
+    sum_xx = _window_sums(x * x, window)
+    sum_yy = _window_sums(y * y, window)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        complete = observations == window
+        beta = (window * sum_xy - sum_x * sum_y) / (window * sum_xx - sum_x * sum_x)
+        mean_y = sum_y / window
+        mean_x = sum_x / window
+        alpha = (mean_y + y_center) - beta * (mean_x + x_center)
+        variance = np.maximum(sum_yy - sum_y * sum_y / window, 0.0) / (window - 1)
+        volatility = np.sqrt(variance) * np.sqrt(TRADING_DAYS)
+        mean_return = mean_y + y_center
+
+    return tuple(np.where(complete, values, np.nan) for values in (alpha, beta, volatility, mean_return))
+
+
+def _regress_on_market(stock_returns, market_returns):
+    """
+    Ordinary least squares of every column of stock_returns on market_returns with an intercept.
+    Only the periods where both returns exist are used for a column.
+    :param stock_returns: array of shape (periods, tickers)
+    :param market_returns: array of shape (periods, 1)
+    :return: tuple of arrays (alpha, beta) with one value per ticker
+    """
+    valid = ~np.isnan(stock_returns) & ~np.isnan(market_returns)
+    observations = valid.sum(axis=0)
+
+    x = np.where(valid, market_returns, 0.0)
+    y = np.where(valid, stock_returns, 0.0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = x.sum(axis=0) / observations
+        y_mean = y.sum(axis=0) / observations
+        x_centered = np.where(valid, x - x_mean, 0.0)
+        y_centered = np.where(valid, y - y_mean, 0.0)
+
+        beta = (x_centered * y_centered).sum(axis=0) / (x_centered * x_centered).sum(axis=0)
+        alpha = y_mean - beta * x_mean
+
+    return alpha, beta
+
+
+def _first_valid(values):
+    """
+    :return: the first value of every column that is not NaN (NaN if there is none)
+    """
+    valid = ~np.isnan(values)
+    positions = valid.argmax(axis=0)
+    first = values[positions, np.arange(values.shape[1])]
+
+    return np.where(valid.any(axis=0), first, np.nan)
@@ -0,0 +1,223 @@
+"""
+Headless report of every ratio of fundamental_ratios and quant_ratios for a universe of tickers, e.g. for nightly runs
+over thousands of tickers without the dashboard.
+The tickers are processed in batches: the data of a batch is loaded concurrently in the worker pool of the executor,
+its rows are appended to the output and the batch is recorded in a checkpoint file next to the output. Only one batch
+is held in memory at a time, so the memory stays flat no matter how large the universe is. The output and the
+checkpoint are written once per batch, not per ticker: after a crash or a stalled run, the next run continues after
+the last recorded batch and calculates every ticker of the unfinished batch again. Tickers that could not be loaded
+are not recorded, so they are tried again by the next run.
+The requests wait for their turn without a timeout, as a batch under the rate limit can take much longer than a
+submission in the dashboard. The report runs in its own process, whose request scheduler does not know about the
+requests of a dashboard, so it only takes a share of the quota in "POLYGON_REQUESTS_PER_MINUTE" (see limit_quota) and
+leaves the rest to a dashboard that uses the same API key.
+
+The output is a CSV file, or a folder of Parquet files (one per batch) if its name ends with ".parquet". Parquet needs
+the optional dependency pyarrow.
+"""
+
+import json
+import os
+import time
+import pandas as pd
+from . import executor as ex
+from . import fundamental_ratios as fr
+from . import quant_ratios as qr
+from . import scheduler
+from .cache import response_cache
+from .dataset import load_dataset, parse_tickers
+
+
+BATCH_SIZE = 50  # Tickers per batch, it bounds the memory of the run.
+RATIO_TIMEOUT = 30  # Seconds a ratio may take to be calculated.
+QUOTA_SHARE = float(os.getenv("EQUITY_EXPLORER_REPORT_QUOTA_SHARE", "0.5"))  # Share of the quota of the report.
+QUANT_COLUMNS = ["Alpha", "Beta", "Volatility", "Sharpe ratio"]
+COLUMNS = ["Ticker", *fr.RATIOS, *QUANT_COLUMNS]
+
+
+def read_tickers(path):
+    """
+    :param path: Text file with the tickers, separated by everything except capital letters and digits, e.g. one
+        ticker per line.
+    :return: List of the tickers without duplicates.
+    """
+    with open(path) as file:
+        return parse_tickers(file.read())
+
+
+def limit_quota(share=QUOTA_SHARE):
+    """
+    Limits the requests of the process to a share of the quota in "POLYGON_REQUESTS_PER_MINUTE", without a quota the
+    requests stay unthrottled.
+    :param share: (Default value = QUOTA_SHARE) Share of the quota between 0 and 1.
+    """
+    quota = scheduler.requests_per_minute()
+    if quota:
+        scheduler.request_scheduler.set_quota(quota * share)
+
+
+def compute_rows(api_key, tickers, workers=None):
+    """
+    Loads the data of a batch of tickers and calculates all ratios.
+    :param api_key: The API key for Polygon.io.
+    :param tickers: List of tickers.
+    :param workers: (Default value = None) Tasks run at once, the shared worker pool of the executor if None.
+    :return: DataFrame with the columns of COLUMNS, one row per ticker whose prices could be loaded.
+    """
+    # Under the rate limit of Polygon.io the requests of a batch wait for their turn, so they get no timeout.
+    dataset = load_dataset(api_key, tickers, timeout=None, workers=workers)
+    # Without prices the request of the ticker failed, e.g. during an outage, it is tried again by the next run.
+    loaded = [ticker for ticker in tickers if ticker in dataset.stocks and dataset.stocks[ticker].prices is not None]
+    if not loaded:
+        return pd.DataFrame(columns=COLUMNS)
+
+    # Every (ticker, ratio) pair is its own task, a failed ratio only leaves its cell empty.
+    tasks = {(ticker, name): (ratio, (dataset.stocks[ticker],))
+             for ticker in loaded for name, ratio in fr.RATIOS.items()}
+    ratios = ex.run_tasks(tasks, timeout=RATIO_TIMEOUT, workers=workers)
+
+    # The quantitative ratios of the whole batch are calculated at once from its price matrix.
+    quant_metrics = qr.get_quant_metrics(None, loaded, price_matrix=dataset.price_matrix)
+
+    rows = []
+    for ticker in loaded:
+        row = {"Ticker": ticker, **quant_metrics.loc[ticker].to_dict()}
+        for name in fr.RATIOS:
+            row.update(ratios.get((ticker, name), {}))
+        rows.append(row)
+
+    rows = pd.DataFrame(rows).reindex(columns=COLUMNS)
+    rows[COLUMNS[1:]] = rows[COLUMNS[1:]].apply(pd.to_numeric, errors="coerce").astype("float64")
+
+    return rows
+
+
+class CsvOutput:
+    """
+    Appends the rows to a CSV file, the checkpoint holds the size of the file after each batch.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def restore(self, checkpoint):
+        # Rows written after the last recorded batch are cut off, they are calculated again.
+        position = checkpoint["position"] if checkpoint else 0
+        with open(self.path, "a+b") as file:
+            file.truncate(position)
+
+    def write(self, rows, batch):
+        """
+        :return: The position to record in the checkpoint.
+        """
+        with open(self.path, "a", newline="") as file:
+            rows.to_csv(file, header=file.tell() == 0, index=False)
+            file.flush()
+            os.fsync(file.fileno())
+            return file.tell()
+
+
+class ParquetOutput:
+    """
+    Writes the rows of every batch to their own Parquet file in a folder, that can be read as one table with
+    pd.read_parquet.
+    """
+
+    def __init__(self, path):
+        import pyarrow  # noqa: F401 Optional dependency, only needed for Parquet output.
+
+        self.path = path
+
+    def restore(self, checkpoint):
+        # Files of batches after the last recorded one are removed, they are calculated again.
+        os.makedirs(self.path, exist_ok=True)
+        last_batch = checkpoint["batch"] if checkpoint else -1
+        for name in os.listdir(self.path):
+            if name.startswith("part-") and int(name[5:].split(".")[0]) > last_batch:
+                os.remove(os.path.join(self.path, name))
+
+    def write(self, rows, batch):
+        """
+        :return: The position to record in the checkpoint.
+        """
+        if len(rows):
+            rows.to_parquet(os.path.join(self.path, f"part-{batch:06d}.parquet"), index=False)
+
+        return batch
+
+
+def read_checkpoint(path):
+    """
+    Reads the checkpoint file, one JSON line per finished batch. A line that was cut off by a crash is removed, so
+    that the next line starts on its own.
+    :param path: The checkpoint file.
+    :return: Tuple (set of the finished tickers, last complete line or None).
+    """
+    finished, last = set(), None
+    if not os.path.exists(path):
+        return finished, last
+    with open(path, "r+b") as file:
+        complete = 0
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            finished.update(record["tickers"])
+            last = record
+            complete += len(line)
+        file.truncate(complete)
+
+    return finished, last
+
+
+def run_report(api_key, tickers, output, batch_size=BATCH_SIZE, restart=False, workers=None):
+    """
+    Calculates the report of the tickers batch by batch and continues an earlier run of the same output.
+    :param api_key: The API key for Polygon.io.
+    :param tickers: List of tickers.
+    :param output: Path of the CSV file, or of the Parquet folder if it ends with ".parquet".
+    :param batch_size: (Default value = BATCH_SIZE) Tickers per batch.
+    :param restart: (Default value = False) Ignore the checkpoint and start over.
+    :param workers: (Default value = None) Tasks run at once, the shared worker pool of the executor if None.
+    :return: List of the tickers that could not be loaded.
+    """
+    writer = ParquetOutput(output) if output.endswith(".parquet") else CsvOutput(output)
+    checkpoint_path = output + ".checkpoint"
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    finished, last = read_checkpoint(checkpoint_path)
+    writer.restore(last)
+    batch = last["batch"] + 1 if last else 0
+    remaining = [ticker for ticker in tickers if ticker not in finished]
+    if finished:
+        print(f"Resuming after {len(finished)} finished tickers, {len(remaining)} remaining")
+
+    failed = []
+    with open(checkpoint_path, "a") as checkpoint, scheduler.lane(scheduler.BACKGROUND):
+        for start in range(0, len(remaining), batch_size):
+            batch_start = time.perf_counter()
+            batch_tickers = remaining[start:start + batch_size]
+            rows = compute_rows(api_key, batch_tickers, workers)
+            position = writer.write(rows, batch)
+
+            # The batch only counts as finished once its rows are written.
+            written = rows["Ticker"].tolist()
+            checkpoint.write(json.dumps({"batch": batch, "tickers": written, "position": position}) + "\n")
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+
+            failed.extend(sorted(set(batch_tickers) - set(written), key=batch_tickers.index))
+            # The responses of a batch are not needed again, dropping them keeps the memory flat.
+            response_cache.clear()
+            print(f"Batch {batch}: {start + len(batch_tickers)}/{len(remaining)} tickers in "
+                  f"{time.perf_counter() - batch_start:.1f} seconds, {len(failed)} failed so far")
+            batch += 1
+
+    if failed:
+        print(f"{len(failed)} tickers could not be loaded and are tried again by the next run: {', '.join(failed)}")
+
+    return failed
@@ -0,0 +1,161 @@
+"""
+Monte Carlo simulation of the value at risk (VaR), the conditional value at risk (CVaR) and the maximum drawdown of
+the tickers over a horizon of trading days.
+The paths are drawn either by bootstrapping whole days of the aligned returns, which keeps the correlation between the
+tickers and the fat tails of the returns, or from a multivariate normal distribution with the mean and the shrunk
+covariance of the returns. They are generated in blocks, whose size is derived from a fixed memory budget, so that
+the memory does not grow with the number of paths. Every block has its own seed spawned from one SeedSequence, the
+results only depend on the seed, the number of paths and the memory budget, not on the number of processes.
+Large runs are spread over the process pool of the executor, the workers read the returns from shared memory.
+The number of paths of the dashboard and the memory budget of a block can be set through the environment variables
+"EQUITY_EXPLORER_SIMULATION_PATHS" and "EQUITY_EXPLORER_SIMULATION_MEMORY_MB".
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from . import executor as ex
+from . import tracing
+from .portfolio import ledoit_wolf
+
+
+HORIZON = 21  # Trading days of the simulated paths, about one month.
+PATHS = int(os.getenv("EQUITY_EXPLORER_SIMULATION_PATHS", "10000"))
+LEVELS = (0.95, 0.99)
+# Bytes the paths of one block may take.
+MEMORY_BUDGET = int(os.getenv("EQUITY_EXPLORER_SIMULATION_MEMORY_MB", "64")) * 2 ** 20
+PARALLEL_PATHS = 200_000  # Runs with at least this many paths are spread over the process pool.
+MIN_OBSERVATIONS = 60  # Tickers with fewer daily returns are left out.
+
+
+def block_size(horizon, tickers, memory_budget=MEMORY_BUDGET):
+    """
+    :return: Number of paths per block, so that the paths of a block and their temporary copies fit the budget.
+    """
+    bytes_per_path = horizon * tickers * 8 * 3  # Returns, wealth and running maximum in float64.
+
+    return max(1, memory_budget // bytes_per_path)
+
+
+def _simulate_block(returns, method, mean, cholesky, seed, paths, horizon):
+    """
+    Simulates one block of paths.
+    :return: Tuple of float32 arrays (terminal returns, maximum drawdowns) of shape (paths, tickers).
+    """
+    rng = np.random.default_rng(seed)
+    tickers = returns.shape[1] if method == "bootstrap" else len(mean)
+    if method == "bootstrap":
+        # Whole days are drawn, so that the returns of the tickers on the same day stay together.
+        path_returns = returns[rng.integers(0, len(returns), size=(paths, horizon))]
+    else:
+        path_returns = mean + rng.standard_normal((paths, horizon, tickers)) @ cholesky.T
+
+    wealth = np.cumprod(1.0 + path_returns, axis=1)
+    peaks = np.maximum(np.maximum.accumulate(wealth, axis=1), 1.0)  # The paths start at a wealth of 1.
+    drawdowns = (1.0 - wealth / peaks).max(axis=1)
+
+    return (wealth[:, -1] - 1.0).astype(np.float32), drawdowns.astype(np.float32)
+
+
+def _simulate_shared_block(shared_name, shape, method, mean, cholesky, seed, paths, horizon):
+    # Runs in a worker process, the returns are read from shared memory instead of being pickled for every block.
+    shared = shared_memory.SharedMemory(name=shared_name)
+    returns = np.ndarray(shape, dtype=np.float64, buffer=shared.buf)
+    try:
+        return _simulate_block(returns, method, mean, cholesky, seed, paths, horizon)
+    finally:
+        del returns  # The buffer can only be closed once no array refers to it.
+        shared.close()
+
+
+def simulate_paths(returns, horizon=HORIZON, paths=PATHS, method="bootstrap", seed=0, memory_budget=MEMORY_BUDGET,
+                   parallel=None):
+    """
+    Simulates the paths of the tickers and keeps the terminal return and the maximum drawdown of every path.
+    :param returns: Array of the daily returns of shape (days, tickers) without NaN.
+    :param horizon: (Default value = HORIZON) Trading days of a path.
+    :param paths: (Default value = PATHS) Number of paths.
+    :param method: (Default value = "bootstrap") "bootstrap" or "normal".
+    :param seed: (Default value = 0) Seed of the SeedSequence the seeds of the blocks are spawned from.
+    :param memory_budget: (Default value = MEMORY_BUDGET) Bytes the paths of one block may take.
+    :param parallel: (Default value = None) Spread the blocks over the process pool, if None only for runs with at
+        least PARALLEL_PATHS paths.
+    :return: Tuple of float32 arrays (terminal returns, maximum drawdowns) of shape (paths, tickers).
+    """
+    if method not in ("bootstrap", "normal"):
+        raise Exception(f"Unknown simulation method {method}")
+    returns = np.ascontiguousarray(returns, dtype=np.float64)
+    tickers = returns.shape[1]
+
+    mean = cholesky = None
+    if method == "normal":
+        covariance, _ = ledoit_wolf(returns)
+        mean = returns.mean(axis=0)
+        cholesky = np.linalg.cholesky(covariance)
+
+    size = block_size(horizon, tickers, memory_budget)
+    sizes = [min(size, paths - start) for start in range(0, paths, size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    parallel = paths >= PARALLEL_PATHS if parallel is None else parallel
+
+    if not parallel or len(sizes) == 1:
+        blocks = [_simulate_block(returns, method, mean, cholesky, block_seed, block_paths, horizon)
+                  for block_seed, block_paths in zip(seeds, sizes)]
+    else:
+        shared = shared_memory.SharedMemory(create=True, size=max(returns.nbytes, 1))
+        try:
+            np.ndarray(returns.shape, dtype=np.float64, buffer=shared.buf)[:] = returns
+            tasks = {number: (_simulate_shared_block, (shared.name, returns.shape, method, mean, cholesky,
+                                                       block_seed, block_paths, horizon))
+                     for number, (block_seed, block_paths) in enumerate(zip(seeds, sizes))}
+            results = ex.run_tasks(tasks, cpu=True)
+        finally:
+            shared.close()
+            shared.unlink()
+        if len(results) != len(tasks):
+            raise Exception(f"{len(tasks) - len(results)} of {len(tasks)} simulation blocks failed")
+        blocks = [results[number] for number in range(len(tasks))]
+
+    return np.concatenate([block[0] for block in blocks]), np.concatenate([block[1] for block in blocks])
+
+
+def risk_metrics(terminal, drawdowns, tickers, levels=LEVELS):
+    """
+    :param terminal: Array of the terminal returns of shape (paths, tickers).
+    :param drawdowns: Array of the maximum drawdowns of shape (paths, tickers).
+    :param tickers: The tickers of the columns.
+    :param levels: (Default value = LEVELS) Confidence levels of VaR and CVaR.
+    :return: DataFrame indexed by the tickers with the columns "VaR 95%", "CVaR 95%", ... and "Median drawdown".
+        Losses and drawdowns are positive numbers.
+    """
+    columns = {}
+    for level in levels:
+        quantiles = np.quantile(terminal, 1 - level, axis=0)
+        tail = np.where(terminal <= quantiles, terminal, np.nan)
+        columns[f"VaR {level:.0%}"] = -quantiles
+        columns[f"CVaR {level:.0%}"] = -np.nanmean(tail, axis=0)
+    columns["Median drawdown"] = np.median(drawdowns, axis=0)
+
+    return pd.DataFrame(columns, index=pd.Index(tickers, name="Ticker")).astype(np.float64)
+
+
+@tracing.traced("simulation")
+def simulate_risk(price_matrix, horizon=HORIZON, paths=PATHS, method="bootstrap", seed=0, levels=LEVELS,
+                  memory_budget=MEMORY_BUDGET, parallel=None):
+    """
+    Simulates the risk of the tickers of a price matrix.
+    :param price_matrix: DataFrame of closing prices with one column per ticker.
+    :return: Dictionary with the DataFrame "metrics" (see risk_metrics) and the arrays "terminal" and "drawdowns"
+        with one column per ticker of the metrics. Empty if no ticker has enough returns.
+    """
+    returns = price_matrix.pct_change(fill_method=None).iloc[1:]
+    returns = returns.loc[:, returns.notna().sum() >= MIN_OBSERVATIONS].dropna()
+    if returns.shape[1] == 0 or len(returns) < 2:
+        return {}
+
+    terminal, drawdowns = simulate_paths(returns.to_numpy(), horizon, paths, method, seed, memory_budget, parallel)
+
+    return {"metrics": risk_metrics(terminal, drawdowns, returns.columns, levels),
+            "terminal": terminal,
+            "drawdowns": drawdowns}
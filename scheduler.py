@@ -0,0 +1,220 @@
+"""
+Central scheduler for all requests to Polygon.io.
+A token bucket keeps the requests within the quota of the plan, requests of the interactive lane (the dashboard) are
+served before the ones of the background lane (batch jobs), and responses with the status 429 or 5xx are retried with
+exponential backoff and jitter. A block can be given a deadline, e.g. a task of executor.run_tasks with a timeout, after
+which its requests are not sent anymore.
+The quota is set through the environment variable "POLYGON_REQUESTS_PER_MINUTE", without it the requests are not
+throttled (the paid plans of Polygon.io have no request limit).
+The token bucket and the lanes are kept in the memory of the process: the lanes order the requests of one process, and
+processes that share the quota of one API key, e.g. the dashboard and the report, each need their own share of it.
+"""
+
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_lane = contextvars.ContextVar("request_lane", default=INTERACTIVE)
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def lane(request_lane):
+    """
+    Runs the requests within the block in the given lane, e.g. "with lane(BACKGROUND):" for batch jobs.
+    The lane is passed on to the tasks submitted through executor.submit.
+    """
+    token = _lane.set(request_lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Bounds the requests within the block to seconds from now: requests that would be sent later raise TimeoutError
+    and the timeout of a request is cut to the time that is left. Like the lane, the deadline is passed on to the tasks
+    submitted through executor.submit.
+    :param seconds: Seconds until the deadline, no deadline if None.
+    """
+    token = _deadline.set(None if seconds is None else time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_left():
+    """
+    :return: Seconds until the deadline of the current block, None if it has none. Raises TimeoutError once the
+        deadline passed.
+    """
+    end = _deadline.get()
+    if end is None:
+        return None
+    left = end - time.monotonic()
+    if left <= 0:
+        raise TimeoutError("The deadline of the requests passed")
+
+    return left
+
+
+class TokenBucket:
+    """
+    Token bucket refilled with rate tokens per second up to capacity tokens.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """
+        :return: Seconds until the next token is available.
+        """
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RequestScheduler:
+
+    def __init__(self, requests_per_minute=None, burst=None, max_retries=5, base_delay=0.5, max_delay=30.0):
+        """
+        :param requests_per_minute: (Default value = None) Quota of the plan, no throttling if None.
+        :param burst: (Default value = None) Requests that may be sent at once, a second of the quota if None.
+        :param max_retries: (Default value = 5) Retries of a request answered with 429 or 5xx.
+        :param base_delay: (Default value = 0.5) Seconds to wait before the first retry, doubled for each retry.
+        :param max_delay: (Default value = 30.0) Upper bound of the wait before a retry.
+        """
+        self.bucket = None
+        self.set_quota(requests_per_minute, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self._waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._condition = threading.Condition()
+
+    def set_quota(self, requests_per_minute, burst=None):
+        """
+        Replaces the quota, e.g. to give a separate process a share of it.
+        :param requests_per_minute: Quota of the plan, no throttling if None.
+        :param burst: (Default value = None) Requests that may be sent at once, a second of the quota if None.
+        """
+        bucket = None
+        if requests_per_minute:
+            rate = requests_per_minute / 60
+            bucket = TokenBucket(rate, burst or max(1.0, rate))
+        self.bucket = bucket
+
+    def acquire(self, request_lane=None):
+        """
+        Blocks until the request may be sent. Waiting requests of a lower lane go first.
+        """
+        if self.bucket is None:
+            return
+        request_lane = _lane.get() if request_lane is None else request_lane
+
+        with self._condition:
+            self._waiting[request_lane] += 1
+            try:
+                while True:
+                    left = time_left()
+                    self.bucket.refill()
+                    ahead = any(count for other_lane, count in self._waiting.items() if other_lane < request_lane)
+                    if self.bucket.tokens >= 1 and not ahead:
+                        self.bucket.tokens -= 1
+                        return
+                    wait = max(self.bucket.wait_time(), 0.01)
+                    self._condition.wait(timeout=wait if left is None else min(wait, left))
+            finally:
+                self._waiting[request_lane] -= 1
+                self._condition.notify_all()
+
+    def retry_delay(self, attempt, response):
+        """
+        :return: Seconds to wait before the next attempt, the "Retry-After" header of the response is respected.
+        """
+        retry_after = (response.headers or {}).get("Retry-After")
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+
+        return delay / 2 + random.uniform(0, delay / 2)  # Jitter, so that waiting requests do not retry together.
+
+    def should_retry(self, response, attempt):
+        return attempt < self.max_retries and (response.status_code == 429 or response.status_code >= 500)
+
+    def execute(self, send, request_lane=None):
+        """
+        Sends a request within the quota and retries it on 429 or 5xx.
+        :param send: Function without arguments that sends the request and returns a http_client.Response.
+        :return: The last response.
+        """
+        request_lane = _lane.get() if request_lane is None else request_lane
+        attempt = 0
+        while True:
+            self.acquire(request_lane)
+            response = send()
+            if not self.should_retry(response, attempt):
+                return response
+            self._count_retry()
+            delay, left = self.retry_delay(attempt, response), time_left()
+            if left is not None and left <= delay:
+                return response  # The retry would be sent after the deadline.
+            time.sleep(delay)
+            attempt += 1
+
+    async def execute_async(self, send, request_lane=None):
+        """
+        Asynchronous version of execute.
+        :param send: Function without arguments that returns a coroutine sending the request.
+        :return: The last response.
+        """
+        request_lane = _lane.get() if request_lane is None else request_lane
+        attempt = 0
+        while True:
+            if self.bucket is not None:
+                await asyncio.to_thread(self.acquire, request_lane)
+            response = await send()
+            if not self.should_retry(response, attempt):
+                return response
+            self._count_retry()
+            await asyncio.sleep(self.retry_delay(attempt, response))
+            attempt += 1
+
+    def _count_retry(self):
+        with self._condition:
+            self.retries += 1
+
+
+def requests_per_minute():
+    """
+    :return: The quota from the environment variable "POLYGON_REQUESTS_PER_MINUTE" or None.
+    """
+    value = os.getenv("POLYGON_REQUESTS_PER_MINUTE")
+
+    return float(value) if value else None
+
+
+# The scheduler shared by all requests of the process.
+request_scheduler = RequestScheduler(requests_per_minute())
@@ -0,0 +1,285 @@
+"""
+Opt-in tracing of single requests of the dashboard, written as Chrome trace events.
+A trace records nested spans, with the ticker and the endpoint as attributes, from the callbacks down through Asset,
+the requests of fundamental_data and the ratios. Spans in worker threads are collected through the context variables
+that executor.submit passes on, spans in worker processes are sent back with the result of their task.
+
+Tracing is switched on for every request through the environment variable "EQUITY_EXPLORER_TRACE" set to "1", or for
+the requests of one page by opening the dashboard with the query flag "?trace=1". The traces are written to the folder
+in "EQUITY_EXPLORER_TRACE_DIR" (default "traces"). The callbacks that one click of a client fires share one JSON file,
+which is rewritten as every callback returns, so the callbacks that wait for the data another one loads show up next
+to it. The files can be opened in chrome://tracing, https://ui.perfetto.dev or https://www.speedscope.app for a flame
+graph.
+"""
+
+import concurrent.futures
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+
+ENABLED = os.getenv("EQUITY_EXPLORER_TRACE") == "1"
+TRACE_DIR = os.getenv("EQUITY_EXPLORER_TRACE_DIR", "traces")
+QUERY_FLAG = "trace=1"
+REQUEST_TTL = 60  # Seconds after its last callback until the trace of a click is closed.
+
+_trace = contextvars.ContextVar("trace", default=None)
+_no_span = nullcontext()
+_requests = {}  # Key of a click -> [Trace, time of its last callback], see _request_key.
+_requests_lock = threading.Lock()
+
+
+class Trace:
+    """
+    The spans of one request as a list of Chrome trace events.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.events = []
+        self.file_name = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10 ** 6}.json"
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._threads = set()
+
+    def add(self, name, category, start, duration, attributes):
+        """
+        Adds a finished span, start and duration are given in microseconds.
+        """
+        process, thread = os.getpid(), threading.get_ident()
+        event = {"name": name, "cat": category, "ph": "X", "ts": start, "dur": duration, "pid": process,
+                 "tid": thread, "args": attributes}
+        with self._lock:
+            if (process, thread) not in self._threads:
+                self._threads.add((process, thread))
+                self.events.append({"name": "thread_name", "ph": "M", "pid": process, "tid": thread,
+                                    "args": {"name": threading.current_thread().name}})
+            self.events.append(event)
+
+    def extend(self, events):
+        # Merges the spans recorded in a worker process.
+        with self._lock:
+            self.events.extend(events)
+
+    def write(self, folder=TRACE_DIR):
+        """
+        Writes the trace as Chrome trace-event JSON, a file written before is replaced by the current spans.
+        :return: The path of the file.
+        """
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, self.file_name)
+        temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        # Callbacks of the same click write one after another, so the file always ends up with all spans.
+        with self._write_lock:
+            with self._lock:
+                content = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+            with open(temporary_path, "w") as file:
+                json.dump(content, file, default=str)
+            os.replace(temporary_path, path)
+
+        return path
+
+
+def _now():
+    # Wall clock in microseconds, so that the spans of different processes line up.
+    return time.time_ns() // 1000
+
+
+def active():
+    """
+    :return: The trace of the current request or None.
+    """
+    return _trace.get()
+
+
+@contextmanager
+def _record(trace, name, category, attributes):
+    start = _now()
+    try:
+        yield attributes
+    finally:
+        trace.add(name, category, start, _now() - start, attributes)
+
+
+def span(name, category="function", **attributes):
+    """
+    Context manager that records a span within the current trace, e.g. "with span("GET", endpoint="aggregates"):".
+    Attributes can be added to the yielded dictionary until the span ends. Outside of a trace nothing is recorded.
+    """
+    trace = _trace.get()
+    if trace is None:
+        return _no_span
+
+    return _record(trace, name, category, attributes)
+
+
+def _ticker_of(signature, args, kwargs):
+    # The ticker of a call, taken from its arguments or from the Asset it is a method of.
+    if args and hasattr(args[0], "asset_ticker"):
+        return args[0].asset_ticker
+    try:
+        arguments = signature.bind_partial(*args, **kwargs).arguments
+    except TypeError:
+        return None
+    ticker = arguments.get("asset_ticker", arguments.get("ticker"))
+
+    return ticker if isinstance(ticker, str) else None
+
+
+def traced(category="function"):
+    """
+    Decorator that records a span for every call within a trace, with the ticker of the call as attribute.
+    Outside of a trace the function is called right away.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        name = func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def traced_coroutine(*args, **kwargs):
+                trace = _trace.get()
+                if trace is None:
+                    return await func(*args, **kwargs)
+                with _record(trace, name, category, {"ticker": _ticker_of(signature, args, kwargs)}):
+                    return await func(*args, **kwargs)
+            return traced_coroutine
+
+        @functools.wraps(func)
+        def traced_function(*args, **kwargs):
+            trace = _trace.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            with _record(trace, name, category, {"ticker": _ticker_of(signature, args, kwargs)}):
+                return func(*args, **kwargs)
+
+        return traced_function
+
+    return decorator
+
+
+def _requested():
+    # True if the page of the dashboard was opened with the query flag, the callbacks themselves are POST requests
+    # of the page, so the flag is found in their referrer.
+    try:
+        import flask
+    except ImportError:
+        return False
+    if not flask.has_request_context():
+        return False
+
+    return QUERY_FLAG in (flask.request.referrer or "") or flask.request.args.get("trace") == "1"
+
+
+def _request_key():
+    # The callbacks that one click fires are told apart from those of other clicks and clients by the address and
+    # user agent of the client and the n_clicks values among the inputs and states of the Dash request. None if the
+    # request has no n_clicks, e.g. for a zoom of a graph.
+    try:
+        import flask
+    except ImportError:
+        return None
+    if not flask.has_request_context():
+        return None
+
+    body = flask.request.get_json(silent=True) or {}
+    clicks = []
+    for item in body.get("inputs", []) + body.get("state", []):
+        for entry in item if isinstance(item, list) else [item]:  # Pattern-matching inputs come as lists.
+            if isinstance(entry, dict) and entry.get("property") == "n_clicks":
+                clicks.append((json.dumps(entry.get("id"), sort_keys=True), entry.get("value")))
+    if not clicks:
+        return None
+
+    return flask.request.remote_addr, flask.request.user_agent.string, tuple(sorted(clicks, key=str))
+
+
+def _trace_of_request(name):
+    """
+    :return: The trace shared by the callbacks of the current click, a new trace named after the callback if the
+        request can not be assigned to a click.
+    """
+    key = _request_key()
+    if key is None:
+        return Trace(name)
+
+    now = time.monotonic()
+    with _requests_lock:
+        for expired in [other for other, (_, last) in _requests.items() if now - last > REQUEST_TTL]:
+            del _requests[expired]
+        entry = _requests.setdefault(key, [Trace("request"), now])
+        entry[1] = now
+
+        return entry[0]
+
+
+def trace_callback(func):
+    """
+    Decorator for the callbacks of the dashboard: if tracing is switched on for the request, every span of the call
+    is recorded and written to the file of the click that fired it once the callback returns.
+    """
+    @functools.wraps(func)
+    def traced_callback(*args, **kwargs):
+        if not (ENABLED or _requested()) or _trace.get() is not None:
+            return func(*args, **kwargs)
+
+        trace = _trace_of_request(func.__name__)
+        token = _trace.set(trace)
+        try:
+            with _record(trace, func.__name__, "callback", {"arguments": [str(argument) for argument in args]}):
+                return func(*args, **kwargs)
+        finally:
+            _trace.reset(token)
+            print(f"Trace of {func.__name__} written to {trace.write()}")
+
+    return traced_callback
+
+
+def _run_in_worker(func, *args):
+    # Runs a task in a worker process within its own trace and returns its spans together with the result.
+    trace = Trace(func.__name__)
+    token = _trace.set(trace)
+    try:
+        with _record(trace, func.__name__, "process", {}):
+            result = func(*args)
+    finally:
+        _trace.reset(token)
+    trace.events.append({"name": "process_name", "ph": "M", "pid": os.getpid(), "tid": 0,
+                         "args": {"name": f"worker {os.getpid()}"}})
+
+    return result, trace.events
+
+
+def submit_to_process(pool, func, *args):
+    """
+    Submits a task to a process pool. Within a trace the spans of the task are merged into it once it is done.
+    :return: concurrent.futures.Future of the result of the task.
+    """
+    trace = _trace.get()
+    if trace is None:
+        return pool.submit(func, *args)
+
+    result = concurrent.futures.Future()
+    worker = pool.submit(_run_in_worker, func, *args)
+    result.worker_future = worker  # Tells executor.run_tasks when the task really starts running.
+
+    def merge(worker_future):
+        if worker_future.cancelled():
+            result.set_exception(concurrent.futures.CancelledError())
+        elif worker_future.exception() is not None:
+            result.set_exception(worker_future.exception())
+        else:
+            value, events = worker_future.result()
+            trace.extend(events)
+            result.set_result(value)
+
+    result.set_running_or_notify_cancel()
+    worker.add_done_callback(merge)
+
+    return result
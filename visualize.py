@@ -1,4 +1,5 @@
 import plotly
+from . import downsample
 
 
 def pretty_plot(func):
@@ -9,15 +10,34 @@ def pretty_plot(func):
     return set_parameters
 
 
+def line_trace(series, name, max_points=downsample.MAX_POINTS):
+    """
+    This function creates the line of a series, reduced to max_points points
+    :param series: Series of values indexed by time
+    :param name: Name of the line
+    :param max_points: Points to keep, all if None
+    :return: Scatter trace, or Scattergl if there are still many points
+    """
+    series = downsample.downsample_line(series, max_points)
+    trace_type = (plotly.graph_objects.Scattergl if len(series) > downsample.WEBGL_POINTS
+                  else plotly.graph_objects.Scatter)
+
+    return trace_type(x=series.index, y=series.to_numpy(), name=name)
+
+
 @pretty_plot
-def get_candles(data, title):
+def get_candles(data, title, max_points=downsample.MAX_POINTS):
     """
     This function plots the prices of a given asset
     :param data: DataFrame of prices
     :param title: Title of the plot
+    :param max_points: Candles to show, consecutive bars are aggregated if there are more
     :return:
     """
 
+    # Aggregate the bars to the resolution of the graph
+    data = downsample.downsample_ohlc(data, max_points)
+
     # Create the plotly figure
     fig = plotly.graph_objects.Figure()
 
@@ -39,21 +59,20 @@ def get_candles(data, title):
 
 
 @pretty_plot
-def get_line(data, title):
+def get_line(data, title, max_points=downsample.MAX_POINTS):
     """
     This function plots the prices of a given asset
     :param data: DataFrame of prices
     :param title: Title of the plot
+    :param max_points: Points of the line, it is downsampled if there are more
     :return:
     """
 
     # Create the plotly figure
     fig = plotly.graph_objects.Figure()
 
-    # Add the candlestick trace
-    fig.add_trace(plotly.graph_objects.Scatter(x=data.index,
-                                               y=data["c"],
-                                               name=title))
+    # Add the downsampled line
+    fig.add_trace(line_trace(data["c"], title, max_points))
 
     # Add the titles
     fig.update_layout(title=title,
@@ -64,28 +83,66 @@ def get_line(data, title):
     return fig
 
 
+def histogram_trace(left_edges, counts, name, bin_width=downsample.BIN_WIDTH):
+    """
+    This function creates the bars of a distribution that was binned on the server
+    :param left_edges: Left edges of the bins, see downsample.fixed_width_histogram
+    :param counts: Number of values in the bins
+    :param name: Name of the distribution
+    :return: Bar trace with one bar per bin that is not empty
+    """
+
+    return plotly.graph_objects.Bar(x=left_edges + bin_width / 2,
+                                    y=counts,
+                                    width=bin_width,
+                                    name=name,
+                                    opacity=0.7)
+
+
 @pretty_plot
-def get_histogram(data, title):
+def get_histogram(data, title, bin_width=downsample.BIN_WIDTH):
     """
-    This function plots the prices of a given asset
-    :param data: DataFrame of prices
+    This function plots the distribution of the values of a given asset
+    :param data: DataFrame of returns
     :param title: Title of the plot
+    :param bin_width: Width of the bins, they are counted on the server
     :return:
     """
 
     # Create the plotly figure
     fig = plotly.graph_objects.Figure()
 
-    # Add the candlestick trace
-    fig.add_trace(plotly.graph_objects.Histogram(x=data["c"],
-                                                 y=data["c"],
-                                                 name=title,
-                                                 opacity=0.7))
+    # Add the bars of the bins
+    left_edges, counts = downsample.fixed_width_histogram(data["c"], bin_width)
+    fig.add_trace(histogram_trace(left_edges, counts, title, bin_width))
 
     # Add the titles
     fig.update_layout(title=title,
                       yaxis_title="Count",
                       xaxis_title="Returns",
+                      barmode="overlay",
+                      bargap=0,
+                      )
+
+    return fig
+
+
+@pretty_plot
+def get_figure(traces, title, xaxis_title, yaxis_title):
+    """
+    This function plots several traces in one figure
+    :param traces: List of plotly traces
+    :param title: Title of the plot
+    :return:
+    """
+
+    # Create the plotly figure with all traces at once
+    fig = plotly.graph_objects.Figure(data=traces)
+
+    # Add the titles
+    fig.update_layout(title=title,
+                      yaxis_title=yaxis_title,
+                      xaxis_title=xaxis_title,
                       )
 
     return fig